@@ -1,78 +1,193 @@
-from flask import Flask, jsonify
+import importlib
+import os
+import threading
+from typing import Iterable, Union
+
+from flask import Flask, current_app, jsonify
 from flask_restful import Api
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, get_jwt_claims
 from marshmallow import ValidationError
-import os
 
+import commands
 from blacklist import BLACKLIST
-from resources.user import (
-    UserRegister,
-    User,
-    UserLogin,
-    UserLogout,
-    TokenRefresh,
-)
-from resources.item import Item, ItemList
-from resources.store import Store, StoreList
-from resources.confirmation import Confirmation, ConfirmationByUser
+from config import CONFIGS
+from db import db
+from libs import db_pool, metrics, sqlite
+from libs.change_feed import FEED_PATH, change_feed
+from libs.confirmation_sweeper import sweeper
+from libs.http_cache import http_cache
+from libs.mail_dispatcher import dispatcher
+from libs.profiler import profiler
+from libs.replicas import replicas
+from ma import ma
+from models.user import IDENTITY_LOOKUPS, UserModel
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("APP_SECRET_KEY")  # aka app.config['JWT_SECRET_KEY']
+jwt = JWTManager()  # doesn't create /auth endpoint
 
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
-# allow libraries to raise their own exceptions
-app.config["PROPAGATE_EXCEPTIONS"] = True
+# if True, throws the revoked token stuff
+@jwt.token_in_blacklist_loader
+def check_if_token_in_blacklist(decrypted_token):
+    return decrypted_token["jti"] in BLACKLIST
 
-app.config["JWT_BLACKLIST_ENABLED"] = True
 
-app.config["JWT_BLACKLIST_TOKEN_CHECKS"] = ["access", "refresh"]
+# access tokens carry the user's identity claims when JWT_EMBED_USER_CLAIMS is set
+@jwt.user_claims_loader
+def add_user_claims(identity):
+    if not current_app.config["JWT_EMBED_USER_CLAIMS"]:
+        return {}
+    claims = UserModel.find_identity(identity)
+    return {"user": claims} if claims else {}
 
 
-api = Api(app)
+# current_user of every authenticated request: the claims embedded in the token, else
+# the identity cache, else the users table; None (user deleted) is answered with a 401
+@jwt.user_loader_callback_loader
+def load_user(identity):
+    claims = get_jwt_claims().get("user")
+    if claims is not None and claims["id"] == identity:
+        IDENTITY_LOOKUPS.inc(source="token")
+        return claims
+    return UserModel.find_identity(identity)
 
 
 # Flask can set app level error handlers
-@app.errorhandler(ValidationError)
 def handle_marshmallow_validation(err):
     return jsonify(err.messages), 400
 
 
-jwt = JWTManager(app)  # doesn't create /auth endpoint
+def add_lazy_resource(
+    api: Api, target: str, url: str, endpoint: str, methods: Iterable[str]
+) -> None:
+    # registers the url rule (so url_for works from the start) but imports the
+    # "module.Class" resource only when the first request for it comes in
+    view = None
+    lock = threading.Lock()
+
+    def load():
+        nonlocal view
+        with lock:
+            if view is None:
+                module, name = target.rsplit(".", 1)
+                resource = getattr(importlib.import_module(module), name)
+                resource.mediatypes = api.mediatypes_method()
+                resource.endpoint = endpoint
+                view = resource.as_view(endpoint)
+        return view
+
+    def lazy_view(*args, **kwargs):
+        return (view or load())(*args, **kwargs)
+
+    api.endpoints.add(endpoint)
+    api.app.add_url_rule(url, endpoint, api.output(lazy_view), methods=list(methods))
+
+
+def register_resources(api: Api) -> None:
+    from resources.user import (
+        UserRegister,
+        User,
+        UserLogin,
+        UserLogout,
+        TokenRefresh,
+    )
+    from resources.item import Item, ItemList, ItemImport
+    from resources.store import Store, StoreList, StoreStats
+    from resources.change_feed import ChangeFeed
+
+    api.add_resource(Item, "/item/<string:name>")
+    api.add_resource(Store, "/store/<string:name>")
+    api.add_resource(ItemList, "/items")
+    api.add_resource(ItemImport, "/items/import")
+    api.add_resource(StoreList, "/stores")
+    api.add_resource(StoreStats, "/stores/stats")
+    api.add_resource(UserRegister, "/register")
+    api.add_resource(User, "/user/<int:user_id>")
+    api.add_resource(UserLogin, "/login")
+    api.add_resource(UserLogout, "/logout")
+    api.add_resource(TokenRefresh, "/refresh")
+    api.add_resource(ChangeFeed, FEED_PATH)
+    # rarely requested, imported on first use; "confirmation" is the endpoint name
+    # send_confirmation_email builds its link from
+    add_lazy_resource(
+        api,
+        "resources.confirmation.Confirmation",
+        "/user_confirmation/<string:confirmation_id>",
+        "confirmation",
+        ["GET"],
+    )
+    add_lazy_resource(
+        api,
+        "resources.confirmation.ConfirmationByUser",
+        "/confirmation/user/<int:user_id>",
+        "confirmationbyuser",
+        ["GET", "POST"],
+    )
+    add_lazy_resource(
+        api,
+        "resources.profiler.Profile",
+        "/admin/profile",
+        "profile",
+        ["GET", "POST", "DELETE"],
+    )
+    add_lazy_resource(
+        api,
+        "resources.profiler.ProfileResult",
+        "/admin/profile/<string:session_id>",
+        "profileresult",
+        ["GET"],
+    )
+
+
+def create_app(config: Union[str, type, None] = None) -> Flask:
+    # config is a class from config.py or its name, defaults to $APP_CONFIG
+    # tables are not created here, run `flask init-db` once per deployment
+    if config is None or isinstance(config, str):
+        config = CONFIGS[config or os.environ.get("APP_CONFIG", "production")]
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    # pool size, overflow, timeout, recycle and pre-ping from DB_POOL_* environment variables
+    db_pool.init_app(app)
+    # WAL, pragmas and BEGIN IMMEDIATE for writes when DATABASE_URL is a SQLite file
+    sqlite.init_app(app)
+    db.init_app(app)
+    # optional read replicas for the read-only GETs, from DATABASE_REPLICA_URLS
+    replicas.init_app(app)
+    ma.init_app(app)
 
+    api = Api(app)
+    register_resources(api)
 
-# if True, throws the revoked token stuff
-@jwt.token_in_blacklist_loader
-def check_if_token_in_blacklist(decrypted_token):
-    return decrypted_token["jti"] in BLACKLIST
+    # one-off maintenance and migration commands for the flask cli
+    commands.init_app(app)
 
+    # per route latency, SQL and serialization timings, served on /metrics
+    metrics.init_app(app)
 
-api.add_resource(Item, "/item/<string:name>")
-api.add_resource(Store, "/store/<string:name>")
-api.add_resource(ItemList, "/items")
-api.add_resource(StoreList, "/stores")
-api.add_resource(UserRegister, "/register")
-api.add_resource(User, "/user/<int:user_id>")
-api.add_resource(UserLogin, "/login")
-api.add_resource(UserLogout, "/logout")
-api.add_resource(TokenRefresh, "/refresh")
-api.add_resource(Confirmation, "/user_confirmation/<string:confirmation_id>")
-api.add_resource(ConfirmationByUser, "/confirmation/user/<int:user_id>")
+    # sampling profiles of the request threads, started on /admin/profile
+    profiler.init_app(app)
 
-# python assigns this name if you run it as entry point into the program
-if __name__ == "__main__":
-    from db import db
-    from ma import ma
+    # ETags, 304s and compressed bodies for the item and store GETs
+    http_cache.init_app(app)
 
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URI")
+    app.register_error_handler(ValidationError, handle_marshmallow_validation)
+    jwt.init_app(app)
 
-    db.init_app(app)
-    ma.init_app(app)
+    # background mail sending and confirmation cleanup, started on the first request
+    dispatcher.init_app(app)
+    sweeper.init_app(app)
+    # item and store changes streamed on /changes, polled by the first subscriber
+    change_feed.init_app(app)
+    return app
+
+
+# python assigns this name if you run it as entry point into the program
+if __name__ == "__main__":
+    app = create_app("development")
 
-    # creates database tables presumably based on model info
-    @app.before_first_request
-    def create_tables():
+    # convenient locally, deployments run `flask init-db` instead
+    with app.app_context():
         db.create_all()
 
     app.run(port=5000, debug=True)
@@ -0,0 +1,7 @@
+from app import create_app
+from libs.asgi import AsgiApp
+
+# ASGI entry point next to run.py, e.g. `uvicorn asgi:app --workers 2`, configured by
+# APP_CONFIG like run.py; needs a2wsgi and an ASGI server, httpx for async mail sends
+# (pip install -r requirements_dev.txt, the deployed Pipfile leaves them out)
+app = AsgiApp(create_app())
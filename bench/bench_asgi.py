@@ -0,0 +1,196 @@
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+import requests
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import (
+    ROOT,
+    boot_app,
+    configure_env,
+    environment,
+    run_concurrent,
+    write_report,
+)
+from bench.load_test import Context, scenarios, seed
+from bench.mail_stub import MailgunStub
+
+# scenarios that can be repeated at every concurrency level, the write scenarios of
+# load_test.py use up seeded rows
+DEFAULT_SCENARIOS = "item_get,items_page,store_get,login"
+
+
+class FreshConnections(Context):
+    # a new connection for every request, as nginx talks to uwsgi in production;
+    # uwsgi's http socket closes connections a keep-alive client would reuse
+    @property
+    def http(self):
+        return requests
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def uwsgi_command(port: int, processes: int, threads: int) -> List[str]:
+    # uwsgi.ini with an http socket instead of the nginx unix socket, the shared
+    # caches and their env switches are taken from it as they are
+    command = [
+        shutil.which("uwsgi") or "uwsgi",
+        "--http-socket",
+        f"127.0.0.1:{port}",
+        "--module",
+        "run",
+        "--callable",
+        "app",
+        "--master",
+        "--processes",
+        str(processes),
+        "--threads",
+        str(threads),
+        "--harakiri",
+        "15",
+        "--die-on-term",
+        "--disable-logging",
+    ]
+    with open(os.path.join(ROOT, "uwsgi.ini")) as f:
+        for line in f:
+            key, _, value = line.partition("=")
+            if key.strip() in ("cache2", "env"):
+                command += [f"--{key.strip()}", value.strip()]
+    return command
+
+
+def uvicorn_command(port: int, processes: int, threads: int) -> List[str]:
+    return [
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "asgi:app",
+        "--port",
+        str(port),
+        "--workers",
+        str(processes),
+        "--log-level",
+        "warning",
+        "--no-access-log",
+    ]
+
+
+SERVERS = OrderedDict([("uwsgi", uwsgi_command), ("asgi", uvicorn_command)])
+
+
+def start_server(command: List[str], base_url: str, env: Dict) -> subprocess.Popen:
+    process = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + "/items?limit=1", timeout=1)
+            return process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{command[0]} did not come up on {base_url}")
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="The same scenarios against uwsgi (run.py, uwsgi.ini settings) and "
+        "the ASGI entry point (asgi.py under uvicorn) at rising concurrency."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8, help="uwsgi threads")
+    parser.add_argument(
+        "--asgi-threads", type=int, help="ASGI_THREADS, defaults to the pool size"
+    )
+    parser.add_argument("--concurrency", default="8,64,256")
+    parser.add_argument("--requests", type=int, default=2000, help="per scenario")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument(
+        "--mail-delay", type=float, default=0.0, help="seconds the Mailgun stub waits"
+    )
+    parser.add_argument("--output", default="bench_asgi.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    stub = MailgunStub(delay=args.mail_delay).start()
+    configure_env(database_url, stub.api_base)
+    if args.asgi_threads:
+        os.environ["ASGI_THREADS"] = str(args.asgi_threads)
+
+    app = boot_app()
+    ctx = FreshConnections("", args.requests)
+    seed(app, ctx, users=200, stores=20, items_per_store=100)
+    env = {**os.environ, "PYTHONPATH": ROOT}
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    wanted = args.scenarios.split(",")
+    results = OrderedDict()
+    for server in args.servers.split(","):
+        port = free_port()
+        ctx.base_url = f"http://127.0.0.1:{port}"
+        process = start_server(
+            SERVERS[server](port, args.processes, args.threads), ctx.base_url, env
+        )
+        try:
+            selected = scenarios(ctx)
+            for name in wanted:
+                for level in levels:
+                    key = f"{server}:{name}:{level}"
+                    results[key] = r = run_concurrent(
+                        selected[name], args.requests, level
+                    )
+                    print(
+                        f"{key:<28} {r['throughput_rps']:>9.1f} req/s  "
+                        f"p50 {r['p50_ms']:>8.2f}ms  p99 {r['p99_ms']:>8.2f}ms  "
+                        f"errors {r['errors']}"
+                    )
+        finally:
+            process.terminate()
+            process.wait(30)
+
+    stub.stop()
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {
+                "database": database_url.split(":")[0],
+                "processes": args.processes,
+                "threads": args.threads,
+                "asgi_threads": args.asgi_threads,
+                "requests": args.requests,
+            },
+            "scenarios": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import os
+import re
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import requests
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.bench_asgi import SERVERS, free_port, start_server
+from bench.common import (
+    ROOT,
+    boot_app,
+    configure_env,
+    environment,
+    percentile,
+    write_report,
+)
+from bench.load_test import Context, seed
+from bench.mail_stub import MailgunStub
+
+EVENT_ID = re.compile(rb"^id: (\d+)$")
+
+
+class Subscriber:
+    # an EventSource on raw HTTP/1.1 connections to /changes: reconnects a second after
+    # a response ends (every request under uwsgi) with the last id it saw, and
+    # records when each event id arrived
+    def __init__(self, port: int, token: str):
+        self.port = port
+        self.token = token
+        self.connected = False
+        self.last_id = None
+        self.received: Dict[int, float] = {}
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            if not await self._request(stop):
+                return
+            try:
+                await asyncio.wait_for(stop.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _request(self, stop: asyncio.Event) -> bool:
+        # False when the server refused the connection or the request
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        except OSError:
+            return False
+        resume = (
+            f"Last-Event-ID: {self.last_id}\r\n" if self.last_id is not None else ""
+        )
+        writer.write(
+            (
+                f"GET /changes HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+                f"Authorization: Bearer {self.token}\r\n{resume}"
+                f"Accept: text/event-stream\r\nConnection: close\r\n\r\n"
+            ).encode()
+        )
+        try:
+            status = await reader.readline()
+            if b" 200 " not in status:
+                return False
+            self.connected = True
+            seq = None
+            while not stop.is_set():
+                line = await reader.readline()
+                if not line:
+                    return True
+                line = line.rstrip(b"\r\n")
+                match = EVENT_ID.match(line)
+                if match:
+                    seq = self.last_id = int(match.group(1))
+                elif seq is not None and line.startswith(b"event: "):
+                    # a bare id only moves the client, an event is a change
+                    self.received[seq] = time.perf_counter()
+                    seq = None
+            return True
+        except (OSError, asyncio.IncompleteReadError):
+            return False
+        finally:
+            writer.close()
+
+
+def server_stats(pid: int) -> Dict[str, int]:
+    # threads and resident memory of the server and its worker processes
+    pids, threads, rss_kb = [pid], 0, 0
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads += int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids += [int(child) for child in f.read().split()]
+        except OSError:
+            continue
+    return {"threads": threads, "rss_mb": rss_kb // 1024}
+
+
+async def run_feed(
+    ctx: Context,
+    port: int,
+    pid: int,
+    subscribers: int,
+    writes: int,
+    interval: float,
+    first_price: float,
+) -> Dict:
+    stop = asyncio.Event()
+    clients = [Subscriber(port, ctx.access_token) for _ in range(subscribers)]
+    tasks = [asyncio.ensure_future(client.run(stop)) for client in clients]
+    # give every client time to connect and the server time to accept them
+    deadline = time.perf_counter() + 15
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.5)
+        if sum(client.connected for client in clients) == subscribers:
+            break
+    connected = [client for client in clients if client.connected]
+    streaming = server_stats(pid)
+
+    def write(i: int) -> bool:
+        # a threaded server with every thread streaming has none left for writes
+        try:
+            return requests.put(
+                ctx.url(f"/item/{ctx.item_names[i % len(ctx.item_names)]}"),
+                headers=ctx.auth,
+                # a price no earlier run wrote, an unchanged item logs no change
+                json={"price": first_price + i, "store_id": 1},
+                timeout=5,
+            ).ok
+        except requests.RequestException:
+            return False
+
+    loop = asyncio.get_running_loop()
+    written: List[float] = []
+    write_errors = 0
+    for i in range(writes):
+        started = time.perf_counter()
+        if await loop.run_in_executor(None, write, i):
+            written.append(started)
+        else:
+            write_errors += 1
+        await asyncio.sleep(interval)
+    # the last events still have to travel through the poller
+    await asyncio.sleep(3)
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    # each write is one change, the n-th id a client received is the n-th write
+    latencies, delivered = [], 0
+    for client in connected:
+        for index, seq in enumerate(sorted(client.received)):
+            if index < len(written):
+                latencies.append((client.received[seq] - written[index]) * 1000)
+                delivered += 1
+    latencies.sort()
+    return {
+        "subscribers": subscribers,
+        "connected": len(connected),
+        "writes": writes,
+        "write_errors": write_errors,
+        "delivered": delivered,
+        "expected": len(connected) * len(written),
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+        "server_streaming": streaming,
+    }
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="Idle /changes subscribers against the ASGI entry point (asgi.py "
+        "under uvicorn, streams held open) and uwsgi (a request per second and "
+        "subscriber), a slow stream of item writes, and how long each change takes "
+        "to reach every subscriber."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=20)
+    parser.add_argument(
+        "--interval", type=float, default=0.1, help="seconds between writes"
+    )
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8, help="uwsgi threads")
+    parser.add_argument("--servers", default="asgi")
+    parser.add_argument("--output", default="bench_change_feed.json")
+    args = parser.parse_args(argv)
+
+    # a socket per subscriber on both ends
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    stub = MailgunStub().start()
+    configure_env(database_url, stub.api_base)
+
+    app = boot_app()
+    ctx = Context("", 10)
+    seed(app, ctx, users=10, stores=2, items_per_store=100)
+    env = {**os.environ, "PYTHONPATH": ROOT}
+
+    results = {}
+    for server in args.servers.split(","):
+        port = free_port()
+        ctx.base_url = f"http://127.0.0.1:{port}"
+        process = start_server(
+            SERVERS[server](port, args.processes, args.threads), ctx.base_url, env
+        )
+        try:
+            idle = server_stats(process.pid)
+            result = asyncio.get_event_loop().run_until_complete(
+                run_feed(
+                    ctx,
+                    port,
+                    process.pid,
+                    args.subscribers,
+                    args.writes,
+                    args.interval,
+                    len(results) * args.writes + 0.5,
+                )
+            )
+            result["server_idle"] = idle
+        finally:
+            process.terminate()
+            try:
+                process.wait(10)
+            except Exception:
+                # uvicorn waits for the open streams, see libs/asgi.py
+                process.kill()
+        results[server] = result
+        print(
+            f"{server:<6} connected {result['connected']:>5}/{args.subscribers}  "
+            f"write errors {result['write_errors']:>3}  "
+            f"delivered {result['delivered']:>6}/{result['expected']:<6}  "
+            f"p50 {result['p50_ms']:>7.1f}ms  p99 {result['p99_ms']:>7.1f}ms  "
+            f"threads {result['server_streaming']['threads']}  "
+            f"rss {result['server_streaming']['rss_mb']}MB"
+        )
+
+    stub.stop()
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {
+                "database": database_url.split(":")[0],
+                "processes": args.processes,
+                "threads": args.threads,
+                "subscribers": args.subscribers,
+                "writes": args.writes,
+            },
+            "servers": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+from collections import OrderedDict
+from time import perf_counter
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import boot_app, configure_env, environment, write_report
+
+INSERT_CHUNK_SIZE = 50000
+
+
+def queries(stores: int):
+    # the searches GET /items answers, each one a page of 100 like a client would ask
+    return OrderedDict(
+        [
+            ("store", lambda i: {"store_id": i % stores + 1, "limit": 100}),
+            (
+                "store_price_range",
+                lambda i: {
+                    "store_id": i % stores + 1,
+                    "min_price": 10,
+                    "max_price": 20,
+                    "sort": "price",
+                    "limit": 100,
+                },
+            ),
+            (
+                "price_range_desc",
+                lambda i: {
+                    "min_price": i % 90,
+                    "max_price": i % 90 + 1,
+                    "sort": "-price",
+                    "limit": 100,
+                },
+            ),
+            (
+                "name_prefix",
+                lambda i: {
+                    "name_prefix": f"item-{i % 9 + 1}",
+                    "sort": "name",
+                    "limit": 100,
+                },
+            ),
+        ]
+    )
+
+
+def grow(db, ItemModel, current: int, target: int, stores: int) -> None:
+    table = ItemModel.__table__
+    rng = random.Random(current)
+    for start in range(current, target, INSERT_CHUNK_SIZE):
+        db.session.execute(
+            table.insert(),
+            [
+                {
+                    "name": f"item-{n}",
+                    "price": round(rng.uniform(0, 100), 2),
+                    "store_id": rng.randint(1, stores),
+                }
+                for n in range(start, min(start + INSERT_CHUNK_SIZE, target))
+            ],
+        )
+        db.session.commit()
+
+
+def time_queries(ItemModel, stores: int, runs: int) -> OrderedDict:
+    results = OrderedDict()
+    for name, make_args in queries(stores).items():
+        timings = []
+        for i in range(runs):
+            start = perf_counter()
+            ItemModel.search(**make_args(i)).all()
+            timings.append(perf_counter() - start)
+        timings.sort()
+        results[name] = round(timings[len(timings) // 2] * 1000, 3)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Median latency of ItemModel.search as the items table grows, "
+        "with the store/price indexes and with them dropped (name prefix searches "
+        "use the unique name index, which is never dropped)."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--stores", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--output", default="bench_item_search.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    configure_env(database_url)
+    app = boot_app()
+
+    from db import db
+    from models.item import ItemModel
+    from models.store import StoreModel
+
+    indexes = [
+        index
+        for index in ItemModel.__table__.indexes
+        if index.name in ("ix_items_store_id_price", "ix_items_price")
+    ]
+
+    report = {"environment": environment(), "stores": args.stores, "sizes": {}}
+    with app.app_context():
+        db.session.bulk_insert_mappings(
+            StoreModel, [{"name": f"store-{i}"} for i in range(args.stores)]
+        )
+        db.session.commit()
+
+        rows = 0
+        for size in (int(s) for s in args.sizes.split(",")):
+            grow(db, ItemModel, rows, size, args.stores)
+            rows = size
+            db.session.execute("ANALYZE")
+            db.session.commit()
+
+            indexed = time_queries(ItemModel, args.stores, args.runs)
+            for index in indexes:
+                index.drop(bind=db.engine)
+            scanned = time_queries(ItemModel, args.stores, max(args.runs // 10, 3))
+            for index in indexes:
+                index.create(bind=db.engine)
+
+            report["sizes"][size] = {"indexed_ms": indexed, "no_index_ms": scanned}
+            print(f"\n{size} items")
+            for name in indexed:
+                print(
+                    f"  {name:<20} indexed {indexed[name]:9.3f}ms  "
+                    f"without indexes {scanned[name]:9.3f}ms"
+                )
+
+    write_report(args.output, report)
+    print(f"\nwrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
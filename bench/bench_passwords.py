@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+from time import perf_counter
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import environment, run_concurrent, write_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Cost of one hash/verify per method and login verification "
+        "throughput at increasing concurrency, direct vs the bounded hashing pool."
+    )
+    parser.add_argument(
+        "--methods",
+        default="pbkdf2:sha256:150000,pbkdf2:sha256:260000,pbkdf2:sha256:600000",
+    )
+    parser.add_argument("--concurrency", default="1,4,8,16,64")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--output", default="bench_passwords.json")
+    args = parser.parse_args(argv)
+
+    from werkzeug.security import check_password_hash, generate_password_hash
+
+    from libs import passwords
+
+    report = {"environment": environment(), "methods": {}, "verify": {}}
+
+    for method in args.methods.split(","):
+        start = perf_counter()
+        stored = generate_password_hash("benchmark", method=method, salt_length=16)
+        hash_ms = (perf_counter() - start) * 1000
+        start = perf_counter()
+        check_password_hash(stored, "benchmark")
+        verify_ms = (perf_counter() - start) * 1000
+        report["methods"][method] = {
+            "hash_ms": round(hash_ms, 2),
+            "verify_ms": round(verify_ms, 2),
+        }
+        print(f"{method:<28} hash {hash_ms:8.2f}ms  verify {verify_ms:8.2f}ms")
+
+    stored = passwords.hash_password("benchmark")
+    print(
+        f"\nverify with {passwords.PASSWORD_HASH_METHOD}, "
+        f"{passwords.PASSWORD_HASH_WORKERS} pool workers"
+    )
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        direct = run_concurrent(
+            lambda i: check_password_hash(stored, "benchmark"),
+            args.requests,
+            concurrency,
+        )
+        pooled = run_concurrent(
+            lambda i: passwords.verify_password(stored, "benchmark"),
+            args.requests,
+            concurrency,
+        )
+        report["verify"][str(concurrency)] = {"direct": direct, "pooled": pooled}
+        for name, r in (("direct", direct), ("pooled", pooled)):
+            print(
+                f"concurrency {concurrency:>3} {name:<7} {r['throughput_rps']:>8.1f}/s  "
+                f"p50 {r['p50_ms']:>8.2f}ms  p99 {r['p99_ms']:>8.2f}ms  errors {r['errors']}"
+            )
+
+    write_report(args.output, report)
+    print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import ROOT, environment, write_report
+
+# PROFILER_ENABLED=false leaves the request hooks out, "idle" has them installed
+# with no session running, the sampling modes profile every request
+MODES = OrderedDict(
+    [
+        ("off", {"enabled": "false"}),
+        ("idle", {"enabled": "true"}),
+        ("sampling", {"enabled": "true", "interval": 0.01}),
+        ("sampling_1ms", {"enabled": "true", "interval": 0.001}),
+    ]
+)
+DEFAULT_SCENARIOS = "item_get,items_page"
+
+
+def run_mode(mode: str, names, requests: int, concurrency: int, rounds: int):
+    # child process: every scenario `rounds` times, the median round is reported
+    from bench.common import boot_app, configure_env, run_concurrent, serve
+    from bench.load_test import Context, scenarios, seed
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_env(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ["PROFILER_DIR"] = os.path.join(workdir, "profiles")
+    app = boot_app()
+    server, base_url = serve(app)
+    ctx = Context(base_url, requests)
+    seed(app, ctx, users=10, stores=10, items_per_store=100)
+
+    from libs.profiler import profiler
+
+    selected = scenarios(ctx)
+    interval = MODES[mode].get("interval")
+    results = OrderedDict()
+    for name in names:
+        # warm up caches and connections before the measured rounds
+        run_concurrent(selected[name], requests // 5, concurrency)
+        if interval:
+            with app.app_context():
+                session = profiler.start(3600, interval=interval)
+        measured = sorted(
+            (
+                run_concurrent(selected[name], requests, concurrency)
+                for _ in range(rounds)
+            ),
+            key=lambda result: result["throughput_rps"],
+        )
+        results[name] = measured[len(measured) // 2]
+        results[name]["rounds_rps"] = [r["throughput_rps"] for r in measured]
+        if interval:
+            with app.app_context():
+                profiler.stop()
+            # the sampler writes its stacks once it sees the end of the session
+            for _ in range(50):
+                found = profiler.result(session["id"])
+                if found and found[0]["workers"]:
+                    break
+                time.sleep(0.1)
+            results[name]["samples"] = found[0]["samples"] if found else 0
+    server.shutdown()
+    return results
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="Request throughput with the sampling profiler left out, "
+        "installed but idle, and sampling every request."
+    )
+    parser.add_argument("--requests", type=int, default=2000, help="per round")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--output", default="bench_profiler.json")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    names = args.scenarios.split(",")
+
+    if args.child:
+        print(
+            json.dumps(
+                run_mode(
+                    args.child, names, args.requests, args.concurrency, args.rounds
+                )
+            )
+        )
+        return {}
+
+    results = OrderedDict()
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                mode,
+                "--scenarios",
+                args.scenarios,
+                "--requests",
+                str(args.requests),
+                "--rounds",
+                str(args.rounds),
+                "--concurrency",
+                str(args.concurrency),
+            ],
+            cwd=ROOT,
+            env={**os.environ, "PROFILER_ENABLED": MODES[mode]["enabled"]},
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        results[mode] = json.loads(output.decode().strip().splitlines()[-1])
+
+    baseline = results.get("off")
+    for name in names:
+        for mode, result in results.items():
+            r = result[name]
+            change = ""
+            if baseline and mode != "off":
+                before = baseline[name]["throughput_rps"]
+                change = f"{(r['throughput_rps'] - before) / before * 100:+6.1f}%"
+            spread = statistics.pstdev(r["rounds_rps"]) / r["throughput_rps"] * 100
+            samples = f"  samples {r['samples']}" if "samples" in r else ""
+            print(
+                f"{name:<12} {mode:<13} {r['throughput_rps']:>9.1f} req/s {change:>8}  "
+                f"p50 {r['p50_ms']:>6.2f}ms  p99 {r['p99_ms']:>7.2f}ms  "
+                f"round spread {spread:4.1f}%{samples}"
+            )
+
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {
+                "requests": args.requests,
+                "rounds": args.rounds,
+                "concurrency": args.concurrency,
+            },
+            "modes": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
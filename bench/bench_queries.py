@@ -0,0 +1,132 @@
+import argparse
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import boot_app, configure_env, environment, write_report
+
+BENCH_PASSWORD = "bench-password"
+# the most statements each request may issue, more fails the run (exit status 1):
+# login reads users.confirmed instead of the confirmations, GET /user still lists
+# the confirmation ids it always returned
+QUERY_BUDGETS = {
+    "login": 1,
+    "user_get": 2,
+    "refresh": 0,
+    "store_get": 1,
+    # items of every store in one query (StoreModel.prefetch_items), not one per store
+    "stores_get": 2,
+}
+# stores seeded for stores_get, more than the budget so a query per store shows
+STORES = 5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="SQL statements issued per request for the user and store routes, "
+        "checked against QUERY_BUDGETS; run it on two revisions and compare the reports."
+    )
+    parser.add_argument("--output", default="bench_queries.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_env(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    # every GET builds its body, the warm up call would otherwise cache it
+    os.environ["HTTP_CACHE_ENABLED"] = "false"
+    app = boot_app()
+
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from db import db
+    from libs.passwords import hash_password
+    from models.confirmation import ConfirmationModel
+    from models.item import ItemModel
+    from models.store import StoreModel
+    from models.user import UserModel
+
+    with app.app_context():
+        user = UserModel(
+            username="bench",
+            password=hash_password(BENCH_PASSWORD),
+            email="bench@bench.example.com",
+        )
+        db.session.add(user)
+        db.session.flush()
+        confirmation = ConfirmationModel(user.id)
+        confirmation.confirmed = True
+        # older revisions have no users.confirmed column
+        if hasattr(UserModel, "confirmed"):
+            user.confirmed = True
+        db.session.add(confirmation)
+        for i in range(STORES):
+            store = StoreModel(name=f"bench-{i}")
+            db.session.add(store)
+            db.session.flush()
+            db.session.add(ItemModel(name=f"bench-{i}", price=1.0, store_id=store.id))
+        db.session.commit()
+        user_id = user.id
+
+    statements = []
+    event.listen(
+        Engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    client = app.test_client()
+    tokens = client.post(
+        "/login", json={"username": "bench", "password": BENCH_PASSWORD}
+    ).get_json()
+    access = {"Authorization": f"Bearer {tokens['access_token']}"}
+    refresh = {"Authorization": f"Bearer {tokens['refresh_token']}"}
+
+    requests = OrderedDict(
+        [
+            (
+                "login",
+                lambda: client.post(
+                    "/login", json={"username": "bench", "password": BENCH_PASSWORD}
+                ),
+            ),
+            ("user_get", lambda: client.get(f"/user/{user_id}")),
+            ("refresh", lambda: client.post("/refresh", headers=refresh)),
+            # authenticated, only the store lookup should be left
+            ("store_get", lambda: client.get("/store/bench", headers=access)),
+            ("stores_get", lambda: client.get("/stores", headers=access)),
+        ]
+    )
+
+    results = OrderedDict()
+    for name, call in requests.items():
+        call()  # warm up, first request runs the before_first_request hooks
+        del statements[:]
+        response = call()
+        results[name] = {
+            "status": response.status_code,
+            "queries": len(statements),
+            "budget": QUERY_BUDGETS[name],
+        }
+        print(
+            f"{name:<12} {response.status_code}  {len(statements)} queries "
+            f"(budget {QUERY_BUDGETS[name]})"
+        )
+        for statement in statements:
+            print("    " + " ".join(statement.split())[:120])
+
+    write_report(args.output, {"environment": environment(), "requests": results})
+    print(f"\nwrote {args.output}")
+    over = [
+        name for name, result in results.items() if result["queries"] > result["budget"]
+    ]
+    if over:
+        sys.exit(f"over the query budget: {', '.join(over)}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
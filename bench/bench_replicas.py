@@ -0,0 +1,111 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Dict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import (
+    boot_app,
+    configure_env,
+    environment,
+    run_concurrent,
+    serve,
+    write_report,
+)
+from bench.load_test import Context, scenarios, seed
+
+DEFAULT_SCENARIOS = "item_get,items_page,store_get,user_get,item_put"
+
+
+def counter_values(counter) -> Dict[str, float]:
+    return {labels["target"]: value for _, labels, value in counter.samples()}
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="Read scenarios with replica routing: where each statement and "
+        "each read-only request went. By default the replicas are copies of a SQLite "
+        "primary taken after seeding, so later writes show up as replica lag."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="primary, defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument(
+        "--replica-urls",
+        help="comma separated, e.g. postgresql://localhost:5433/bench; an unreachable "
+        "one shows the failover",
+    )
+    parser.add_argument("--replicas", type=int, default=2, help="SQLite copies")
+    parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS)
+    parser.add_argument("--output", default="bench_replicas.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    primary = os.path.join(workdir, "primary.db")
+    database_url = args.database_url or f"sqlite:///{primary}"
+    copies = [os.path.join(workdir, f"replica-{i}.db") for i in range(args.replicas)]
+    replica_urls = args.replica_urls or ",".join(f"sqlite:///{c}" for c in copies)
+    configure_env(database_url)
+    # read by create_app, the replicas are not connected to before the first request
+    os.environ["DATABASE_REPLICA_URLS"] = replica_urls
+
+    app = boot_app()
+    server, base_url = serve(app)
+    ctx = Context(base_url, args.requests)
+    seed(app, ctx, users=200, stores=20, items_per_store=100)
+    if not args.replica_urls and not args.database_url:
+        for copy in copies:
+            shutil.copy(primary, copy)
+
+    from libs.replicas import QUERIES, READ_ROUTES
+
+    selected = scenarios(ctx)
+    results = OrderedDict()
+    for name in args.scenarios.split(","):
+        queries, routes = counter_values(QUERIES), counter_values(READ_ROUTES)
+        result = run_concurrent(selected[name], args.requests, args.concurrency)
+        result["queries"] = {
+            target: value - queries.get(target, 0)
+            for target, value in counter_values(QUERIES).items()
+            if value != queries.get(target, 0)
+        }
+        result["read_routes"] = {
+            target: value - routes.get(target, 0)
+            for target, value in counter_values(READ_ROUTES).items()
+            if value != routes.get(target, 0)
+        }
+        results[name] = result
+        print(
+            f"{name:<12} {result['throughput_rps']:>8.1f} req/s  errors "
+            f"{result['errors']:<4} queries {result['queries']}  "
+            f"reads {result['read_routes']}"
+        )
+
+    server.shutdown()
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {
+                "database": database_url.split(":")[0],
+                "replicas": len(replica_urls.split(",")),
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+            },
+            "scenarios": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict, namedtuple
+from time import perf_counter
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import configure_env, environment, write_report
+
+
+def per_object_us(dump, objects, objects_per_call: int, repeat: int) -> float:
+    # best of repeat runs, in microseconds per serialized top level object
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        dump(objects)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / objects_per_call * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Per object dump cost of ItemSchema and StoreSchema through "
+        "marshmallow and through the compiled dumps in schemas/fast.py."
+    )
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--stores", type=int, default=500)
+    parser.add_argument("--items-per-store", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="bench_serializers.json")
+    args = parser.parse_args(argv)
+
+    configure_env("sqlite://")
+
+    from models.item import ItemModel
+    from models.store import StoreModel
+    from schemas.fast import CompiledDump
+    from schemas.item import ItemSchema
+    from schemas.store import StoreSchema
+
+    items = [
+        ItemModel(id=i, name=f"item-{i}", price=i + 0.99, store_id=i % 50 + 1)
+        for i in range(args.items)
+    ]
+    # what a column only query returns: tuples with attribute access
+    Row = namedtuple("Row", [column.name for column in ItemModel.__table__.columns])
+    rows = [Row(**{key: getattr(item, key) for key in Row._fields}) for item in items]
+    stores = []
+    for s in range(args.stores):
+        store = StoreModel(id=s, name=f"store-{s}")
+        store._prefetched_items = [
+            ItemModel(id=i, name=f"item-{s}-{i}", price=i + 0.99, store_id=s)
+            for i in range(args.items_per_store)
+        ]
+        stores.append(store)
+
+    cases = OrderedDict(
+        [
+            ("ItemSchema", (ItemSchema(many=True), items)),
+            ("ItemSchema (column rows)", (ItemSchema(many=True), rows)),
+            ("StoreSchema", (StoreSchema(many=True), stores)),
+        ]
+    )
+
+    report = {"environment": environment(), "results": OrderedDict()}
+    for name, (schema, objects) in cases.items():
+        compiled = CompiledDump(schema)
+        # the fast path is only worth having if it is indistinguishable on the wire
+        identical = json.dumps(schema.dump(objects)) == json.dumps(
+            compiled.dump(objects)
+        )
+        marshmallow_us = per_object_us(schema.dump, objects, len(objects), args.repeat)
+        compiled_us = per_object_us(compiled.dump, objects, len(objects), args.repeat)
+        report["results"][name] = {
+            "objects": len(objects),
+            "marshmallow_us": round(marshmallow_us, 3),
+            "compiled_us": round(compiled_us, 3),
+            "speedup": round(marshmallow_us / compiled_us, 2),
+            "identical": identical,
+        }
+        print(
+            f"{name:<26} marshmallow {marshmallow_us:9.2f}us  compiled "
+            f"{compiled_us:8.2f}us  x{marshmallow_us / compiled_us:5.1f}  "
+            f"identical {identical}"
+        )
+
+    write_report(args.output, report)
+    print(f"\nwrote {args.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
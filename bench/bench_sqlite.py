@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Dict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import ROOT, environment, write_report
+
+# SQLITE_TUNING is read when the app is created, so every mode runs in its own process
+MODES = OrderedDict([("default", "false"), ("tuned", "true")])
+SCENARIOS = ("item_get", "item_post", "item_put", "mixed", "item_delete")
+
+
+def run_mode(requests: int, concurrency: int) -> Dict:
+    # child process: item CRUD against a fresh SQLite file with the current settings
+    from bench.common import boot_app, configure_env, run_concurrent, serve
+    from bench.load_test import Context, expect, scenarios, seed
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_env(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    app = boot_app()
+    server, base_url = serve(app)
+    ctx = Context(base_url, requests)
+    seed(app, ctx, users=100, stores=10, items_per_store=200)
+
+    selected = scenarios(ctx)
+
+    def mixed(i: int) -> bool:
+        # one write for every four reads, the readers should not wait on the writer
+        name = ctx.item_names[i % len(ctx.item_names)]
+        if i % 5 == 0:
+            return expect(
+                ctx.http.put(
+                    ctx.url(f"/item/{name}"),
+                    headers=ctx.auth,
+                    json={"price": i + 0.5, "store_id": 1},
+                ),
+                200,
+            )
+        return expect(ctx.http.get(ctx.url(f"/item/{name}")), 200)
+
+    selected["mixed"] = mixed
+    results = OrderedDict(
+        (name, run_concurrent(selected[name], requests, concurrency))
+        for name in SCENARIOS
+    )
+    server.shutdown()
+    return results
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="Item CRUD throughput on SQLite with the driver defaults "
+        "(SQLITE_TUNING=false) and with WAL, pragmas and BEGIN IMMEDIATE."
+    )
+    parser.add_argument("--requests", type=int, default=1000, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="bench_sqlite.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_mode(args.requests, args.concurrency)))
+        return {}
+
+    results = OrderedDict()
+    for mode, tuning in MODES.items():
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                "--requests",
+                str(args.requests),
+                "--concurrency",
+                str(args.concurrency),
+            ],
+            cwd=ROOT,
+            env={**os.environ, "SQLITE_TUNING": tuning},
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        results[mode] = json.loads(output.decode().strip().splitlines()[-1])
+
+    print(f"{'scenario':<12}" + "".join(f"{mode:>34}" for mode in MODES))
+    for name in SCENARIOS:
+        row = "".join(
+            "{:>10.1f} req/s p99 {:>7.1f}ms err {:>3}".format(
+                results[mode][name]["throughput_rps"],
+                results[mode][name]["p99_ms"],
+                results[mode][name]["errors"],
+            )
+            for mode in MODES
+        )
+        print(f"{name:<12}{row}")
+
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {"requests": args.requests, "concurrency": args.concurrency},
+            "modes": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import ROOT, configure_env, environment, percentile, write_report
+
+# runs in a fresh interpreter, like a uwsgi worker coming up; older revisions
+# without create_app build the app on import of run.py
+WORKER = """
+import json, sys
+from time import perf_counter
+
+start = perf_counter()
+try:
+    from app import create_app
+except ImportError:
+    create_app = None
+    from run import app
+imported = perf_counter()
+if create_app:
+    app = create_app()
+created = perf_counter()
+
+client = app.test_client()
+client.get("/items")
+first = perf_counter()
+client.get("/items")
+second = perf_counter()
+
+from db import db
+with app.app_context():
+    db.create_all()
+create_all = perf_counter() - second
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (first - created) * 1000,
+    "second_request_ms": (second - first) * 1000,
+    "create_all_ms": create_all * 1000,
+    "modules": len(sys.modules),
+}))
+"""
+
+SETUP = """
+from db import db
+try:
+    from app import create_app
+    app = create_app()
+except ImportError:
+    from run import app
+with app.app_context():
+    db.create_all()
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Worker startup: import time, app creation and time to the first "
+        "response, each measured in a fresh interpreter."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", default="bench_startup.json")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    configure_env(database_url)
+    env = {**os.environ, "PYTHONPATH": ROOT}
+
+    # the schema exists before workers start, as after `flask init-db`
+    subprocess.run([sys.executable, "-c", SETUP], cwd=ROOT, env=env, check=True)
+
+    samples = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, "-c", WORKER],
+            cwd=ROOT,
+            env=env,
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        samples.append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    results = OrderedDict()
+    for key in samples[0]:
+        values = sorted(sample[key] for sample in samples)
+        results[key] = {
+            "p50": round(percentile(values, 0.5), 3),
+            "max": round(values[-1], 3),
+        }
+        print(f"{key:<20} p50 {values[len(values) // 2]:9.2f}  max {values[-1]:9.2f}")
+
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "database": database_url.split(":")[0],
+            "runs": args.runs,
+            "results": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
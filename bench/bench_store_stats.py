@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from typing import Dict
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import ROOT, environment, write_report
+
+# the nested store list every reporting client aggregated before, the aggregates
+# endpoint, and the item writes that now also update store_stats
+SCENARIOS = ("stores_list", "stores_stats", "item_post", "item_put", "item_delete")
+
+
+def run_size(items_per_store: int, stores: int, requests: int, concurrency: int):
+    # child process: a fresh SQLite file seeded with the given catalogue size
+    from bench.common import boot_app, configure_env, run_concurrent, serve
+    from bench.load_test import Context, scenarios, seed
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    configure_env(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    # every GET has to build its body, not replay one cached by table version
+    os.environ["HTTP_CACHE_ENABLED"] = "false"
+    app = boot_app()
+    server, base_url = serve(app)
+    ctx = Context(base_url, requests)
+    seed(app, ctx, users=10, stores=stores, items_per_store=items_per_store)
+
+    selected = scenarios(ctx)
+    results = OrderedDict()
+    for name in SCENARIOS:
+        results[name] = run_concurrent(selected[name], requests, concurrency)
+    for name, path in (("stores_list", "/stores"), ("stores_stats", "/stores/stats")):
+        results[name]["bytes"] = len(
+            ctx.http.get(ctx.url(path), headers=ctx.auth).content
+        )
+    server.shutdown()
+
+    from models.store_stats import StoreStatsModel
+
+    with app.app_context():
+        results["mismatched_stores"] = len(StoreStatsModel.check())
+    return results
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="GET /stores (every item nested) against GET /stores/stats "
+        "(aggregates kept in store_stats) as the catalogue grows, and the item "
+        "writes that maintain the aggregates; exits with status 1 when store_stats "
+        "no longer matches the items afterwards."
+    )
+    parser.add_argument("--items-per-store", default="100,1000")
+    parser.add_argument("--stores", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=300, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", default="bench_store_stats.json")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(
+            json.dumps(
+                run_size(args.child, args.stores, args.requests, args.concurrency)
+            )
+        )
+        return {}
+
+    results = OrderedDict()
+    for size in [int(size) for size in args.items_per_store.split(",")]:
+        output = subprocess.run(
+            [
+                sys.executable,
+                os.path.abspath(__file__),
+                "--child",
+                str(size),
+                "--stores",
+                str(args.stores),
+                "--requests",
+                str(args.requests),
+                "--concurrency",
+                str(args.concurrency),
+            ],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.PIPE,
+        ).stdout
+        results[size] = result = json.loads(output.decode().strip().splitlines()[-1])
+        for name in SCENARIOS:
+            print(
+                f"{size:>6} items/store  {name:<13} "
+                f"{result[name]['throughput_rps']:>9.1f} req/s  "
+                f"p50 {result[name]['p50_ms']:>8.2f}ms  "
+                f"p99 {result[name]['p99_ms']:>8.2f}ms  errors {result[name]['errors']}"
+            )
+        print(f"{size:>6} items/store  mismatched stores {result['mismatched_stores']}")
+
+    write_report(
+        args.output,
+        {
+            "environment": environment(),
+            "config": {
+                "stores": args.stores,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+            },
+            "sizes": results,
+        },
+    )
+    print(f"\nwrote {args.output}")
+    # the writes above go through every maintained path, any drift fails the run
+    drifted = [
+        str(size) for size, result in results.items() if result["mismatched_stores"]
+    ]
+    if drifted:
+        sys.exit(
+            f"store_stats out of date after the writes ({', '.join(drifted)} items/store)"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def configure_env(database_url: str, mail_api_base: str = None) -> None:
+    # must run before the app is imported, several modules read the environment at import
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("APP_SECRET_KEY", "benchmark-secret")
+    os.environ.setdefault("MAILGUN_DOMAIN", "bench.example.com")
+    os.environ.setdefault("MAILGUN_API_KEY", "bench-key")
+    # every benchmark request comes from one address, which the limits would throttle
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    # the production config only serves /metrics with a token
+    os.environ.setdefault("METRICS_TOKEN", "bench-metrics")
+    if mail_api_base:
+        os.environ["MAILGUN_API_BASE"] = mail_api_base
+
+
+def boot_app():
+    # the same entry point uwsgi loads (uwsgi.ini: module = run)
+    from run import app
+    from db import db
+
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def serve(app):
+    # threaded werkzeug server on a free port, returns (server, base url)
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        # keep the access log out of the benchmark output
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server(
+        "127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    # nearest rank on an already sorted list
+    if not sorted_values:
+        return 0.0
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict:
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "throughput_rps": round(count / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / count * 1000, 3) if count else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if count else 0.0,
+    }
+
+
+def run_concurrent(
+    call: Callable[[int], bool], requests: int, concurrency: int
+) -> Dict:
+    # runs call(i) for i in range(requests) on a fixed size pool, call returns False
+    # for an unexpected response
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def timed(i: int) -> None:
+        start = perf_counter()
+        try:
+            ok = call(i)
+        except Exception:
+            ok = False
+        elapsed = perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(requests)))
+    return summarize(latencies, perf_counter() - start, errors[0])
+
+
+def git_revision() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=ROOT,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment() -> Dict:
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_report(path: str, report: Dict) -> None:
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(current: Dict, baseline_path: str) -> None:
+    # prints p50/p99 and throughput changes for scenarios present in both reports
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\ncompared with {baseline_path} ({baseline['environment']['revision']})")
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        print(
+            "{:<24} rps {:>9.1f} ({:+6.1f}%)  p50 {:>8.2f}ms ({:+6.1f}%)  p99 {:>8.2f}ms ({:+6.1f}%)".format(
+                name,
+                result["throughput_rps"],
+                _change(before["throughput_rps"], result["throughput_rps"]),
+                result["p50_ms"],
+                _change(before["p50_ms"], result["p50_ms"]),
+                result["p99_ms"],
+                _change(before["p99_ms"], result["p99_ms"]),
+            )
+        )
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
@@ -0,0 +1,437 @@
+import argparse
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+import requests
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.common import (
+    boot_app,
+    compare,
+    configure_env,
+    environment,
+    run_concurrent,
+    serve,
+    write_report,
+)
+from bench.mail_stub import MailgunStub
+
+BENCH_PASSWORD = "bench-password"
+
+
+class Context:
+    # everything the scenarios need: base url, seeded names/ids and tokens
+    def __init__(self, base_url: str, requests_per_scenario: int):
+        self.base_url = base_url
+        self.requests = requests_per_scenario
+        self._local = threading.local()
+        self.usernames: List[str] = []
+        self.user_ids: List[int] = []
+        self.item_names: List[str] = []
+        self.store_names: List[str] = []
+        self.unconfirmed_user_ids: List[int] = []
+        self.deletable_user_ids: List[int] = []
+        self.confirmation_ids: List[str] = []
+        self.logout_tokens: List[str] = []
+        self.etags: Dict[str, str] = {}
+        self.access_token = None
+        self.refresh_token = None
+
+    @property
+    def http(self) -> requests.Session:
+        # one keep-alive session per benchmark thread
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    @property
+    def auth(self) -> Dict:
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+
+def seed(app, ctx: Context, users: int, stores: int, items_per_store: int) -> None:
+    from flask_jwt_extended import create_access_token, create_refresh_token
+
+    from db import db
+    from models.confirmation import ConfirmationModel
+    from models.item import ItemModel
+    from models.store import StoreModel
+    from models.store_stats import StoreStatsModel
+    from models.user import UserModel
+
+    from libs.passwords import hash_password
+
+    extra = ctx.requests
+    # hashed once and shared, seeding thousands of users should not take minutes
+    password_hash = hash_password(BENCH_PASSWORD)
+
+    def add_users(prefix: str, count: int, confirmed: bool) -> List[int]:
+        rows = [
+            UserModel(
+                username=f"{prefix}-{i}",
+                password=password_hash,
+                email=f"{prefix}-{i}@bench.example.com",
+                confirmed=confirmed,
+            )
+            for i in range(count)
+        ]
+        db.session.add_all(rows)
+        db.session.flush()
+        confirmations = [ConfirmationModel(user.id) for user in rows]
+        for confirmation in confirmations:
+            confirmation.confirmed = confirmed
+        db.session.add_all(confirmations)
+        db.session.commit()
+        if not confirmed and prefix == "confirm":
+            ctx.confirmation_ids = [c.id for c in confirmations]
+        return [user.id for user in rows]
+
+    with app.app_context():
+        ctx.user_ids = add_users("user", users, True)
+        ctx.usernames = [f"user-{i}" for i in range(users)]
+        ctx.unconfirmed_user_ids = add_users("resend", extra, False)
+        add_users("confirm", extra, False)
+        ctx.deletable_user_ids = add_users("delete", extra, True)
+
+        db.session.bulk_insert_mappings(
+            StoreModel, [{"name": f"store-{i}"} for i in range(stores)]
+        )
+        db.session.commit()
+        store_ids = [row.id for row in db.session.query(StoreModel.id)]
+        ctx.store_names = [f"store-{i}" for i in range(stores)]
+
+        db.session.bulk_insert_mappings(
+            ItemModel,
+            [
+                {"name": f"item-{s}-{i}", "price": i + 0.99, "store_id": store_id}
+                for s, store_id in enumerate(store_ids)
+                for i in range(items_per_store)
+            ],
+        )
+        db.session.commit()
+        # the bulk inserts skip the flush listeners that keep store_stats up to date
+        StoreStatsModel.rebuild()
+        ctx.item_names = [
+            f"item-{s}-{i}" for s in range(stores) for i in range(items_per_store)
+        ]
+
+        ctx.access_token = create_access_token(identity=ctx.user_ids[0], fresh=True)
+        ctx.refresh_token = create_refresh_token(ctx.user_ids[0])
+        ctx.logout_tokens = [
+            create_access_token(identity=ctx.user_ids[0], fresh=True)
+            for _ in range(extra)
+        ]
+
+
+def expect(response: requests.Response, *statuses: int) -> bool:
+    return response.status_code in statuses
+
+
+def revalidate(ctx: Context, path: str, headers: Dict = None) -> bool:
+    # conditional GET with the ETag fetched by the first call, expects a 304
+    headers = dict(headers or {})
+    if path not in ctx.etags:
+        ctx.etags[path] = ctx.http.get(ctx.url(path), headers=headers).headers["ETag"]
+    headers["If-None-Match"] = ctx.etags[path]
+    return expect(ctx.http.get(ctx.url(path), headers=headers), 304)
+
+
+def scenarios(ctx: Context) -> "OrderedDict[str, Callable[[int], bool]]":
+    # one entry per route registered in app.py, ordered so that writes find what they need
+    # (post before put before delete); each callable performs request number i
+    def pick(values: List, i: int):
+        return values[i % len(values)]
+
+    return OrderedDict(
+        [
+            (
+                "login",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url("/login"),
+                        json={
+                            "username": pick(ctx.usernames, i),
+                            "password": BENCH_PASSWORD,
+                        },
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "refresh",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url("/refresh"),
+                        headers={"Authorization": f"Bearer {ctx.refresh_token}"},
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "item_get",
+                lambda i: expect(
+                    ctx.http.get(ctx.url(f"/item/{pick(ctx.item_names, i)}")), 200
+                ),
+            ),
+            ("items_list", lambda i: expect(ctx.http.get(ctx.url("/items")), 200)),
+            (
+                "items_page",
+                lambda i: expect(
+                    ctx.http.get(
+                        ctx.url(
+                            f"/items?limit=100&after={i * 100 % len(ctx.item_names)}"
+                        )
+                    ),
+                    200,
+                ),
+            ),
+            ("items_not_modified", lambda i: revalidate(ctx, "/items")),
+            (
+                "items_stream",
+                lambda i: expect(ctx.http.get(ctx.url("/items?stream=1")), 200),
+            ),
+            (
+                "item_post",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url(f"/item/bench-new-{i}"),
+                        headers=ctx.auth,
+                        json={"price": 1.99, "store_id": 1},
+                    ),
+                    201,
+                ),
+            ),
+            (
+                "item_put",
+                lambda i: expect(
+                    ctx.http.put(
+                        ctx.url(f"/item/bench-new-{i}"),
+                        headers=ctx.auth,
+                        json={"price": 2.99, "store_id": 1},
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "item_delete",
+                lambda i: expect(
+                    ctx.http.delete(ctx.url(f"/item/bench-new-{i}"), headers=ctx.auth),
+                    200,
+                ),
+            ),
+            (
+                "items_import",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url("/items/import"),
+                        headers=ctx.auth,
+                        json=[
+                            {"name": f"import-{j}", "price": i + 0.5, "store_id": 1}
+                            for j in range(100)
+                        ],
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "store_get",
+                lambda i: expect(
+                    ctx.http.get(
+                        ctx.url(f"/store/{pick(ctx.store_names, i)}"), headers=ctx.auth
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "stores_list",
+                lambda i: expect(
+                    ctx.http.get(ctx.url("/stores"), headers=ctx.auth), 200
+                ),
+            ),
+            (
+                "stores_not_modified",
+                lambda i: revalidate(ctx, "/stores", ctx.auth),
+            ),
+            (
+                "stores_stats",
+                lambda i: expect(
+                    ctx.http.get(ctx.url("/stores/stats"), headers=ctx.auth), 200
+                ),
+            ),
+            (
+                "store_post",
+                lambda i: expect(
+                    ctx.http.post(ctx.url(f"/store/bench-new-{i}"), headers=ctx.auth),
+                    201,
+                ),
+            ),
+            (
+                "store_delete",
+                lambda i: expect(
+                    ctx.http.delete(ctx.url(f"/store/bench-new-{i}"), headers=ctx.auth),
+                    200,
+                ),
+            ),
+            (
+                "user_get",
+                lambda i: expect(
+                    ctx.http.get(ctx.url(f"/user/{pick(ctx.user_ids, i)}")), 200
+                ),
+            ),
+            (
+                "register",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url("/register"),
+                        json={
+                            "username": f"register-{i}",
+                            "password": BENCH_PASSWORD,
+                            "email": f"register-{i}@bench.example.com",
+                        },
+                    ),
+                    201,
+                ),
+            ),
+            (
+                "confirmation_by_user",
+                lambda i: expect(
+                    ctx.http.get(
+                        ctx.url(f"/confirmation/user/{pick(ctx.user_ids, i)}")
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "confirmation_resend",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url(f"/confirmation/user/{ctx.unconfirmed_user_ids[i]}")
+                    ),
+                    201,
+                ),
+            ),
+            (
+                "confirm",
+                lambda i: expect(
+                    ctx.http.get(
+                        ctx.url(f"/user_confirmation/{ctx.confirmation_ids[i]}")
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "user_delete",
+                lambda i: expect(
+                    ctx.http.delete(ctx.url(f"/user/{ctx.deletable_user_ids[i]}")),
+                    200,
+                ),
+            ),
+            (
+                "logout",
+                lambda i: expect(
+                    ctx.http.post(
+                        ctx.url("/logout"),
+                        headers={"Authorization": f"Bearer {ctx.logout_tokens[i]}"},
+                    ),
+                    200,
+                ),
+            ),
+            (
+                "metrics",
+                lambda i: expect(
+                    ctx.http.get(
+                        ctx.url("/metrics"),
+                        headers={
+                            "Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"
+                        },
+                    ),
+                    200,
+                ),
+            ),
+        ]
+    )
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(
+        description="Boot the app from run.py, seed it and drive every REST route "
+        "at a fixed concurrency, reporting throughput and latency percentiles."
+    )
+    parser.add_argument(
+        "--database-url",
+        help="defaults to a fresh SQLite file, e.g. postgresql://localhost/bench",
+    )
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--stores", type=int, default=50)
+    parser.add_argument("--items-per-store", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--scenarios", help="comma separated subset, defaults to every route"
+    )
+    parser.add_argument(
+        "--mail-delay", type=float, default=0.0, help="seconds the Mailgun stub waits"
+    )
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="previous report to diff against")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    stub = MailgunStub(delay=args.mail_delay).start()
+    configure_env(database_url, stub.api_base)
+    app = boot_app()
+    server, base_url = serve(app)
+
+    ctx = Context(base_url, args.requests)
+    seed(app, ctx, args.users, args.stores, args.items_per_store)
+
+    selected = scenarios(ctx)
+    if args.scenarios:
+        wanted = args.scenarios.split(",")
+        selected = OrderedDict((k, v) for k, v in selected.items() if k in wanted)
+
+    results = OrderedDict()
+    for name, call in selected.items():
+        results[name] = run_concurrent(call, args.requests, args.concurrency)
+        r = results[name]
+        print(
+            f"{name:<24} {r['throughput_rps']:>9.1f} req/s  p50 {r['p50_ms']:>8.2f}ms  "
+            f"p95 {r['p95_ms']:>8.2f}ms  p99 {r['p99_ms']:>8.2f}ms  errors {r['errors']}"
+        )
+
+    server.shutdown()
+    stub.stop()
+
+    report = {
+        "environment": environment(),
+        "config": {
+            "database": database_url.split(":")[0],
+            "users": args.users,
+            "stores": args.stores,
+            "items_per_store": args.items_per_store,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+        },
+        "scenarios": results,
+    }
+    write_report(args.output, report)
+    print(f"\nwrote {args.output}")
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MailgunStubHandler(BaseHTTPRequestHandler):
+    # accepts every POST like the Mailgun messages API would, optionally after a delay
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.received += 1
+        if self.delay:
+            threading.Event().wait(self.delay)
+        body = b'{"id": "<stub>", "message": "Queued. Thank you."}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class MailgunStub:
+    def __init__(self, delay: float = 0.0):
+        handler = type("Handler", (MailgunStubHandler,), {"delay": delay})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.server.daemon_threads = True
+        self.server.received = 0
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/v3"
+
+    @property
+    def received(self) -> int:
+        return self.server.received
+
+    def start(self) -> "MailgunStub":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
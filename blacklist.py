@@ -1 +1,187 @@
-BLACKLIST = set()
+import heapq
+from abc import ABC, abstractmethod
+import os
+import sys
+import threading
+import warnings
+from time import time
+from typing import Dict, List, Optional, Tuple
+
+from libs.uwsgi_cache import UwsgiCache
+from models.revoked_token import RevokedTokenModel
+
+# tokens without an exp claim (e.g. refresh tokens with expiry disabled) are kept this long
+DEFAULT_TOKEN_TTL = 30 * 24 * 60 * 60
+# upper bound on the number of revoked jtis a single process keeps in memory
+DEFAULT_MAX_ENTRIES = 100000
+# how often (seconds) the database backend deletes expired rows
+PURGE_INTERVAL = 60
+
+UNKNOWN_BACKEND = "Unknown token blacklist backend '{}'."
+UWSGI_FALLBACK = (
+    "BLACKLIST_BACKEND=uwsgi outside of a uwsgi worker, revoked tokens are kept "
+    "in this process's memory instead."
+)
+BLACKLIST_FULL = (
+    "Token blacklist full at {} unexpired entries, set BLACKLIST_BACKEND=database "
+    "to keep revoked tokens in the shared database instead."
+)
+
+
+def _expiry(expires_at: Optional[int]) -> int:
+    if expires_at is None:
+        return int(time()) + DEFAULT_TOKEN_TTL
+    return int(expires_at)
+
+
+class BlacklistFull(Exception):
+    pass
+
+
+class BaseBlacklist(ABC):
+    # a revoked jti only needs to be remembered until the token itself would have expired,
+    # after that flask_jwt_extended rejects it anyway so the entry can be dropped;
+    # backends that can count their entries report them in stats as "entries"
+    name = "base"
+
+    @abstractmethod
+    def add(self, jti: str, expires_at: Optional[int] = None) -> None:
+        pass
+
+    @abstractmethod
+    def __contains__(self, jti: str) -> bool:
+        pass
+
+    def purge(self) -> int:
+        return 0
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+
+class MemoryBlacklist(BaseBlacklist):
+    # per-process store: dict for O(1) lookups plus a heap ordered by expiry for cheap purging
+    name = "memory"
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._tokens: Dict[str, int] = {}
+        self._expiry_heap: List[Tuple[int, str]] = []
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def add(self, jti: str, expires_at: Optional[int] = None) -> None:
+        expires_at = _expiry(expires_at)
+        with self._lock:
+            self._purge_locked(int(time()))
+            # at capacity the revocation is refused: dropping an unexpired entry
+            # would make its token valid again
+            if len(self._tokens) >= self.max_entries and jti not in self._tokens:
+                self.rejected += 1
+                raise BlacklistFull(BLACKLIST_FULL.format(self.max_entries))
+            self._tokens[jti] = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, jti))
+
+    def __contains__(self, jti: str) -> bool:
+        expires_at = self._tokens.get(jti)
+        return expires_at is not None and expires_at >= time()
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def purge(self) -> int:
+        with self._lock:
+            return self._purge_locked(int(time()))
+
+    def _purge_locked(self, now: int) -> int:
+        purged = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            expires_at, jti = heapq.heappop(self._expiry_heap)
+            # the jti may have been re-added with a later expiry
+            if self._tokens.get(jti) == expires_at:
+                del self._tokens[jti]
+                purged += 1
+        return purged
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+            "rejected": self.rejected,
+            "bytes": sys.getsizeof(self._tokens) + sys.getsizeof(self._expiry_heap),
+        }
+
+
+class DatabaseBlacklist(BaseBlacklist):
+    # shared by every worker through the configured database (SQLite or Postgres)
+    name = "database"
+
+    def __init__(self, purge_interval: int = PURGE_INTERVAL):
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    def add(self, jti: str, expires_at: Optional[int] = None) -> None:
+        RevokedTokenModel(jti, _expiry(expires_at)).save_to_db()
+        if time() - self._last_purge > self.purge_interval:
+            self.purge()
+
+    def __contains__(self, jti: str) -> bool:
+        return RevokedTokenModel.is_revoked(jti)
+
+    def __len__(self) -> int:
+        return RevokedTokenModel.count()
+
+    def purge(self) -> int:
+        self._last_purge = time()
+        return RevokedTokenModel.purge_expired()
+
+    def stats(self) -> Dict:
+        return {"backend": self.name, "entries": len(self)}
+
+
+class UwsgiBlacklist(BaseBlacklist):
+    # shared memory cache across all uwsgi workers, uwsgi expires entries on its own
+    # see the cache2 "blacklist" entry in uwsgi.ini for its size
+    name = "uwsgi"
+
+    def __init__(self, cache_name: str = "blacklist"):
+        self._cache = UwsgiCache(cache_name)
+        self._added = 0
+
+    def add(self, jti: str, expires_at: Optional[int] = None) -> None:
+        ttl = _expiry(expires_at) - int(time())
+        if ttl > 0:
+            self._cache.set(jti, b"1", ttl)
+            self._added += 1
+
+    def __contains__(self, jti: str) -> bool:
+        return self._cache.exists(jti)
+
+    def stats(self) -> Dict:
+        # uwsgi does not expose a cheap item count, so no __len__; this is only what
+        # this worker added, other workers' and expired entries are not in it
+        return {"backend": self.name, "added_by_worker": self._added}
+
+
+BACKENDS = {
+    MemoryBlacklist.name: MemoryBlacklist,
+    DatabaseBlacklist.name: DatabaseBlacklist,
+    UwsgiBlacklist.name: UwsgiBlacklist,
+}
+
+
+def create_blacklist(backend: str = None) -> BaseBlacklist:
+    backend = backend or os.environ.get("BLACKLIST_BACKEND", MemoryBlacklist.name)
+    # BLACKLIST is created at import, also by `flask` commands and scripts run
+    # outside uwsgi with uwsgi.ini's environment; they only have the one process
+    if backend == UwsgiBlacklist.name and not UwsgiCache.available():
+        warnings.warn(UWSGI_FALLBACK, RuntimeWarning)
+        backend = MemoryBlacklist.name
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(UNKNOWN_BACKEND.format(backend))
+
+
+BLACKLIST = create_blacklist()
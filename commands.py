@@ -0,0 +1,203 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+
+from db import db
+
+
+def _widen_column(table: str, column: str, length: int) -> None:
+    # SQLite does not enforce VARCHAR lengths, only Postgres needs the ALTER
+    if db.engine.dialect.name != "postgresql":
+        return
+    for info in inspect(db.engine).get_columns(table):
+        if info["name"] == column and (info["type"].length or length) < length:
+            db.session.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE VARCHAR({length})"
+            )
+            db.session.commit()
+            click.echo(f"widened {table}.{column} to VARCHAR({length})")
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db() -> None:
+    """Create missing tables, run once per deployment before starting workers."""
+    # create_app has imported every model by now, so the metadata is complete
+    db.create_all()
+    click.echo("tables up to date")
+
+
+@click.command("migrate-passwords")
+@click.option("--batch-size", default=500, show_default=True)
+@with_appcontext
+def migrate_passwords(batch_size: int) -> None:
+    """Hash every password still stored in plain text."""
+    from libs.passwords import hash_password, is_hashed
+    from models.user import UserModel
+
+    _widen_column(UserModel.__tablename__, "password", 255)
+
+    migrated, last_id = 0, 0
+    while True:
+        rows = (
+            db.session.query(UserModel.id, UserModel.password)
+            .filter(UserModel.id > last_id)
+            .order_by(UserModel.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = [
+            {"id": row.id, "password": hash_password(row.password)}
+            for row in rows
+            if not is_hashed(row.password)
+        ]
+        db.session.bulk_update_mappings(UserModel, updates)
+        db.session.commit()
+        migrated += len(updates)
+    click.echo(f"hashed {migrated} plaintext passwords")
+
+
+@click.command("backfill-confirmed")
+@with_appcontext
+def backfill_confirmed() -> None:
+    """Add users.confirmed if missing and fill it from confirmation_model."""
+    from models.confirmation import ConfirmationModel
+    from models.user import UserModel
+
+    table = UserModel.__tablename__
+    if "confirmed" not in {c["name"] for c in inspect(db.engine).get_columns(table)}:
+        db.session.execute(
+            f"ALTER TABLE {table} ADD COLUMN confirmed BOOLEAN NOT NULL DEFAULT false"
+        )
+        click.echo(f"added {table}.confirmed")
+
+    # a user counts as confirmed once any of their confirmations was confirmed,
+    # resending is refused after that so it is always the most recent one
+    confirmed = (
+        db.session.query(ConfirmationModel.id)
+        .filter(
+            ConfirmationModel.user_id == UserModel.id,
+            ConfirmationModel.confirmed.is_(True),
+        )
+        .exists()
+    )
+    updated = UserModel.query.filter(UserModel.confirmed.is_(False), confirmed).update(
+        {UserModel.confirmed: True}, synchronize_session=False
+    )
+    db.session.commit()
+    click.echo(f"marked {updated} users as confirmed")
+
+
+@click.command("sweep-confirmations")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option(
+    "--grace",
+    default=24 * 60 * 60,
+    show_default=True,
+    help="Seconds past expiry before a confirmation is deleted.",
+)
+@with_appcontext
+def sweep_confirmations(batch_size: int, grace: int) -> None:
+    """Delete expired and superseded, unconfirmed confirmations."""
+    from models.confirmation import ConfirmationModel
+
+    deleted = ConfirmationModel.delete_expired(batch_size, grace)
+    click.echo(f"deleted {deleted} expired confirmations")
+
+
+@click.command("prune-changes")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option(
+    "--retention",
+    type=int,
+    help="Seconds of changes to keep, defaults to CHANGE_LOG_RETENTION.",
+)
+@with_appcontext
+def prune_changes(batch_size: int, retention: int) -> None:
+    """Delete change feed entries older than the retention period."""
+    from flask import current_app
+    from models.change_log import ChangeLogModel
+
+    if retention is None:
+        retention = current_app.config["CHANGE_LOG_RETENTION"]
+    deleted = ChangeLogModel.delete_older_than(retention, batch_size)
+    click.echo(f"deleted {deleted} changes")
+
+
+@click.command("purge-outbox")
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option(
+    "--retention",
+    type=int,
+    help="Seconds to keep finished messages, defaults to MAIL_OUTBOX_RETENTION.",
+)
+@with_appcontext
+def purge_outbox(batch_size: int, retention: int) -> None:
+    """Delete sent and abandoned emails older than the retention period."""
+    from flask import current_app
+    from models.outbox import OutboxModel
+
+    if retention is None:
+        retention = current_app.config["MAIL_OUTBOX_RETENTION"]
+    deleted = OutboxModel.delete_finished(retention, batch_size)
+    click.echo(f"deleted {deleted} outbox messages")
+
+
+@click.command("rebuild-store-stats")
+@with_appcontext
+def rebuild_store_stats() -> None:
+    """Recompute the per store item statistics from the items table."""
+    from models.store_stats import StoreStatsModel
+
+    rebuilt = StoreStatsModel.rebuild()
+    click.echo(f"rebuilt statistics of {rebuilt} stores")
+
+
+@click.command("check-store-stats")
+@with_appcontext
+def check_store_stats() -> None:
+    """Compare the per store item statistics with the items table."""
+    from models.store_stats import StoreStatsModel
+
+    mismatches = StoreStatsModel.check()
+    for store_id, stored, computed in mismatches:
+        click.echo(f"store {store_id}: stored {stored}, items say {computed}")
+    if mismatches:
+        raise click.ClickException(
+            f"{len(mismatches)} stores out of date, run `flask rebuild-store-stats`"
+        )
+    click.echo("store statistics match the items")
+
+
+@click.command("create-indexes")
+@with_appcontext
+def create_indexes() -> None:
+    """Create indexes declared on the models that are missing from existing tables."""
+    # db.create_all only creates indexes together with new tables
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=db.engine)
+                click.echo(f"created {index.name}")
+    click.echo("indexes up to date")
+
+
+def init_app(app) -> None:
+    # available through the flask cli, e.g. FLASK_APP=run flask migrate-passwords
+    app.cli.add_command(init_db)
+    app.cli.add_command(migrate_passwords)
+    app.cli.add_command(backfill_confirmed)
+    app.cli.add_command(sweep_confirmations)
+    app.cli.add_command(prune_changes)
+    app.cli.add_command(purge_outbox)
+    app.cli.add_command(rebuild_store_stats)
+    app.cli.add_command(check_store_stats)
+    app.cli.add_command(create_indexes)
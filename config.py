@@ -0,0 +1,58 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class Config:
+    # settings shared by every environment, read from the environment when this
+    # module is imported
+    SECRET_KEY = os.environ.get("APP_SECRET_KEY")  # aka app.config['JWT_SECRET_KEY']
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # allow libraries to raise their own exceptions
+    PROPAGATE_EXCEPTIONS = True
+
+    JWT_BLACKLIST_ENABLED = True
+    JWT_BLACKLIST_TOKEN_CHECKS = ["access", "refresh"]
+    # put the user's identity claims in access tokens so authenticated requests never
+    # look the user up; a changed or deleted user keeps them until the token expires
+    JWT_EMBED_USER_CLAIMS = _env_bool("JWT_EMBED_USER_CLAIMS", False)
+
+    # users allowed on the /admin endpoints, comma separated ids
+    ADMIN_USER_IDS = {
+        int(user_id)
+        for user_id in os.environ.get("ADMIN_USER_IDS", "").split(",")
+        if user_id.strip()
+    }
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    # `python app.py` has always read DATABASE_URI
+    SQLALCHEMY_DATABASE_URI = (
+        os.environ.get("DATABASE_URI") or Config.SQLALCHEMY_DATABASE_URI
+    )
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SECRET_KEY = "testing"
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+
+CONFIGS = {
+    "production": ProductionConfig,
+    "development": DevelopmentConfig,
+    "testing": TestingConfig,
+}
@@ -1,18 +1,8 @@
-import sqlite3
+# creates every table declared by the models, same as `FLASK_APP=run flask init-db`
+from app import create_app
+from db import db
 
-connection = sqlite3.connect("data.db")
-cursor = connection.cursor()
+app = create_app()
 
-create_table = "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, username text, password text)"
-cursor.execute(create_table)
-
-create_table = (
-    "CREATE TABLE IF NOT EXISTS items (id INTEGER PRIMARY KEY, name text, price text)"
-)
-cursor.execute(create_table)
-
-cursor.execute('INSERT INTO items VALUES (1, "test", 10.99)')
-
-connection.commit()
-
-connection.close()
+with app.app_context():
+    db.create_all()
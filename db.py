@@ -1,3 +1,110 @@
-from flask_sqlalchemy import SQLAlchemy
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
 
-db = SQLAlchemy()
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import Select
+
+# keys in db.session.info, the session is scoped to the thread/request
+UOW_DEPTH = "unit_of_work_depth"
+UOW_ROLLBACK_ONLY = "unit_of_work_rollback_only"
+UOW_AFTER_COMMIT = "unit_of_work_after_commit"
+# engine SELECTs of this session go to, set by libs/replicas.py for read-only requests
+READ_BIND = "read_bind"
+# set by read_only (libs/replicas.py) for requests that never write
+READ_ONLY = "read_only"
+
+
+class RoutingSession(SignallingSession):
+    # SELECTs go to the session's read bind (a replica) while there is one; the first
+    # flush or other statement goes to the primary and drops the read bind, so the
+    # rest of the session reads its own writes
+    def get_bind(self, mapper=None, clause=None):
+        read_bind = self.info.get(READ_BIND)
+        if read_bind is not None:
+            if isinstance(clause, Select) and not self._flushing:
+                return read_bind
+            self.info[READ_BIND] = None
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def in_unit_of_work() -> bool:
+    return db.session.info.get(UOW_DEPTH, 0) > 0
+
+
+def save_changes() -> None:
+    # what the models' save_to_db/delete_from_db call: commit straight away when used
+    # on their own (scripts, single writes), but only flush inside a unit of work so
+    # ids get assigned and the outermost unit of work commits everything at once
+    if in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    # run callback once the current changes are committed, e.g. cache invalidation
+    # dropped without running when the unit of work rolls back
+    if in_unit_of_work():
+        db.session.info.setdefault(UOW_AFTER_COMMIT, []).append(callback)
+    else:
+        callback()
+
+
+def mark_rollback_only() -> None:
+    db.session.info[UOW_ROLLBACK_ONLY] = True
+
+
+@contextmanager
+def unit_of_work():
+    # groups every save_to_db/delete_from_db inside the block into one transaction,
+    # nested blocks join the outer one, which commits (or rolls back on an exception
+    # or mark_rollback_only) when it exits
+    info = db.session.info
+    outermost = info.get(UOW_DEPTH, 0) == 0
+    info[UOW_DEPTH] = info.get(UOW_DEPTH, 0) + 1
+    try:
+        yield db.session
+        if outermost:
+            if info.pop(UOW_ROLLBACK_ONLY, False):
+                db.session.rollback()
+            else:
+                db.session.commit()
+                for callback in info.pop(UOW_AFTER_COMMIT, []):
+                    callback()
+    except BaseException:
+        if outermost:
+            db.session.rollback()
+        raise
+    finally:
+        info[UOW_DEPTH] -= 1
+        if outermost:
+            info.pop(UOW_ROLLBACK_ONLY, None)
+            info.pop(UOW_AFTER_COMMIT, None)
+
+
+def transactional(func):
+    # resource method decorator: the whole request is one unit of work, responses with
+    # a 5xx status roll back whatever the method had staged
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with unit_of_work():
+            response = func(*args, **kwargs)
+            if isinstance(response, tuple) and len(response) > 1:
+                status = response[1]
+            else:
+                status = getattr(response, "status_code", 200)
+            if status >= 500:
+                mark_rollback_only()
+            return response
+
+    return wrapper
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import traceback
+from io import BytesIO
+
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Response
+
+from libs.change_feed import FEED_PATH, EventStreamResponse, change_feed
+from libs.mail_dispatcher import dispatcher
+from libs.mailgun import Mailgun
+
+# httpx is optional, without it mail keeps going out from the dispatcher threads
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class AsgiApp:
+    # serves the flask app from an event loop (see asgi.py): connections wait on the
+    # loop for one of a fixed number of threads instead of each holding a server
+    # thread, so a process keeps far more requests in flight than it has threads.
+    # The resources stay synchronous, Flask-SQLAlchemy 2 and psycopg2 have no async
+    # API, the DB work of a request still runs on one of the threads.
+    def __init__(self, app):
+        # threads past the connection pool size would only wait for a connection
+        pooled = int(os.environ.get("DB_POOL_SIZE", 8)) + int(
+            os.environ.get("DB_MAX_OVERFLOW", 2)
+        )
+        app.config.setdefault(
+            "ASGI_THREADS", int(os.environ.get("ASGI_THREADS", pooled))
+        )
+        app.config.setdefault(
+            "ASGI_ASYNC_MAIL", httpx is not None and _env_bool("ASGI_ASYNC_MAIL", True)
+        )
+        self.app = app
+        self.wsgi = WSGIMiddleware(app, workers=app.config["ASGI_THREADS"])
+        self._mail_task = None
+        self._feed_task = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http" and scope["path"] == FEED_PATH:
+            await self.event_stream(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception:
+                    await send(
+                        {
+                            "type": "lifespan.startup.failed",
+                            "message": traceback.format_exc(),
+                        }
+                    )
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def startup(self) -> None:
+        # runs in every server worker process after it started, the dispatcher then
+        # sends from this loop and does not start its threads
+        if self.app.config["ASGI_ASYNC_MAIL"]:
+            self._mail_task = asyncio.ensure_future(
+                dispatcher.run_async(self.wsgi.executor)
+            )
+        # the change feed poller, subscribers then wait on this loop, not on threads
+        self._feed_task = asyncio.ensure_future(
+            change_feed.run_async(self.wsgi.executor)
+        )
+
+    async def shutdown(self) -> None:
+        # open event streams keep the server from reaching this, run it with e.g.
+        # --timeout-graceful-shutdown 5 (uvicorn) so they are cancelled first
+        if self._feed_task is not None:
+            change_feed.stop()
+            await self._feed_task
+            self._feed_task = None
+        if self._mail_task is not None:
+            dispatcher.stop()
+            await self._mail_task
+            self._mail_task = None
+        await Mailgun.close_async_client()
+        self.wsgi.executor.shutdown(wait=False)
+
+    async def event_stream(self, scope, receive, send) -> None:
+        # the request goes through flask on a thread (authentication, arguments and
+        # errors as for any other route), an event stream response is then served
+        # from the loop instead of iterating its threaded stream
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self.wsgi.executor, self._dispatch, scope)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": [
+                    (name.lower().encode("latin1"), value.encode("latin1"))
+                    for name, value in response.headers.items()
+                ],
+            }
+        )
+        if not isinstance(response, EventStreamResponse):
+            await send({"type": "http.response.body", "body": response.get_data()})
+            return
+
+        response.close()
+        disconnected = asyncio.ensure_future(self._disconnect(receive))
+        try:
+            # a client that went away is noticed by the next event or heartbeat
+            async for chunk in change_feed.stream_async(
+                response.after_id, self.wsgi.executor
+            ):
+                if disconnected.done():
+                    return
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            disconnected.cancel()
+
+    def _dispatch(self, scope) -> Response:
+        with self.app.request_context(build_environ(scope, BytesIO())):
+            try:
+                return self.app.full_dispatch_request()
+            except Exception as error:
+                return self.app.handle_exception(error)
+
+    @staticmethod
+    async def _disconnect(receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
@@ -0,0 +1,92 @@
+import csv
+import io
+import json
+from typing import Dict, Iterator, List, Tuple
+
+from flask import request
+
+INVALID_JSON = "Invalid JSON."
+NOT_AN_OBJECT = "Expected a JSON object."
+NOT_AN_ARRAY = "Expected a JSON array of objects."
+UNSUPPORTED_CONTENT_TYPE = (
+    "Unsupported content type, use application/json, application/x-ndjson or text/csv."
+)
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+CSV_TYPES = ("text/csv",)
+JSON_TYPES = ("application/json",)
+
+# (row number, parsed row or None, error messages or None)
+ParsedRow = Tuple[int, Dict, Dict]
+
+
+class UnsupportedBody(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+def iter_request_rows() -> Iterator[ParsedRow]:
+    # yields rows of the request body one at a time, ndjson and csv bodies are read
+    # from the input stream line by line so the whole upload is never held in memory
+    content_type = request.mimetype
+    if content_type in NDJSON_TYPES:
+        return _iter_ndjson(_text_stream())
+    if content_type in CSV_TYPES:
+        return _iter_csv(_text_stream())
+    if content_type in JSON_TYPES:
+        return _iter_json_array(request.get_json())
+    raise UnsupportedBody(UNSUPPORTED_CONTENT_TYPE)
+
+
+def chunked(rows: Iterator[ParsedRow], size: int) -> Iterator[List[ParsedRow]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _text_stream() -> io.TextIOWrapper:
+    return io.TextIOWrapper(request.stream, encoding=request.charset or "utf-8")
+
+
+def _iter_json_array(data) -> Iterator[ParsedRow]:
+    if not isinstance(data, list):
+        raise UnsupportedBody(NOT_AN_ARRAY)
+    for number, row in enumerate(data):
+        if isinstance(row, dict):
+            yield number, row, None
+        else:
+            yield number, None, {"_schema": [NOT_AN_OBJECT]}
+
+
+def _iter_ndjson(stream: io.TextIOWrapper) -> Iterator[ParsedRow]:
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, {"_schema": [INVALID_JSON]}
+        else:
+            if isinstance(row, dict):
+                yield number, row, None
+            else:
+                yield number, None, {"_schema": [NOT_AN_OBJECT]}
+        number += 1
+
+
+def _iter_csv(stream: io.TextIOWrapper) -> Iterator[ParsedRow]:
+    # header row names the columns, e.g. name,price,store_id
+    for number, row in enumerate(csv.DictReader(stream)):
+        # drop empty cells so the schema reports them as missing rather than invalid
+        row = {
+            key: value
+            for key, value in row.items()
+            if key is not None and value not in ("", None)
+        }
+        yield number, row, None
@@ -0,0 +1,176 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, Hashable, Optional
+
+from sqlalchemy.orm import make_transient_to_detached
+
+from db import db
+from libs.uwsgi_cache import UwsgiCache
+
+UNKNOWN_BACKEND = "Unknown cache backend '{}'."
+
+
+class NullCache:
+    # used when caching is switched off, every lookup is a miss
+    name = "none"
+
+    def __init__(self, *args, **kwargs):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        self.misses += 1
+        return None
+
+    def set(self, key: Hashable, value: Dict) -> None:
+        pass
+
+    def delete(self, key: Hashable) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def __len__(self) -> int:
+        return 0
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class LRUCache(NullCache):
+    # per-process least recently used cache with a time to live on every entry
+    # other processes do not see invalidations, so keep the ttl short when running
+    # several workers or use the uwsgi backend
+    name = "memory"
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30, **kwargs):
+        super().__init__()
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Dict) -> None:
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "max_size": self.max_size, "ttl": self.ttl}
+
+
+class SharedCache(NullCache):
+    # json values in a uwsgi cache2 store shared by all workers, so an invalidation
+    # in one worker is seen by every other one; size and lru eviction are configured
+    # in uwsgi.ini, counters are per process
+    name = "uwsgi"
+
+    def __init__(
+        self, prefix: str, ttl: float = 30, cache_name: str = "models", **kwargs
+    ):
+        super().__init__()
+        self.prefix = prefix
+        self.ttl = ttl
+        self._cache = UwsgiCache(cache_name)
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.prefix}:{key}"
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        raw = self._cache.get(self._key(key))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: Hashable, value: Dict) -> None:
+        self._cache.set(self._key(key), json.dumps(value).encode(), self.ttl)
+
+    def delete(self, key: Hashable) -> None:
+        self._cache.delete(self._key(key))
+
+
+BACKENDS = {
+    NullCache.name: NullCache,
+    LRUCache.name: LRUCache,
+    SharedCache.name: SharedCache,
+}
+
+# every cache created here, keyed by name, so their counters can be reported together
+CACHES: Dict[str, NullCache] = {}
+
+
+def create_cache(name: str, backend: str = None) -> NullCache:
+    # configured from the environment, e.g. MODEL_CACHE_BACKEND=memory MODEL_CACHE_SIZE=5000
+    backend = backend or os.environ.get("MODEL_CACHE_BACKEND", NullCache.name)
+    try:
+        cache_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(UNKNOWN_BACKEND.format(backend))
+
+    cache = cache_class(
+        prefix=name,
+        max_size=int(os.environ.get("MODEL_CACHE_SIZE", 1024)),
+        ttl=float(os.environ.get("MODEL_CACHE_TTL", 30)),
+    )
+    CACHES[name] = cache
+    return cache
+
+
+def cache_row(model) -> Dict:
+    # plain column values, enough to rebuild the model without touching the database
+    return {
+        column.name: getattr(model, column.name) for column in model.__table__.columns
+    }
+
+
+def restore_row(model_class, row: Dict):
+    # turn a cached row back into a persistent instance attached to the current session,
+    # marked clean so it only hits the database if it is modified or lazily loads a relation
+    instance = model_class(**row)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
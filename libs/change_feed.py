@@ -0,0 +1,293 @@
+import asyncio
+import os
+import threading
+import traceback
+from collections import deque
+from time import time
+from typing import AsyncIterator, Deque, Iterator, List, Optional, Tuple
+
+from flask import Response
+
+from db import db
+from libs import sqlite
+from models.change_log import ChangeLogModel
+
+# url of the feed, the ASGI entry point serves it from the event loop
+FEED_PATH = "/changes"
+# tells EventSource clients to reconnect after a second when a stream ends
+RETRY = b"retry: 1000\n\n"
+# a comment line, keeps proxies from closing idle connections
+HEARTBEAT = b": heartbeat\n\n"
+
+Event = Tuple[int, bytes]
+
+
+def format_event(change: ChangeLogModel) -> bytes:
+    # the row column is json already, "event" lets clients listen per table
+    return (
+        f"id: {change.id}\nevent: {change.table}\n"
+        f'data: {{"seq": {change.id}, "op": "{change.op}", "row": {change.row}}}\n\n'
+    ).encode()
+
+
+def reset_event(seq: int) -> Event:
+    # the changes after the client's id were deleted (see `flask prune-changes`),
+    # it has to fetch the lists again and resume from seq
+    return seq, f'id: {seq}\nevent: reset\ndata: {{"seq": {seq}}}\n\n'.encode()
+
+
+class EventStreamResponse(Response):
+    # after_id is where the stream starts, libs/asgi.py serves these from the event
+    # loop instead of iterating the threaded stream
+    def __init__(self, stream: Iterator[bytes], after_id: int):
+        super().__init__(
+            stream,
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            direct_passthrough=True,
+        )
+        self.after_id = after_id
+
+
+class ChangeFeed:
+    # streams the change_log table to subscribers as server-sent events
+    #
+    # one poller per process reads the new rows and keeps the latest of them in
+    # memory, subscribers are served from there: the table is read once per poll
+    # however many clients are connected, and otherwise only by clients catching up
+    # from further back than the buffer reaches
+    #
+    # a WSGI server (uwsgi.ini) would hold a thread per subscriber and kill it at
+    # harakiri, so there each request gets the changes after its Last-Event-ID and
+    # the response ends, the clients reconnect a second later; the ASGI entry point
+    # (asgi.py) keeps the streams open on the event loop, with no thread per client
+    def __init__(self, app=None):
+        self.app = None
+        self.last_id: Optional[int] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._changed = threading.Condition()
+        self._events: Deque[Event] = deque()
+        # every change after this id is in _events
+        self._floor = 0
+        # set while run_async polls from an event loop instead of a thread
+        self._async_changed: Optional[asyncio.Event] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault(
+            "CHANGE_FEED_POLL_INTERVAL",
+            float(os.environ.get("CHANGE_FEED_POLL_INTERVAL", 0.5)),
+        )
+        # changes kept in memory per process
+        app.config.setdefault(
+            "CHANGE_FEED_BUFFER_SIZE",
+            int(os.environ.get("CHANGE_FEED_BUFFER_SIZE", 10000)),
+        )
+        app.config.setdefault("CHANGE_FEED_BATCH_SIZE", 500)
+        app.config.setdefault("CHANGE_FEED_HEARTBEAT", 15.0)
+        # seconds a WSGI request waits for a change when there is none yet, keep it
+        # well under uwsgi's harakiri; every waiting subscriber holds a thread
+        app.config.setdefault(
+            "CHANGE_FEED_WSGI_WAIT", float(os.environ.get("CHANGE_FEED_WSGI_WAIT", 0))
+        )
+        # seconds to wait for a missing id, a transaction that took its id before
+        # a later one committed; ids skipped by a rollback are passed after that
+        app.config.setdefault("CHANGE_FEED_GAP_TIMEOUT", 5.0)
+        # `flask prune-changes` deletes older changes
+        app.config.setdefault(
+            "CHANGE_LOG_RETENTION",
+            int(os.environ.get("CHANGE_LOG_RETENTION", 7 * 24 * 60 * 60)),
+        )
+        self.app = app
+        self._events = deque(maxlen=app.config["CHANGE_FEED_BUFFER_SIZE"])
+
+    def response(self, after_id: Optional[int]) -> EventStreamResponse:
+        # after_id None starts at the current end of the log
+        self._ensure_started()
+        if after_id is None:
+            after_id = self.last_id
+        return EventStreamResponse(self.stream(after_id), after_id)
+
+    def _ensure_started(self) -> None:
+        # the poller is started by the first subscriber of the process, after uwsgi forked
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._start_at(self._in_context(ChangeLogModel.latest_id))
+            self._pid = os.getpid()
+            self._stopping.clear()
+            threading.Thread(target=self._run, name="change-feed", daemon=True).start()
+
+    def _start_at(self, last_id: int) -> None:
+        self._events.clear()
+        self.last_id = self._floor = last_id
+
+    def stop(self) -> None:
+        self._stopping.set()
+        with self._changed:
+            self._changed.notify_all()
+        if self._async_changed is not None:
+            self._async_changed.set()
+
+    def _run(self) -> None:
+        interval = self.app.config["CHANGE_FEED_POLL_INTERVAL"]
+        while not self._stopping.is_set():
+            try:
+                published = self._publish(self._in_context(self._poll))
+            except Exception:
+                traceback.print_exc()
+                published = 0
+            if not published:
+                self._stopping.wait(interval)
+
+    async def run_async(self, executor) -> None:
+        # the ASGI server's replacement for the poller thread, the reads run on the
+        # executor and the subscribers are woken on the loop
+        loop = asyncio.get_running_loop()
+        last_id = await loop.run_in_executor(
+            executor, self._in_context, ChangeLogModel.latest_id
+        )
+        with self._lock:
+            self._start_at(last_id)
+            # keeps _ensure_started from starting the thread in this process
+            self._pid = os.getpid()
+        self._stopping.clear()
+        self._async_changed = asyncio.Event()
+        interval = self.app.config["CHANGE_FEED_POLL_INTERVAL"]
+        try:
+            while not self._stopping.is_set():
+                try:
+                    rows = await loop.run_in_executor(
+                        executor, self._in_context, self._poll
+                    )
+                    published = self._publish(rows)
+                except Exception:
+                    traceback.print_exc()
+                    published = 0
+                if not published:
+                    await asyncio.sleep(interval)
+        finally:
+            self._async_changed = None
+
+    def _in_context(self, func):
+        # only ever reads, on SQLite without queueing for the write lock
+        with self.app.app_context(), sqlite.reading():
+            try:
+                return func()
+            finally:
+                db.session.remove()
+
+    def _poll(self) -> List[ChangeLogModel]:
+        return ChangeLogModel.after(
+            self.last_id, self.app.config["CHANGE_FEED_BATCH_SIZE"]
+        )
+
+    def _publish(self, rows: List[ChangeLogModel]) -> int:
+        # rows are published in id order without holes, so a client resuming from
+        # an id has seen every change before it
+        gap_timeout = self.app.config["CHANGE_FEED_GAP_TIMEOUT"]
+        expected = self.last_id + 1
+        ready = []
+        for row in rows:
+            if row.id != expected and time() - row.created_at < gap_timeout:
+                break
+            ready.append((row.id, format_event(row)))
+            expected = row.id + 1
+        if not ready:
+            return 0
+
+        with self._changed:
+            for event in ready:
+                if len(self._events) == self._events.maxlen:
+                    self._floor = self._events[0][0]
+                self._events.append(event)
+            self.last_id = ready[-1][0]
+            self._changed.notify_all()
+        if self._async_changed is not None:
+            # run_async publishes on the loop, every waiting subscriber wakes up
+            self._async_changed.set()
+            self._async_changed.clear()
+        return len(ready)
+
+    def _take(self, after_id: int) -> Optional[List[Event]]:
+        # the buffered changes after after_id, None when the buffer does not reach back
+        with self._changed:
+            if after_id < self._floor:
+                return None
+            events = []
+            for event in reversed(self._events):
+                if event[0] <= after_id:
+                    break
+                events.append(event)
+        events.reverse()
+        return events
+
+    def _catch_up(self, after_id: int) -> List[Event]:
+        # a page of changes from the table, for clients further behind than the buffer
+        until_id = self.last_id
+
+        def read() -> List[Event]:
+            oldest = ChangeLogModel.oldest_id()
+            if oldest is None or oldest > after_id + 1:
+                return [reset_event(until_id)]
+            rows = ChangeLogModel.after(
+                after_id, self.app.config["CHANGE_FEED_BATCH_SIZE"], until_id
+            )
+            if not rows:
+                # only holes up to until_id, move the client past them
+                return [(until_id, b"")]
+            return [(row.id, format_event(row)) for row in rows]
+
+        return self._in_context(read)
+
+    def stream(self, after_id: int) -> Iterator[bytes]:
+        # the WSGI answer: the changes after after_id, then the response ends and the
+        # client reconnects after RETRY with its Last-Event-ID (long polling);
+        # with none yet it waits at most CHANGE_FEED_WSGI_WAIT seconds for one
+        yield RETRY
+        events = self._events_after(after_id)
+        if not events and self.app.config["CHANGE_FEED_WSGI_WAIT"] > 0:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: self.last_id > after_id or self._stopping.is_set(),
+                    self.app.config["CHANGE_FEED_WSGI_WAIT"],
+                )
+            events = self._events_after(after_id)
+        if events:
+            yield b"".join(data for _, data in events)
+        else:
+            # an id alone sets the client's Last-Event-ID, the next request resumes here
+            yield f"id: {after_id}\n\n".encode()
+
+    def _events_after(self, after_id: int) -> List[Event]:
+        events = self._take(after_id)
+        if events is None:
+            events = self._catch_up(after_id)
+        return events
+
+    async def stream_async(self, after_id: int, executor) -> AsyncIterator[bytes]:
+        # the event loop version of stream, waiting costs no thread
+        loop = asyncio.get_running_loop()
+        heartbeat = self.app.config["CHANGE_FEED_HEARTBEAT"]
+        yield RETRY
+        while not self._stopping.is_set():
+            events = self._take(after_id)
+            if events is None:
+                events = await loop.run_in_executor(executor, self._catch_up, after_id)
+            if events:
+                after_id = events[-1][0]
+                yield b"".join(data for _, data in events)
+                continue
+
+            try:
+                await asyncio.wait_for(self._async_changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield HEARTBEAT
+
+
+change_feed = ChangeFeed()
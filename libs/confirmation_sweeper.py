@@ -0,0 +1,70 @@
+import os
+import random
+import threading
+import traceback
+
+from db import db
+from models.confirmation import ConfirmationModel
+
+
+class ConfirmationSweeper:
+    # optional background thread deleting expired confirmations every few minutes,
+    # the same work as `flask sweep-confirmations` for deployments without a cron
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        # seconds between sweeps, 0 leaves sweeping to the cli command
+        app.config.setdefault(
+            "CONFIRMATION_SWEEP_INTERVAL",
+            int(os.environ.get("CONFIRMATION_SWEEP_INTERVAL", 0)),
+        )
+        app.config.setdefault("CONFIRMATION_SWEEP_BATCH_SIZE", 1000)
+        # keep expired rows around for a while, e.g. to answer "link expired" correctly
+        app.config.setdefault("CONFIRMATION_SWEEP_GRACE", 24 * 60 * 60)
+        self.app = app
+        if app.config["CONFIRMATION_SWEEP_INTERVAL"]:
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self) -> None:
+        # one thread per process, started after uwsgi forked the worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(
+                target=self._run, name="confirmation-sweeper", daemon=True
+            ).start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def sweep(self) -> int:
+        config = self.app.config
+        with self.app.app_context():
+            try:
+                return ConfirmationModel.delete_expired(
+                    config["CONFIRMATION_SWEEP_BATCH_SIZE"],
+                    config["CONFIRMATION_SWEEP_GRACE"],
+                )
+            finally:
+                db.session.remove()
+
+    def _run(self) -> None:
+        interval = self.app.config["CONFIRMATION_SWEEP_INTERVAL"]
+        # spread the workers out so they do not all sweep at the same moment
+        while not self._stopping.wait(interval * random.uniform(0.5, 1.5)):
+            try:
+                self.sweep()
+            except Exception:
+                traceback.print_exc()
+
+
+sweeper = ConfirmationSweeper()
@@ -0,0 +1,112 @@
+import os
+from time import perf_counter
+from typing import Dict
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool, QueuePool
+
+from libs import sqlite
+from libs.metrics import registry
+
+POOL_WAIT_TIME = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection."
+)
+POOL_TIMEOUTS = registry.counter(
+    "db_pool_checkout_timeouts_total", "Checkouts that gave up after pool_timeout."
+)
+FORKED_CONNECTIONS = registry.counter(
+    "db_pool_forked_connections_total",
+    "Connections inherited from a parent process and discarded on checkout.",
+)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited for a free connection
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT_TIME.observe(perf_counter() - start)
+
+
+def engine_options(database_uri: str) -> Dict:
+    # sizing is per process: uwsgi runs 8 processes, so the database sees up to
+    # 8 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections, keep that under max_connections
+    options = {"pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True)}
+    if sqlite.enabled(database_uri):
+        return sqlite.engine_options(options)
+    if not database_uri or make_url(database_uri).drivername.startswith("sqlite"):
+        # SQLite connections are local files, there is nothing to size or recycle
+        return options
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 8)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 2)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        # seconds, recycle before server side idle timeouts or load balancers drop them
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    )
+    return options
+
+
+def _on_connect(dbapi_connection, connection_record) -> None:
+    connection_record.info["pid"] = os.getpid()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    # uwsgi forks workers from the master, a connection opened before the fork would
+    # otherwise be shared by several processes; drop it without closing the socket
+    # (closing would also end it for the process that really owns it)
+    pid = os.getpid()
+    if connection_record.info.get("pid", pid) != pid:
+        FORKED_CONNECTIONS.inc()
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid {}, attempting to check out in pid {}".format(
+                connection_record.info["pid"], pid
+            )
+        )
+
+
+def _pool_status():
+    from db import db
+
+    try:
+        pool = db.engine.pool
+    except RuntimeError:
+        # no application context, e.g. scraped while the app is starting
+        return []
+    if not isinstance(pool, QueuePool):
+        return []
+    return [
+        ({"state": "size"}, pool.size()),
+        ({"state": "checked_out"}, pool.checkedout()),
+        ({"state": "checked_in"}, pool.checkedin()),
+        ({"state": "overflow"}, max(pool.overflow(), 0)),
+    ]
+
+
+def init_app(app) -> None:
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS",
+        engine_options(app.config.get("SQLALCHEMY_DATABASE_URI")),
+    )
+
+    if not event.contains(Pool, "connect", _on_connect):
+        event.listen(Pool, "connect", _on_connect)
+        event.listen(Pool, "checkout", _on_checkout)
+
+    registry.callback("db_pool_connections", "Connection pool status.", _pool_status)
@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import os
+from functools import wraps
+from typing import Dict, Optional
+
+from flask import Response, current_app, request
+from flask_restful.representations.json import output_json
+from flask_restful.utils import unpack
+
+from libs.cache import CACHES, LRUCache
+from libs.metrics import registry
+from models.table_version import TableVersionModel
+
+# brotli is optional, gzip is used when it is not installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+NOT_MODIFIED = registry.counter(
+    "http_not_modified_total", "Conditional GETs answered with 304, by route."
+)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class HttpCache:
+    # ETags for GET endpoints computed from the versions of the tables a response is
+    # built from (models/table_version.py), so a conditional request costs one small
+    # query; rendered bodies and their compressed forms are kept per ETag
+    def __init__(self, app=None):
+        self.bodies = LRUCache()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault(
+            "HTTP_CACHE_ENABLED", _env_bool("HTTP_CACHE_ENABLED", True)
+        )
+        # rendered bodies kept per process, and the largest one worth keeping
+        app.config.setdefault(
+            "HTTP_CACHE_SIZE", int(os.environ.get("HTTP_CACHE_SIZE", 256))
+        )
+        app.config.setdefault("HTTP_CACHE_MAX_BODY", 1024 * 1024)
+        # bodies smaller than this are sent uncompressed, 0 turns compression off
+        app.config.setdefault(
+            "HTTP_COMPRESS_MIN_SIZE",
+            int(os.environ.get("HTTP_COMPRESS_MIN_SIZE", 1024)),
+        )
+        app.config.setdefault("HTTP_COMPRESS_LEVEL", 6)
+
+        # entries never go stale, a write changes the ETag instead
+        self.bodies = LRUCache(max_size=app.config["HTTP_CACHE_SIZE"], ttl=24 * 60 * 60)
+        CACHES["http"] = self.bodies
+
+    @staticmethod
+    def _etag(versions: Dict[str, int]) -> str:
+        key = f"{sorted(versions.items())}|{request.full_path}"
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @staticmethod
+    def _encoding() -> Optional[str]:
+        if not current_app.config["HTTP_COMPRESS_MIN_SIZE"]:
+            return None
+        offered = ["br", "gzip"] if brotli else ["gzip"]
+        return request.accept_encodings.best_match(offered)
+
+    @staticmethod
+    def _compress(body: bytes, encoding: str) -> bytes:
+        level = current_app.config["HTTP_COMPRESS_LEVEL"]
+        if encoding == "br":
+            return brotli.compress(body, quality=level)
+        return gzip.compress(body, compresslevel=level)
+
+    def _respond(self, tag: str, entry: Dict, encoding: Optional[str]) -> Response:
+        body = entry["body"]
+        if encoding and len(body) >= current_app.config["HTTP_COMPRESS_MIN_SIZE"]:
+            if encoding not in entry:
+                entry[encoding] = self._compress(body, encoding)
+            body = entry[encoding]
+        else:
+            encoding = None
+
+        response = Response(body, mimetype="application/json")
+        # the encoded forms are different bytes, so they get their own strong ETag
+        response.set_etag(f"{tag}-{encoding}" if encoding else tag)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        # may be stored, but has to be revalidated, which is what the ETag makes cheap
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @staticmethod
+    def _not_modified(etag: str) -> Response:
+        NOT_MODIFIED.inc(route=request.url_rule.rule)
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    def conditional(self, *tables: str):
+        # decorates a flask-restful GET whose response depends only on the url and on
+        # the given tables; goes below any auth decorator so auth is checked first
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not current_app.config["HTTP_CACHE_ENABLED"]:
+                    return func(*args, **kwargs)
+
+                tag = self._etag(TableVersionModel.versions(tables))
+                # "*" matches any current body, which only exists once func answered
+                # 200, a 404 has to stay a 404
+                star = request.if_none_match.star_tag
+                for etag in (tag, f"{tag}-gzip", f"{tag}-br"):
+                    if not star and request.if_none_match.contains(etag):
+                        return self._not_modified(etag)
+
+                entry = self.bodies.get(tag)
+                if entry is None:
+                    result = func(*args, **kwargs)
+                    if isinstance(result, Response):
+                        # streamed, nothing to keep
+                        return result
+                    data, code, headers = unpack(result)
+                    if code != 200:
+                        return result
+                    # rendered the same way flask-restful renders it
+                    entry = {"body": output_json(data, code, headers).get_data()}
+                    if len(entry["body"]) <= current_app.config["HTTP_CACHE_MAX_BODY"]:
+                        self.bodies.set(tag, entry)
+
+                response = self._respond(tag, entry, self._encoding())
+                if star:
+                    return self._not_modified(response.get_etag()[0])
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+http_cache = HttpCache()
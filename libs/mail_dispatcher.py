@@ -0,0 +1,239 @@
+import asyncio
+import os
+import random
+import threading
+import traceback
+from itertools import groupby
+from typing import Callable, Dict, List, Optional
+
+from db import after_commit, db
+from libs.mailgun import Mailgun, MailGunException, MAX_BATCH_RECIPIENTS
+from models.outbox import OutboxModel
+
+
+class MailDispatcher:
+    # sends emails queued in the mail_outbox table from background threads so that
+    # request threads never wait on the Mailgun API
+    #
+    # every uwsgi worker runs its own pool, the threads are started on the first request
+    # of the process because threads started before uwsgi forks do not survive the fork
+    def __init__(self, app=None):
+        self.app = None
+        self._pid = None
+        self._threads: List[threading.Thread] = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        # set while run_async drives the dispatcher from an event loop instead
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_wakeup: Optional[asyncio.Event] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault(
+            "MAIL_DISPATCHER_WORKERS", int(os.environ.get("MAIL_DISPATCHER_WORKERS", 2))
+        )
+        app.config.setdefault("MAIL_DISPATCHER_BATCH_SIZE", 100)
+        app.config.setdefault("MAIL_DISPATCHER_POLL_INTERVAL", 2.0)
+        # seconds a claimed batch stays locked to one worker
+        app.config.setdefault("MAIL_DISPATCHER_LEASE", 60)
+        app.config.setdefault("MAIL_DISPATCHER_BACKOFF_BASE", 5)
+        app.config.setdefault("MAIL_DISPATCHER_BACKOFF_MAX", 3600)
+        # `flask purge-outbox` deletes sent and abandoned messages older than this
+        app.config.setdefault(
+            "MAIL_OUTBOX_RETENTION",
+            int(os.environ.get("MAIL_OUTBOX_RETENTION", 7 * 24 * 60 * 60)),
+        )
+        self.app = app
+        app.before_request(self._ensure_started)
+
+    def enqueue(
+        self, recipient: str, subject: str, text: str, html: str, variables: Dict = None
+    ) -> OutboxModel:
+        # fail fast on missing configuration instead of queueing mail that can never be sent
+        Mailgun.check_config()
+
+        message = OutboxModel(recipient, subject, text, html, variables)
+        message.save_to_db()
+        # inside a unit of work the row is only visible to the workers once committed
+        after_commit(self.wake)
+        return message
+
+    def backoff(self, attempts: int) -> float:
+        config = self.app.config
+        delay = config["MAIL_DISPATCHER_BACKOFF_BASE"] * 2 ** (attempts - 1)
+        delay = min(delay, config["MAIL_DISPATCHER_BACKOFF_MAX"])
+        # jitter so a Mailgun outage does not end in a thundering herd of retries
+        return delay * random.uniform(0.5, 1.0)
+
+    def _ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._threads = [
+                threading.Thread(
+                    target=self._run, name=f"mail-dispatcher-{i}", daemon=True
+                )
+                for i in range(self.app.config["MAIL_DISPATCHER_WORKERS"])
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._async_wakeup.set)
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self.wake()
+
+    def _run(self) -> None:
+        interval = self.app.config["MAIL_DISPATCHER_POLL_INTERVAL"]
+        while not self._stopping.is_set():
+            try:
+                sent = self.process_once()
+            except Exception:
+                traceback.print_exc()
+                sent = 0
+            # keep draining while there is work, otherwise sleep until woken or polled
+            if not sent:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+    def process_once(self) -> int:
+        with self.app.app_context():
+            try:
+                messages = self._claim()
+                for batch in self._batches(messages):
+                    self._finish(batch, self._send(batch))
+                return len(messages)
+            finally:
+                db.session.remove()
+
+    async def run_async(self, executor) -> None:
+        # the ASGI server's replacement for the worker threads: batches are claimed and
+        # marked on the executor, the Mailgun calls of a claim go out concurrently on
+        # the event loop, a slow API no longer ties up one thread per call
+        with self._lock:
+            # keeps _ensure_started from starting the threads in this process
+            self._pid = os.getpid()
+        self._stopping.clear()
+        self._loop = asyncio.get_running_loop()
+        self._async_wakeup = asyncio.Event()
+        interval = self.app.config["MAIL_DISPATCHER_POLL_INTERVAL"]
+        try:
+            while not self._stopping.is_set():
+                try:
+                    sent = await self.process_once_async(executor)
+                except Exception:
+                    traceback.print_exc()
+                    sent = 0
+                if not sent:
+                    try:
+                        await asyncio.wait_for(self._async_wakeup.wait(), interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._async_wakeup.clear()
+        finally:
+            self._loop = self._async_wakeup = None
+
+    async def process_once_async(self, executor) -> int:
+        loop = asyncio.get_running_loop()
+        messages = await loop.run_in_executor(executor, self._in_context, self._claim)
+        batches = list(self._batches(messages))
+        errors = await asyncio.gather(*(self._send_async(batch) for batch in batches))
+
+        def finish():
+            for batch, error in zip(batches, errors):
+                self._finish(batch, error)
+
+        if batches:
+            await loop.run_in_executor(executor, self._in_context, finish)
+        return len(messages)
+
+    def _in_context(self, func: Callable):
+        with self.app.app_context():
+            try:
+                return func()
+            finally:
+                db.session.remove()
+
+    def _claim(self) -> List[OutboxModel]:
+        config = self.app.config
+        return OutboxModel.claim_batch(
+            config["MAIL_DISPATCHER_BATCH_SIZE"], config["MAIL_DISPATCHER_LEASE"]
+        )
+
+    def _finish(self, batch: List[OutboxModel], error: Optional[str]) -> None:
+        # the messages may come from a session that has been removed since the claim
+        db.session.add_all(batch)
+        if error is None:
+            OutboxModel.mark_sent(batch)
+        else:
+            OutboxModel.mark_failed(batch, error, self.backoff)
+
+    @staticmethod
+    def _batches(messages: List[OutboxModel]):
+        # messages rendered from the same template differ only by recipient variables,
+        # so they can go out as a single Mailgun batch call; Mailgun takes one set of
+        # variables per address, a second message to an address goes in another batch
+        def template(message):
+            return message.subject, message.text, message.html
+
+        for _, group in groupby(sorted(messages, key=template), key=template):
+            batches: List[List[OutboxModel]] = []
+            recipients: List[set] = []
+            for message in group:
+                for batch, seen in zip(batches, recipients):
+                    if (
+                        message.recipient not in seen
+                        and len(batch) < MAX_BATCH_RECIPIENTS
+                    ):
+                        break
+                else:
+                    batch, seen = [], set()
+                    batches.append(batch)
+                    recipients.append(seen)
+                batch.append(message)
+                seen.add(message.recipient)
+            yield from batches
+
+    @staticmethod
+    def _recipients(batch: List[OutboxModel]) -> Dict[str, Dict]:
+        # _batches puts every address in a batch once
+        return {message.recipient: message.recipient_variables for message in batch}
+
+    def _send(self, batch: List[OutboxModel]) -> Optional[str]:
+        # returns the error, None once Mailgun accepted the batch
+        # requests is only imported once mail is actually sent, see libs/mailgun.py
+        from requests import RequestException
+
+        first = batch[0]
+        try:
+            Mailgun.send_batch(
+                self._recipients(batch), first.subject, first.text, first.html
+            )
+        except (MailGunException, RequestException) as e:
+            return str(e)
+        return None
+
+    async def _send_async(self, batch: List[OutboxModel]) -> Optional[str]:
+        from httpx import HTTPError
+
+        first = batch[0]
+        try:
+            await Mailgun.send_batch_async(
+                self._recipients(batch), first.subject, first.text, first.html
+            )
+        except (MailGunException, HTTPError) as e:
+            return str(e) or type(e).__name__
+        return None
+
+
+dispatcher = MailDispatcher()
@@ -1,11 +1,23 @@
+import json
 import os
-from typing import List
-from requests import Response, post
+import threading
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, List
+
+from libs.metrics import MAIL_SEND_TIME
+
+# requests takes a noticeable part of startup, it is imported by the first send
+if TYPE_CHECKING:
+    from httpx import AsyncClient, Response as HttpxResponse
+    from requests import Response, Session
 
 ERROR_SENDING_EMAIL = "Error in sending confirmation email, user registration failed."
 FAILED_LOAD_DOMAIN = "Failed to load MailGun domain."
 FAILED_LOAD_API_KEY = "Failed to load MailGun API key."
 
+# Mailgun accepts at most 1000 recipients per batch message
+MAX_BATCH_RECIPIENTS = 1000
+
 
 class MailGunException(Exception):
     def __init__(self, message: str):
@@ -15,33 +27,134 @@ class MailGunException(Exception):
 class Mailgun:
     MAILGUN_DOMAIN = os.environ.get("MAILGUN_DOMAIN")
     MAILGUN_API_KEY = os.environ.get("MAILGUN_API_KEY")
+    # overridable so the dispatcher can be pointed at a local stub server
+    MAILGUN_API_BASE = (
+        os.environ.get("MAILGUN_API_BASE") or "https://api.mailgun.net/v3"
+    )
+    TIMEOUT = float(os.environ.get("MAILGUN_TIMEOUT", 10))
 
     FROM_TITLE = "Jason man"
     FROM_EMAIL = "postmaster@sandbox784a18bff6884762bc3ece9fb36dbb83.mailgun.org"
 
+    # one keep-alive session per thread, requests sessions are not guaranteed thread safe
+    _local = threading.local()
+    # httpx client for the event loop of the ASGI server (see libs/asgi.py), bound to
+    # the loop that first uses it
+    _async_client = None
+
     @classmethod
-    def send_email(
-        cls, email: List[str], subject: str, text: str, html: str
-    ) -> Response:
+    def check_config(cls) -> None:
         if cls.MAILGUN_API_KEY is None:
             raise MailGunException(FAILED_LOAD_API_KEY)
 
         if cls.MAILGUN_DOMAIN is None:
             raise MailGunException(FAILED_LOAD_DOMAIN)
 
-        response = post(
-            f"https://api.mailgun.net/v3/{cls.MAILGUN_DOMAIN}/messages",
-            auth=("api", cls.MAILGUN_API_KEY),
-            data={
-                "from": f"{cls.FROM_TITLE} <{cls.FROM_EMAIL}>",
-                "to": email,
-                "subject": subject,
-                "text": text,
-                "html": html,
-            },
-        )
+    @classmethod
+    def session(cls) -> "Session":
+        session = getattr(cls._local, "session", None)
+        if session is None:
+            from requests import Session
+            from requests.adapters import HTTPAdapter
+
+            session = Session()
+            session.auth = ("api", cls.MAILGUN_API_KEY)
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            cls._local.session = session
+        return session
+
+    @classmethod
+    def async_client(cls) -> "AsyncClient":
+        if cls._async_client is None:
+            from httpx import AsyncClient, Limits
+
+            cls._async_client = AsyncClient(
+                auth=("api", cls.MAILGUN_API_KEY),
+                limits=Limits(max_connections=32, max_keepalive_connections=8),
+            )
+        return cls._async_client
+
+    @classmethod
+    async def close_async_client(cls) -> None:
+        if cls._async_client is not None:
+            await cls._async_client.aclose()
+            cls._async_client = None
+
+    @classmethod
+    def _url(cls) -> str:
+        return f"{cls.MAILGUN_API_BASE}/{cls.MAILGUN_DOMAIN}/messages"
+
+    @classmethod
+    def _data(cls, data: Dict) -> Dict:
+        return {"from": f"{cls.FROM_TITLE} <{cls.FROM_EMAIL}>", **data}
+
+    @classmethod
+    def _post(cls, data: Dict) -> "Response":
+        cls.check_config()
+
+        start = perf_counter()
+        outcome = "error"
+        try:
+            response = cls.session().post(
+                cls._url(), data=cls._data(data), timeout=cls.TIMEOUT
+            )
+            outcome = str(response.status_code)
+        finally:
+            MAIL_SEND_TIME.observe(perf_counter() - start, outcome=outcome)
+
+        if response.status_code != 200:
+            raise MailGunException(ERROR_SENDING_EMAIL)
+
+        return response
+
+    @classmethod
+    async def _post_async(cls, data: Dict) -> "HttpxResponse":
+        cls.check_config()
+
+        start = perf_counter()
+        outcome = "error"
+        try:
+            response = await cls.async_client().post(
+                cls._url(), data=cls._data(data), timeout=cls.TIMEOUT
+            )
+            outcome = str(response.status_code)
+        finally:
+            MAIL_SEND_TIME.observe(perf_counter() - start, outcome=outcome)
 
         if response.status_code != 200:
             raise MailGunException(ERROR_SENDING_EMAIL)
 
         return response
+
+    @classmethod
+    def send_email(
+        cls, email: List[str], subject: str, text: str, html: str
+    ) -> "Response":
+        return cls._post({"to": email, "subject": subject, "text": text, "html": html})
+
+    @staticmethod
+    def _batch_data(
+        recipients: Dict[str, Dict], subject: str, text: str, html: str
+    ) -> Dict:
+        # one API call for many recipients, each only sees their own address and
+        # %recipient.<key>% placeholders in the bodies are filled from their variables
+        return {
+            "to": list(recipients),
+            "subject": subject,
+            "text": text,
+            "html": html,
+            "recipient-variables": json.dumps(recipients),
+        }
+
+    @classmethod
+    def send_batch(
+        cls, recipients: Dict[str, Dict], subject: str, text: str, html: str
+    ) -> "Response":
+        return cls._post(cls._batch_data(recipients, subject, text, html))
+
+    @classmethod
+    async def send_batch_async(
+        cls, recipients: Dict[str, Dict], subject: str, text: str, html: str
+    ) -> "HttpxResponse":
+        return await cls._post_async(cls._batch_data(recipients, subject, text, html))
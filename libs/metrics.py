@@ -0,0 +1,325 @@
+import bisect
+import os
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+# (metric name, labels, value)
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    labels = list(labels)
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [
+                (self.name, dict(key), value) for key, value in self._values.items()
+            ]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # label key -> [per bucket counts..., +Inf count], sum
+        self._values: Dict[Tuple, Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or (
+                [0] * (len(self.buckets) + 1),
+                0.0,
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        for key, counts, total in values:
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": str(bound)}, cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class CallbackMetric:
+    # values are read from a callback at scrape time, for numbers other modules
+    # already keep (cache counters, pool status, ...)
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        callback: Callable[[], Iterable[Tuple[Dict, float]]],
+        type: str = "gauge",
+    ):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.type = type
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, labels, value) for labels, value in self.callback()]
+
+
+class MetricsRegistry:
+    # numbers are per process, with several uwsgi workers each one answers a scrape
+    # with its own counters (label them by instance when scraping through the socket)
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def histogram(
+        self, name: str, help: str, buckets: Tuple = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def callback(
+        self, name: str, help: str, callback, type: str = "gauge"
+    ) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help, callback, type))
+
+    def render(self) -> str:
+        # prometheus text exposition format 0.0.4
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Time spent handling a request, by route."
+)
+REQUEST_SQL_QUERIES = registry.histogram(
+    "http_request_sql_queries", "SQL statements executed per request.", COUNT_BUCKETS
+)
+REQUEST_SQL_TIME = registry.histogram(
+    "http_request_sql_seconds", "Time spent in SQL statements per request."
+)
+SQL_QUERY_TIME = registry.histogram(
+    "sql_query_duration_seconds", "Duration of individual SQL statements."
+)
+SERIALIZATION_TIME = registry.histogram(
+    "schema_dump_duration_seconds", "Time spent in marshmallow schema dumps, by schema."
+)
+MAIL_SEND_TIME = registry.histogram(
+    "mail_send_duration_seconds", "Duration of Mailgun API calls, by outcome."
+)
+
+
+class RequestStats(threading.local):
+    # per thread accumulator for the request currently being handled
+    active = False
+    sql_queries = 0
+    sql_time = 0.0
+    dump_time = 0.0
+    dump_depth = 0
+
+
+request_stats = RequestStats()
+
+
+class TimedSchemaMixin:
+    # records how long schema.dump takes, nested schemas are counted in their parent
+    @property
+    def timer_label(self) -> str:
+        return type(self).__name__
+
+    def dump(self, obj, *args, **kwargs):
+        if request_stats.dump_depth:
+            return super().dump(obj, *args, **kwargs)
+
+        request_stats.dump_depth += 1
+        start = perf_counter()
+        try:
+            return super().dump(obj, *args, **kwargs)
+        finally:
+            request_stats.dump_depth -= 1
+            elapsed = perf_counter() - start
+            request_stats.dump_time += elapsed
+            SERIALIZATION_TIME.observe(elapsed, schema=self.timer_label)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_start"].pop()
+    SQL_QUERY_TIME.observe(elapsed)
+    if request_stats.active:
+        request_stats.sql_queries += 1
+        request_stats.sql_time += elapsed
+
+
+def _handle_error(context) -> None:
+    # a failed statement never reaches after_cursor_execute
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _cache_counters():
+    from libs.cache import CACHES
+
+    for name, cache in CACHES.items():
+        stats = cache.stats()
+        for counter in ("hits", "misses", "evictions", "expirations"):
+            yield {"cache": name, "event": counter}, stats[counter]
+
+
+def _cache_sizes():
+    from libs.cache import CACHES
+
+    return [({"cache": name}, len(cache)) for name, cache in CACHES.items()]
+
+
+def _blacklist_entries():
+    from blacklist import BLACKLIST
+
+    stats = BLACKLIST.stats()
+    # the uwsgi backend cannot count its entries
+    if "entries" not in stats:
+        return []
+    return [({"backend": stats["backend"]}, stats["entries"])]
+
+
+def _start_request() -> None:
+    request_stats.active = True
+    request_stats.sql_queries = 0
+    request_stats.sql_time = 0.0
+    request_stats.dump_time = 0.0
+    request_stats.start = perf_counter()
+
+
+def _finish_request(app, response):
+    if not request_stats.active:
+        return response
+    request_stats.active = False
+
+    elapsed = perf_counter() - request_stats.start
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    labels = {"method": request.method, "route": route}
+    REQUEST_LATENCY.observe(elapsed, status=str(response.status_code), **labels)
+    REQUEST_SQL_QUERIES.observe(request_stats.sql_queries, **labels)
+    REQUEST_SQL_TIME.observe(request_stats.sql_time, **labels)
+
+    threshold = app.config["SLOW_REQUEST_THRESHOLD_MS"]
+    if threshold and elapsed * 1000 >= threshold:
+        app.logger.warning(
+            "slow request %s %s -> %s in %.1fms (sql: %d queries, %.1fms; dump: %.1fms)",
+            request.method,
+            request.full_path.rstrip("?"),
+            response.status_code,
+            elapsed * 1000,
+            request_stats.sql_queries,
+            request_stats.sql_time * 1000,
+            request_stats.dump_time * 1000,
+        )
+    return response
+
+
+def metrics_view():
+    # without a token the route is only registered in development and testing
+    token = current_app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app) -> None:
+    # 0 turns the slow request log off
+    app.config.setdefault(
+        "SLOW_REQUEST_THRESHOLD_MS",
+        float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", 500)),
+    )
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+    registry.callback(
+        "model_cache_events_total",
+        "Model cache lookups by outcome.",
+        _cache_counters,
+        "counter",
+    )
+    registry.callback(
+        "model_cache_entries", "Entries held by each model cache.", _cache_sizes
+    )
+    registry.callback(
+        "token_blacklist_entries",
+        "Revoked tokens currently remembered.",
+        _blacklist_entries,
+    )
+
+    app.before_request(_start_request)
+    app.after_request(lambda response: _finish_request(app, response))
+    # /metrics lists routes, cache sizes, pool status and blacklist counts, so a
+    # deployment only serves it to holders of METRICS_TOKEN
+    app.config.setdefault("METRICS_TOKEN", os.environ.get("METRICS_TOKEN"))
+    if app.config["METRICS_TOKEN"] or app.debug or app.testing:
+        app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,67 @@
+import base64
+import binascii
+import json
+from typing import Iterable, List, Optional, Tuple
+
+from flask import Response, request, stream_with_context
+from marshmallow import Schema
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# rows fetched from the database per round trip while streaming
+STREAM_BATCH_SIZE = 500
+
+INVALID_PAGE = "'limit' and 'after' must be whole numbers."
+
+
+def wants_stream() -> bool:
+    return request.args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def page_args() -> Tuple[Optional[int], int]:
+    # ?limit=<n>&after=<id> selects a keyset page: rows with id > after, ordered by id
+    # returns (None, 0) when neither is given so callers can keep the unpaginated response
+    # raises ValueError for a value that is not a number, answered with INVALID_PAGE,
+    # a client with a corrupted cursor should not silently start over at page one
+    if "limit" not in request.args and "after" not in request.args:
+        return None, 0
+
+    limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    after = int(request.args.get("after", 0))
+    return min(max(limit, 1), MAX_PAGE_SIZE), max(after, 0)
+
+
+def next_cursor(rows: list, limit: int) -> Optional[int]:
+    # a full page means there may be more rows, the last id is where the next page starts
+    if len(rows) == limit:
+        return rows[-1].id
+    return None
+
+
+def encode_cursor(values: List) -> str:
+    # opaque to clients, they only hand it back as ?after=
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> List:
+    # raises ValueError for anything encode_cursor did not produce
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError(cursor)
+    if not isinstance(values, list):
+        raise ValueError(cursor)
+    return values
+
+
+def stream_list(key: str, rows: Iterable, schema: Schema) -> Response:
+    # writes {"<key>": [...]} one object at a time so memory use does not depend on
+    # the number of rows, schema must be a single object (many=False) schema or
+    # a dumper built from one (schemas/fast.py)
+    def generate():
+        yield f'{{"{key}": ['
+        for index, row in enumerate(rows):
+            yield (", " if index else "") + json.dumps(schema.dump(row))
+        yield "]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
@@ -0,0 +1,118 @@
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from libs.metrics import registry
+
+# werkzeug method string, bump the iteration count to raise the cost; existing hashes
+# are upgraded the next time their owner logs in
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+PASSWORD_SALT_LENGTH = 16
+# hashing threads per process, pbkdf2 releases the GIL so these run in parallel
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 4))
+# hash jobs allowed to wait for a worker before new logins are turned away
+PASSWORD_HASH_QUEUE = int(os.environ.get("PASSWORD_HASH_QUEUE", 32))
+PASSWORD_HASH_WAIT = float(os.environ.get("PASSWORD_HASH_WAIT", 5))
+
+HASH_PREFIXES = ("pbkdf2:", "scrypt:")
+
+PASSWORD_HASH_TIME = registry.histogram(
+    "password_hash_duration_seconds", "Password hashing and verification time."
+)
+PASSWORD_HASH_REJECTED = registry.counter(
+    "password_hash_rejected_total", "Hash jobs refused because the queue was full."
+)
+
+
+class PasswordHasherBusy(Exception):
+    def __init__(self, message: str = "Too many concurrent password checks."):
+        super().__init__(message)
+
+
+class PasswordHasher:
+    # runs the deliberately slow KDF on a small fixed pool so that a burst of logins
+    # queues up (bounded) instead of every uwsgi thread burning CPU at the same time
+    def __init__(self, workers: int, queue: int, wait: float):
+        self.wait = wait
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # created lazily per process, executor threads do not survive a uwsgi fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self._workers, thread_name_prefix="password-hasher"
+                    )
+                    self._pid = os.getpid()
+        return self._executor
+
+    def run(self, operation: str, func, *args):
+        if not self._slots.acquire(timeout=self.wait):
+            PASSWORD_HASH_REJECTED.inc()
+            raise PasswordHasherBusy()
+        try:
+            return self._pool().submit(self._timed, operation, func, *args).result()
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _timed(operation: str, func, *args):
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            PASSWORD_HASH_TIME.observe(perf_counter() - start, operation=operation)
+
+
+hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE, PASSWORD_HASH_WAIT)
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(HASH_PREFIXES)
+
+
+def hash_password(password: str) -> str:
+    return hasher.run("hash", _generate, password)
+
+
+def verify_password(stored: str, password: str) -> bool:
+    if not is_hashed(stored):
+        # rows written before hashing was introduced, see `flask migrate-passwords`;
+        # timed like a hash so these accounts do not stand out either
+        reject_password(password)
+        return hmac.compare_digest(stored.encode(), password.encode())
+    return hasher.run("verify", check_password_hash, stored, password)
+
+
+def reject_password(password: str) -> bool:
+    # for a login naming no user: the same KDF work as a wrong password, so response
+    # times do not tell which usernames exist
+    hasher.run("verify", check_password_hash, _dummy_hash(), password)
+    return False
+
+
+def needs_rehash(stored: str) -> bool:
+    # stored hashes look like "<method>$<salt>$<hash>"
+    return not is_hashed(stored) or stored.split("$", 1)[0] != PASSWORD_HASH_METHOD
+
+
+@lru_cache(maxsize=None)
+def _dummy_hash() -> str:
+    # made on first use with the current method, an import does not pay for a hash
+    return _generate(os.urandom(16).hex())
+
+
+def _generate(password: str) -> str:
+    return generate_password_hash(
+        password, method=PASSWORD_HASH_METHOD, salt_length=PASSWORD_SALT_LENGTH
+    )
@@ -0,0 +1,276 @@
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import traceback
+from collections import Counter
+from glob import glob
+from time import monotonic, sleep, time
+from typing import Dict, Iterable, Optional, Tuple
+from uuid import uuid4
+
+from flask import request
+
+SESSION_FILE = "session.json"
+# session ids end up in file names, nothing but what uuid4().hex produces is accepted
+SESSION_ID = re.compile(r"^[0-9a-f]{32}$")
+# profiles are deleted when a new session starts this many seconds after them
+KEEP_PROFILES = 24 * 60 * 60
+# reading the frames of another thread has crashed workers on CPython 3.11 (now and
+# then, at 1ms samples); sampling was only verified on 3.7 (runtime.txt) and 3.12,
+# other versions profile with PROFILER_ENABLED=true set explicitly
+SAFE_FRAMES = sys.version_info[:2] in ((3, 7), (3, 12))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _short_path(filename: str) -> str:
+    # site-packages/flask/app.py -> flask/app.py, project files relative to the repo
+    _, marker, rest = filename.rpartition("site-packages" + os.sep)
+    if marker:
+        return rest
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if filename.startswith(root + os.sep):
+        return filename[len(root) + 1 :]
+    return filename
+
+
+class SamplingProfiler:
+    # statistical profiler for slow workers in production: a background thread looks
+    # at the Python stack of every request thread picked for a session
+    # (sys._current_frames) every PROFILER_INTERVAL seconds and counts identical
+    # stacks, so the cost is per sample, not per function call as with cProfile
+    #
+    # a session (time window, share of requests, routes) is started through the admin
+    # endpoints (resources/profiler.py) and written to PROFILER_DIR, which every worker
+    # process of the host looks at once per PROFILER_CHECK_INTERVAL; each worker
+    # rewrites its stacks there as often, so a worker killed by harakiri in the middle
+    # of a slow request keeps all but its last second, and the endpoint merges them
+    # into collapsed stacks ("frame;frame;frame count" lines) for flamegraph.pl,
+    # speedscope or inferno. Outside a session a request costs one clock comparison.
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        # the session sampled in this process, None outside a window
+        self.session: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._seen = None
+        # thread id -> root frame ("GET /item/<string:name>") of the sampled requests
+        self._targets: Dict[int, str] = {}
+        self._stacks: Counter = Counter()
+        self._labels: Dict = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault(
+            "PROFILER_ENABLED", _env_bool("PROFILER_ENABLED", SAFE_FRAMES)
+        )
+        app.config.setdefault(
+            "PROFILER_DIR",
+            os.environ.get(
+                "PROFILER_DIR", os.path.join(tempfile.gettempdir(), "items-profiles")
+            ),
+        )
+        # seconds between two samples of a request thread
+        app.config.setdefault(
+            "PROFILER_INTERVAL", float(os.environ.get("PROFILER_INTERVAL", 0.01))
+        )
+        app.config.setdefault("PROFILER_MAX_SECONDS", 600)
+        app.config.setdefault("PROFILER_CHECK_INTERVAL", 1.0)
+        self.app = app
+        self.directory = app.config["PROFILER_DIR"]
+        if app.config["PROFILER_ENABLED"]:
+            app.before_request(self._before_request)
+            app.teardown_request(self._teardown_request)
+
+    def start(
+        self,
+        seconds: float,
+        rate: float = 1.0,
+        routes: Iterable[str] = (),
+        interval: float = None,
+    ) -> Dict:
+        # routes are url rules ("/item/<string:name>") or endpoint names ("item"),
+        # none profiles every route; rate is the share of requests sampled
+        now = time()
+        session = {
+            "id": uuid4().hex,
+            "started": now,
+            "until": now + seconds,
+            "rate": rate,
+            "routes": sorted(routes),
+            "interval": interval or self.app.config["PROFILER_INTERVAL"],
+        }
+        os.makedirs(self.directory, exist_ok=True)
+        self._delete_old_profiles(now)
+        self._write_session(session)
+        # this worker starts right away, the others with their next request
+        self._next_check = 0.0
+        self._check()
+        return session
+
+    def stop(self) -> Optional[Dict]:
+        # ends the running session early, the workers write what they sampled so far
+        session = self.current()
+        if session is None:
+            return None
+        session["until"] = time()
+        self._write_session(session)
+        self._next_check = 0.0
+        return session
+
+    def current(self) -> Optional[Dict]:
+        # the running session of any worker, None once its window closed
+        session = self._read_session()
+        if session is None or session["until"] <= time():
+            return None
+        return session
+
+    def result(self, session_id: str) -> Optional[Tuple[Dict, str]]:
+        # (session, collapsed stacks of every worker that sampled), None when unknown
+        if not SESSION_ID.match(session_id):
+            return None
+        session = self._read_session()
+        if session is None or session["id"] != session_id:
+            session = {"id": session_id}
+        stacks = Counter()
+        paths = glob(os.path.join(self.directory, f"{session_id}-*.collapsed"))
+        if not paths and "until" not in session:
+            return None
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    stacks[stack] += int(count)
+        session["workers"] = len(paths)
+        session["samples"] = sum(stacks.values())
+        return session, _collapsed(stacks)
+
+    def _before_request(self) -> None:
+        if monotonic() >= self._next_check:
+            self._check()
+        session = self.session
+        if session is None:
+            return
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        routes = session["routes"]
+        if routes and rule not in routes and request.endpoint not in routes:
+            return
+        if session["rate"] < 1 and random.random() >= session["rate"]:
+            return
+        self._targets[threading.get_ident()] = f"{request.method} {rule}"
+
+    def _teardown_request(self, error=None) -> None:
+        if self._targets:
+            self._targets.pop(threading.get_ident(), None)
+
+    def _check(self) -> None:
+        self._next_check = monotonic() + self.app.config["PROFILER_CHECK_INTERVAL"]
+        try:
+            session = self.current()
+        except (OSError, ValueError):
+            return
+        # a session stopped early may still be writing its profile here
+        if session is None or session["id"] == self._seen or self.session:
+            return
+        with self._lock:
+            if session["id"] == self._seen:
+                return
+            self._seen = session["id"]
+            self._stacks = Counter()
+            self.session = session
+            threading.Thread(
+                target=self._run, args=(session,), name="profiler", daemon=True
+            ).start()
+
+    def _run(self, session: Dict) -> None:
+        check_interval = self.app.config["PROFILER_CHECK_INTERVAL"]
+        next_check = monotonic() + check_interval
+        try:
+            while time() < session["until"]:
+                self._sample()
+                sleep(session["interval"])
+                if monotonic() >= next_check:
+                    # written as it goes, harakiri kills the worker without a finally;
+                    # picks up an earlier end set by stop() in another worker
+                    next_check = monotonic() + check_interval
+                    self._write_profile(session["id"])
+                    latest = self._read_session()
+                    if latest is None or latest["id"] != session["id"]:
+                        break
+                    session["until"] = latest["until"]
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.session = None
+            self._targets.clear()
+            self._write_profile(session["id"])
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        for ident, root in list(self._targets.items()):
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(root)
+            stack.reverse()
+            self._stacks[";".join(stack)] += 1
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+            )
+        return label
+
+    def _read_session(self) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.directory, SESSION_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_session(self, session: Dict) -> None:
+        self._write(SESSION_FILE, json.dumps(session))
+
+    def _write_profile(self, session_id: str) -> None:
+        self._write(f"{session_id}-{os.getpid()}.collapsed", _collapsed(self._stacks))
+
+    def _write(self, name: str, content: str) -> None:
+        # replaced in one step, a worker never reads half a file
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            f.write(content)
+        os.replace(temporary, path)
+
+    def _delete_old_profiles(self, now: float) -> None:
+        for path in glob(os.path.join(self.directory, "*.collapsed")):
+            try:
+                if os.path.getmtime(path) < now - KEEP_PROFILES:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,197 @@
+import math
+import os
+import threading
+from functools import wraps
+from time import time
+from typing import Callable, Dict, Optional, Tuple
+
+from flask import request
+
+from libs.metrics import registry
+from libs.uwsgi_cache import UwsgiCache
+
+UNKNOWN_BACKEND = "Unknown rate limit backend '{}'."
+INVALID_LIMIT = "Rate limit '{}' must look like <requests>/<seconds>."
+TOO_MANY_REQUESTS = "Too many requests, please try again in {} seconds."
+
+# requests per period in seconds, overridden with RATE_LIMIT_<NAME>, e.g.
+# RATE_LIMIT_LOGIN=20/60
+DEFAULT_LIMITS = {
+    # per client address
+    "login": "10/60",
+    # per username, spreading a password guessing run over many addresses does not help
+    "login_user": "5/60",
+    "register": "5/600",
+    # per user id, every accepted resend sends an email
+    "resend": "3/600",
+}
+
+REJECTED = registry.counter(
+    "rate_limit_rejected_total", "Requests refused with 429, by limit."
+)
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def parse_limit(limit: str) -> Tuple[int, int]:
+    try:
+        requests, period = (int(part) for part in limit.split("/"))
+    except ValueError:
+        raise ValueError(INVALID_LIMIT.format(limit))
+    return requests, period
+
+
+class MemoryCounters:
+    # per process counters, fine for a single worker or for tests; with several uwsgi
+    # workers every one of them allows the full limit
+    name = "memory"
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._counts: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> int:
+        count, expires_at = self._counts.get(key, (0, 0))
+        return count if expires_at > time() else 0
+
+    def inc(self, key: str, ttl: int) -> int:
+        now = time()
+        with self._lock:
+            count, expires_at = self._counts.get(key, (0, 0))
+            if expires_at <= now:
+                count, expires_at = 0, now + ttl
+            self._counts[key] = (count + 1, expires_at)
+            if len(self._counts) > self.max_entries:
+                self._purge_locked(now)
+            return count + 1
+
+    def _purge_locked(self, now: float) -> None:
+        expired = [
+            key for key, (_, expires_at) in self._counts.items() if expires_at <= now
+        ]
+        for key in expired:
+            del self._counts[key]
+
+
+class UwsgiCounters:
+    # atomic counters in a uwsgi cache2 store shared by every worker, see the cache2
+    # "ratelimit" entry in uwsgi.ini; uwsgi expires them on its own
+    name = "uwsgi"
+
+    def __init__(self, cache_name: str = "ratelimit"):
+        self._cache = UwsgiCache(cache_name)
+
+    def get(self, key: str) -> int:
+        return self._cache.get_int(key)
+
+    def inc(self, key: str, ttl: int) -> int:
+        return self._cache.inc(key, 1, ttl)
+
+
+BACKENDS = {MemoryCounters.name: MemoryCounters, UwsgiCounters.name: UwsgiCounters}
+
+
+def create_counters(backend: str = None):
+    backend = backend or os.environ.get("RATE_LIMIT_BACKEND", MemoryCounters.name)
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(UNKNOWN_BACKEND.format(backend))
+
+
+class RateLimiter:
+    # sliding window counter: a counter per fixed window, the previous window's count
+    # weighted by how much of it still overlaps the sliding window; two counter
+    # lookups per check however many requests were made
+    def __init__(self, counters=None):
+        self.enabled = _env_bool("RATE_LIMIT_ENABLED", True)
+        self._counters = counters
+        self._limits: Dict[str, Tuple[int, int]] = {}
+
+    @property
+    def counters(self):
+        # created on first use, the uwsgi backend only works inside a worker
+        if self._counters is None:
+            self._counters = create_counters()
+        return self._counters
+
+    def limit_for(self, name: str) -> Tuple[int, int]:
+        if name not in self._limits:
+            limit = os.environ.get(f"RATE_LIMIT_{name.upper()}", DEFAULT_LIMITS[name])
+            self._limits[name] = parse_limit(limit)
+        return self._limits[name]
+
+    def hit(self, name: str, key: str) -> int:
+        # counts one request, returns 0 when it is allowed, otherwise the seconds
+        # after which the client may try again
+        limit, period = self.limit_for(name)
+        now = time()
+        window = int(now // period)
+        elapsed = (now % period) / period
+
+        previous = self.counters.get(f"{name}:{key}:{window - 1}")
+        # kept for two periods, the next window still reads it as its previous one
+        current = self.counters.inc(f"{name}:{key}:{window}", 2 * period)
+        if previous * (1 - elapsed) + current <= limit:
+            return 0
+
+        if current <= limit:
+            # allowed once enough of the previous window has slid out
+            wait = period * (1 - (limit - current) / previous) - (now % period)
+        else:
+            # this window alone is over the limit, it has to slide out partly
+            wait = period - (now % period) + period * (1 - limit / current)
+        return max(math.ceil(wait), 1)
+
+
+limiter = RateLimiter()
+
+
+def by_address() -> str:
+    return request.remote_addr or "unknown"
+
+
+def by_json_field(field: str) -> Callable[[], Optional[str]]:
+    def key() -> Optional[str]:
+        data = request.get_json(silent=True)
+        value = data.get(field) if isinstance(data, dict) else None
+        return str(value) if value is not None else None
+
+    return key
+
+
+def by_view_arg(arg: str) -> Callable[[], Optional[str]]:
+    def key() -> Optional[str]:
+        value = (request.view_args or {}).get(arg)
+        return str(value) if value is not None else None
+
+    return key
+
+
+def rate_limit(name: str, key: Callable[[], Optional[str]] = by_address):
+    # decorates a flask-restful method, runs before anything inside it so a throttled
+    # request never reaches the database; key returning None skips the check
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            client = key() if limiter.enabled else None
+            if client is not None:
+                retry_after = limiter.hit(name, client)
+                if retry_after:
+                    REJECTED.inc(limit=name)
+                    return (
+                        {"message": TOO_MANY_REQUESTS.format(retry_after)},
+                        429,
+                        {"Retry-After": str(retry_after)},
+                    )
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,143 @@
+import os
+import threading
+from functools import wraps
+from itertools import count
+from time import monotonic
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, event, exc, text
+from sqlalchemy.engine import Engine
+
+from db import READ_BIND, READ_ONLY, db
+from libs.db_pool import engine_options
+from libs.metrics import registry
+
+QUERIES = registry.counter(
+    "db_queries_total", "Statements executed, by database (primary or replica)."
+)
+READ_ROUTES = registry.counter(
+    "db_read_routes_total", "Read-only requests by the database their reads went to."
+)
+REPLICA_FAILURES = registry.counter(
+    "db_replica_failures_total", "Failed replica health checks and connections."
+)
+
+
+class Replica:
+    # one read-only copy of the database with its own pool; a replica that fails a
+    # health check or drops a connection is skipped for retry_interval seconds
+    def __init__(
+        self, name: str, uri: str, check_interval: float, retry_interval: float
+    ):
+        self.name = name
+        self.engine = create_engine(uri, **engine_options(uri))
+        self.check_interval = check_interval
+        self.retry_interval = retry_interval
+        self.down_until = 0.0
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        event.listen(self.engine, "handle_error", self._on_error)
+
+    def available(self) -> bool:
+        now = monotonic()
+        if now < self.down_until:
+            return False
+        if now - self.checked_at < self.check_interval:
+            return True
+        with self._lock:
+            if now - self.checked_at >= self.check_interval:
+                self.checked_at = now
+                try:
+                    with self.engine.connect() as connection:
+                        connection.execute(text("SELECT 1"))
+                except exc.DBAPIError:
+                    self.mark_down()
+        return monotonic() >= self.down_until
+
+    def mark_down(self) -> None:
+        if monotonic() < self.down_until:
+            return
+        REPLICA_FAILURES.inc(replica=self.name)
+        self.down_until = monotonic() + self.retry_interval
+
+    def _on_error(self, context) -> None:
+        # no connection means it could not be opened, the statement never ran
+        if context.is_disconnect or context.connection is None:
+            self.mark_down()
+
+
+class ReplicaRouter:
+    # sends the SELECTs of read-only resource methods (see read_only) to replicas,
+    # round robin over the healthy ones, the primary when none is left; writes and
+    # everything after the first write of a request stay on the primary
+    #
+    # replicas lag behind: a row read from one right after a write may still be
+    # cached (libs/cache.py, the identity cache) for its ttl, keep the lag well below it
+    def __init__(self, app=None):
+        self.replicas: List[Replica] = []
+        self._names: Dict[Engine, str] = {}
+        self._next = count()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        app.config.setdefault(
+            "SQLALCHEMY_REPLICA_URIS",
+            [
+                uri.strip()
+                for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",")
+                if uri.strip()
+            ],
+        )
+        app.config.setdefault(
+            "REPLICA_CHECK_INTERVAL",
+            float(os.environ.get("REPLICA_CHECK_INTERVAL", 5)),
+        )
+        app.config.setdefault(
+            "REPLICA_RETRY_INTERVAL",
+            float(os.environ.get("REPLICA_RETRY_INTERVAL", 30)),
+        )
+
+        self.replicas = [
+            Replica(
+                f"replica-{i}",
+                uri,
+                app.config["REPLICA_CHECK_INTERVAL"],
+                app.config["REPLICA_RETRY_INTERVAL"],
+            )
+            for i, uri in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"])
+        ]
+        self._names = {replica.engine: replica.name for replica in self.replicas}
+        if not event.contains(Engine, "before_cursor_execute", self._count_query):
+            event.listen(Engine, "before_cursor_execute", self._count_query)
+
+    def choose(self) -> Optional[Engine]:
+        # the engine for the reads of one request, None for the primary
+        for _ in range(len(self.replicas)):
+            replica = self.replicas[next(self._next) % len(self.replicas)]
+            if replica.available():
+                READ_ROUTES.inc(target=replica.name)
+                return replica.engine
+        READ_ROUTES.inc(target="primary")
+        return None
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        QUERIES.inc(target=self._names.get(conn.engine, "primary"))
+
+
+replicas = ReplicaRouter()
+
+
+def read_only(func):
+    # resource method decorator, goes above the others so every read of the request
+    # (ETag versions, current user) uses the same replica; streamed bodies included,
+    # the read bind lives as long as the request's session. Only for methods that
+    # never write: on SQLite they also begin without the write lock (libs/sqlite.py)
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        db.session.info[READ_ONLY] = True
+        if replicas.replicas:
+            db.session.info[READ_BIND] = replicas.choose()
+        return func(*args, **kwargs)
+
+    return wrapper
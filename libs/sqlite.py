@@ -0,0 +1,163 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+from flask import has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import Pool
+
+from db import READ_ONLY, db
+
+# resource methods marked read_only (libs/replicas.py) never take the write lock,
+# every other request starts its transaction holding it (BEGIN IMMEDIATE), GETs that
+# write included: a deferred read transaction cannot take the write lock in WAL mode
+# once another writer committed after it began, the busy timeout does not help there
+
+# writers of this process queue here rather than in SQLite's busy handler, which
+# polls with sleeps of up to 100ms; other processes still wait in the busy handler
+_write_lock = threading.Lock()
+# the DBAPI connection holding _write_lock; kept here rather than in the pool's
+# connection record, which checkin no longer has for a detached connection
+_lock_holder = None
+# set by reading() for background reads, which have no request method to go by
+_local = threading.local()
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def is_file_database(database_uri: str) -> bool:
+    if not database_uri:
+        return False
+    url = make_url(database_uri)
+    return url.drivername.startswith("sqlite") and url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def enabled(database_uri: str) -> bool:
+    return is_file_database(database_uri) and _env_bool("SQLITE_TUNING", True)
+
+
+def pragmas() -> Dict[str, str]:
+    # set on every new connection; WAL lets readers and the writer work at the same
+    # time, synchronous=NORMAL only syncs at checkpoints (a power loss can lose the
+    # last transactions but not corrupt the file), a negative cache_size is in KiB
+    return {
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)),
+        "cache_size": os.environ.get("SQLITE_CACHE_SIZE", str(-64 * 1024)),
+        "temp_store": "MEMORY",
+    }
+
+
+def engine_options(options: Dict) -> Dict:
+    # SQLAlchemy 1.3 opens a new connection per checkout for SQLite files, which
+    # throws away the page cache and runs the pragmas again; keep them in a pool
+    # shared by the request threads instead
+    from libs.db_pool import TimedQueuePool
+
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=int(os.environ.get("SQLITE_POOL_SIZE", 8)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 2)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        connect_args={
+            "check_same_thread": False,
+            # seconds a connection waits for the write lock before "database is locked"
+            "timeout": float(os.environ.get("SQLITE_BUSY_TIMEOUT", 10)),
+        },
+    )
+    return options
+
+
+@contextmanager
+def reading():
+    # transactions started inside only read, they begin without the write lock
+    _local.reading = True
+    try:
+        yield
+    finally:
+        _local.reading = False
+
+
+def _on_connect(dbapi_connection, connection_record) -> None:
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # pysqlite would start its own deferred transaction right before the first
+    # write, _on_begin starts them instead
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas().items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+    connection_record.info["sqlite_tuned"] = True
+
+
+def _on_begin(conn) -> None:
+    global _lock_holder
+    if not conn.connection.info.get("sqlite_tuned"):
+        return
+    dbapi_connection = conn.connection.connection
+    if getattr(_local, "reading", False) or (
+        has_request_context() and db.session.info.get(READ_ONLY)
+    ):
+        statement = "BEGIN"
+    else:
+        statement = "BEGIN IMMEDIATE"
+        if _lock_holder is not dbapi_connection:
+            timeout = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 10))
+            if not _write_lock.acquire(timeout=timeout):
+                # as a pool checkout that timed out, the transaction does not start
+                raise exc.TimeoutError(
+                    f"SQLite write lock not acquired within {timeout}s, "
+                    "another writer of this process holds it"
+                )
+            # held until the connection goes back to the pool or is dropped from it
+            _lock_holder = dbapi_connection
+    # straight on the DBAPI connection, not counted as a query of the request
+    conn.connection.cursor().execute(statement)
+
+
+def _release(dbapi_connection) -> None:
+    # the pool's checkin, invalidate and detach events; the lock goes with the
+    # connection whichever way it leaves its checkout
+    global _lock_holder
+    if dbapi_connection is not None and _lock_holder is dbapi_connection:
+        _lock_holder = None
+        _write_lock.release()
+
+
+def _on_checkin(dbapi_connection, connection_record) -> None:
+    _release(dbapi_connection)
+
+
+def _on_invalidate(dbapi_connection, connection_record, exception) -> None:
+    _release(dbapi_connection)
+
+
+def _on_detach(dbapi_connection, connection_record) -> None:
+    _release(dbapi_connection)
+
+
+def init_app(app) -> None:
+    # engine_options in libs/db_pool.py already picked the pool for the database
+    if not enabled(app.config.get("SQLALCHEMY_DATABASE_URI")):
+        return
+    if not event.contains(Pool, "connect", _on_connect):
+        event.listen(Pool, "connect", _on_connect)
+        event.listen(Pool, "checkin", _on_checkin)
+        event.listen(Pool, "invalidate", _on_invalidate)
+        event.listen(Pool, "detach", _on_detach)
+        event.listen(Engine, "begin", _on_begin)
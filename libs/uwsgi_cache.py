@@ -0,0 +1,47 @@
+from typing import Optional
+
+# the uwsgi module only exists when the app is running inside a uwsgi worker
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+UWSGI_NOT_AVAILABLE = "uwsgi cache '{}' is not available outside of a uwsgi worker."
+
+
+class UwsgiCache:
+    # thin wrapper around a uwsgi cache2 store declared in uwsgi.ini
+    # it lives in shared memory, so every worker process sees the same entries
+    def __init__(self, name: str):
+        if uwsgi is None:
+            raise RuntimeError(UWSGI_NOT_AVAILABLE.format(name))
+        self.name = name
+
+    @classmethod
+    def available(cls) -> bool:
+        return uwsgi is not None
+
+    def get(self, key: str) -> Optional[bytes]:
+        return uwsgi.cache_get(key, self.name)
+
+    def set(self, key: str, value: bytes, ttl: int = 0) -> None:
+        # cache_update overwrites where cache_set would refuse an existing key
+        uwsgi.cache_update(key, value, max(int(ttl), 0), self.name)
+
+    def exists(self, key: str) -> bool:
+        return bool(uwsgi.cache_exists(key, self.name))
+
+    def delete(self, key: str) -> None:
+        uwsgi.cache_del(key, self.name)
+
+    def inc(self, key: str, amount: int = 1, ttl: int = 0) -> int:
+        # atomic across workers, requires the cache to be declared with bitmap=1 math
+        uwsgi.cache_inc(key, amount, max(int(ttl), 0), self.name)
+        return self.get_int(key)
+
+    def get_int(self, key: str) -> int:
+        value = uwsgi.cache_num(key, self.name)
+        return int(value or 0)
+
+    def clear(self) -> None:
+        uwsgi.cache_clear(self.name)
@@ -0,0 +1,111 @@
+import json
+from time import time
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, inspect
+
+from db import db
+
+# tables whose row changes go to the change feed, see libs/change_feed.py
+FEED_TABLES = ("items", "stores")
+
+
+class ChangeLogModel(db.Model):
+    # one row per created, updated or deleted item or store, written in the same
+    # transaction as the change; the id is the sequence number clients resume from
+    __tablename__ = "change_log"
+    # SQLite hands out the ids of deleted rows again without AUTOINCREMENT, clients
+    # resuming from one of them would skip the new changes
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    table = db.Column(db.String(16), nullable=False)
+    op = db.Column(db.String(8), nullable=False)
+    # json encoded column values of the row, the last known ones for a delete
+    row = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.Float, nullable=False, index=True)
+
+    @classmethod
+    def after(
+        cls, after_id: int, limit: int, until_id: Optional[int] = None
+    ) -> List["ChangeLogModel"]:
+        query = cls.query.filter(cls.id > after_id)
+        if until_id is not None:
+            query = query.filter(cls.id <= until_id)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def latest_id(cls) -> int:
+        return db.session.query(db.func.max(cls.id)).scalar() or 0
+
+    @classmethod
+    def oldest_id(cls) -> Optional[int]:
+        return db.session.query(db.func.min(cls.id)).scalar()
+
+    @classmethod
+    def record(cls, connection, changes: Iterable[Tuple[str, str, dict]]) -> None:
+        # (table, op, row) tuples, connection is the session's connection so the
+        # log rows commit or roll back together with the changes
+        now = time()
+        rows = [
+            {"table": table, "op": op, "row": json.dumps(row), "created_at": now}
+            for table, op, row in changes
+        ]
+        if rows:
+            connection.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def delete_older_than(cls, seconds: float, batch_size: int) -> int:
+        # in batches so a large backlog does not hold the write lock for long; the
+        # newest row stays, tables created before AUTOINCREMENT count on from it
+        cutoff = time() - seconds
+        newest = cls.latest_id()
+        deleted = 0
+        while True:
+            ids = [
+                row.id
+                for row in db.session.query(cls.id)
+                .filter(cls.created_at < cutoff, cls.id < newest)
+                .order_by(cls.id)
+                .limit(batch_size)
+            ]
+            if not ids:
+                return deleted
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+
+
+def _loaded_row(instance) -> dict:
+    # values already on the instance, a deleted row can no longer be loaded
+    values = inspect(instance).dict
+    return {
+        column.name: values[column.name]
+        for column in instance.__table__.columns
+        if column.name in values
+    }
+
+
+def _log_changes(session, flush_context) -> None:
+    # after the flush the new rows have their ids, the history is not reset yet
+    changes = [
+        *(("create", instance) for instance in session.new),
+        *(
+            ("update", instance)
+            for instance in session.dirty
+            if session.is_modified(instance)
+        ),
+        *(("delete", instance) for instance in session.deleted),
+    ]
+    ChangeLogModel.record(
+        session.connection(),
+        (
+            (instance.__tablename__, op, _loaded_row(instance))
+            for op, instance in changes
+            if getattr(instance, "__tablename__", None) in FEED_TABLES
+        ),
+    )
+
+
+if not event.contains(db.session, "after_flush", _log_changes):
+    event.listen(db.session, "after_flush", _log_changes)
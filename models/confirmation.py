@@ -1,11 +1,17 @@
 from uuid import uuid4
 from time import time
-from db import db
+from typing import List
+from db import db, save_changes
 
 CONFIRMATION_EXPIRATION_DELTA = 1800
 
 
 class ConfirmationModel(db.Model):
+    # UserModel.most_recent_confirmation filters by user_id and orders by expire_at,
+    # this index answers it without touching the rest of the table
+    __table_args__ = (
+        db.Index("ix_confirmation_user_id_expire_at", "user_id", "expire_at"),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     expire_at = db.Column(db.Integer, nullable=False)
@@ -26,6 +32,28 @@ class ConfirmationModel(db.Model):
     def find_by_id(cls, _id: str) -> "ConfirmationModel":
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def delete_expired(cls, batch_size: int = 1000, grace: int = 0) -> int:
+        # removes unconfirmed confirmations that expired more than grace seconds ago,
+        # which includes every one superseded by a resend (force_to_expire)
+        # confirmed rows are kept as the record of when a user confirmed
+        # works in batches with a commit each so locks are held only briefly
+        cutoff = int(time()) - grace
+        deleted = 0
+        while True:
+            ids: List[str] = [
+                row.id
+                for row in db.session.query(cls.id)
+                .filter(cls.confirmed.is_(False), cls.expire_at < cutoff)
+                .limit(batch_size)
+            ]
+            if not ids:
+                return deleted
+            deleted += cls.query.filter(cls.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
     # properties can be called like confirmation.expired
     @property
     def expired(self) -> bool:
@@ -36,10 +64,12 @@ class ConfirmationModel(db.Model):
             self.expire_at = int(time())
             self.save_to_db()
 
-    def save_to_db(self) -> None:
+    def save_to_db(self, commit: bool = True) -> None:
         db.session.add(self)
-        db.session.commit()
+        if commit:
+            save_changes()
 
-    def delete_from_db(self) -> None:
+    def delete_from_db(self, commit: bool = True) -> None:
         db.session.delete(self)
-        db.session.commit()
+        if commit:
+            save_changes()
@@ -1,19 +1,33 @@
-from typing import List
-from db import db
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+from db import after_commit, db, save_changes
+from libs.cache import cache_row, create_cache, restore_row
+from models.change_log import ChangeLogModel
+from models.table_version import TableVersionModel
+
+# read-through cache of item rows keyed by name, see libs/cache.py for configuration
+item_cache = create_cache("items")
 
 
 class ItemModel(db.Model):
     __tablename__ = "items"
+    # (store_id, price) serves store filters, store + price ranges and the store
+    # prefetch in StoreModel; price on its own serves price ranges and price sorts
+    # existing databases: `flask create-indexes`
+    __table_args__ = (db.Index("ix_items_store_id_price", "store_id", "price"),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
-    price = db.Column(db.Float(precision=2), nullable=False)
+    price = db.Column(db.Float(precision=2), nullable=False, index=True)
 
     store_id = db.Column(db.Integer, db.ForeignKey("stores.id"), nullable=False)
     store = db.relationship("StoreModel")
 
+    # sort keys accepted by search, "-<key>" sorts descending
+    SORT_COLUMNS = ("id", "price", "name")
+
     @classmethod
-    def find_by_name(cls, name: str) -> "ItemModel":
+    def find_by_name(cls, name: str, for_update: bool = False) -> "ItemModel":
         """
         connection = sqlite3.connect('data.db')
         cursor = connection.cursor()
@@ -28,14 +42,180 @@ class ItemModel(db.Model):
             # cls instantiates
             return cls(*row)
         """
-        return cls.query.filter_by(name=name).first()
+        # for_update locks the row until the transaction ends and skips the cache:
+        # store_stats moves by the difference to the price and store read here, which
+        # must be what the row holds while it is changed (FOR UPDATE is left out on
+        # SQLite, where libs/sqlite.py serializes the writers)
+        if for_update:
+            return (
+                cls.query.filter_by(name=name)
+                .with_for_update()
+                .populate_existing()
+                .first()
+            )
+
+        row = item_cache.get(name)
+        if row is not None:
+            return restore_row(cls, row)
+
+        item = cls.query.filter_by(name=name).first()
+        if item:
+            item_cache.set(name, cache_row(item))
+        return item
+
+    @classmethod
+    def _listing(cls, columns_only: bool):
+        # columns_only returns plain row tuples with attribute access instead of
+        # tracked model instances, for read paths that only serialize the result
+        if columns_only:
+            return db.session.query(*cls.__table__.columns)
+        return cls.query
+
+    @classmethod
+    def find_all(cls, columns_only: bool = False) -> List["ItemModel"]:
+        return cls._listing(columns_only).all()
+
+    @classmethod
+    def find_page(
+        cls, limit: int, after: int = 0, columns_only: bool = False
+    ) -> List["ItemModel"]:
+        # keyset pagination, the primary key index makes every page equally cheap
+        return (
+            cls._listing(columns_only)
+            .filter(cls.id > after)
+            .order_by(cls.id)
+            .limit(limit)
+            .all()
+        )
+
+    @classmethod
+    def iter_all(
+        cls, batch_size: int, columns_only: bool = False
+    ) -> Iterator["ItemModel"]:
+        # fetches batch_size rows per round trip instead of loading the whole table
+        return cls._listing(columns_only).order_by(cls.id).yield_per(batch_size)
 
     @classmethod
-    def find_all(cls) -> List["ItemModel"]:
-        return cls.query.all()
+    def search(
+        cls,
+        store_id: Optional[int] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        name_prefix: Optional[str] = None,
+        sort: str = "id",
+        limit: Optional[int] = None,
+        after: Optional[Tuple] = None,
+        columns_only: bool = False,
+    ):
+        # every filter is an equality or range on an indexed column; results are
+        # ordered by the sort column with id breaking ties, so after=(sort value, id)
+        # of the last row continues a page without an OFFSET
+        # returns the query, to be read with .all() or streamed with .yield_per()
+        descending = sort.startswith("-")
+        column = getattr(cls, sort.lstrip("-"))
+
+        query = cls._listing(columns_only)
+        if store_id is not None:
+            query = query.filter(cls.store_id == store_id)
+        if min_price is not None:
+            query = query.filter(cls.price >= min_price)
+        if max_price is not None:
+            query = query.filter(cls.price <= max_price)
+        if name_prefix:
+            # a range on the unique name index, which SQLite and Postgres (outside
+            # the C collation) cannot use for LIKE alone; the LIKE drops what the
+            # range lets through under other collations
+            query = query.filter(
+                cls.name >= name_prefix,
+                cls.name.startswith(name_prefix, autoescape=True),
+            )
+            upper = _prefix_upper_bound(name_prefix)
+            if upper is not None:
+                query = query.filter(cls.name < upper)
+
+        if after is not None:
+            value, last_id = after
+            if column is cls.id:
+                query = query.filter(
+                    cls.id < last_id if descending else cls.id > last_id
+                )
+            elif descending:
+                query = query.filter(
+                    db.or_(column < value, db.and_(column == value, cls.id < last_id))
+                )
+            else:
+                query = query.filter(
+                    db.or_(column > value, db.and_(column == value, cls.id > last_id))
+                )
+
+        order = [column] if column is cls.id else [column, cls.id]
+        if descending:
+            order = [each.desc() for each in order]
+        query = query.order_by(*order)
+        if limit is not None:
+            query = query.limit(limit)
+        return query
+
+    @classmethod
+    def bulk_upsert(cls, rows: List[Dict]) -> Tuple[int, int]:
+        # insert or update by name with one SELECT, one multi-row INSERT and one
+        # executemany UPDATE, committed together; returns (inserted, updated)
+        # rows need name, price and store_id, a repeated name keeps its last row
+        from models.store_stats import StoreStatsModel
+
+        by_name = {row["name"]: row for row in rows}
+        existing = {
+            row.name: row
+            for row in db.session.query(cls.name, cls.id, cls.store_id).filter(
+                cls.name.in_(list(by_name))
+            )
+        }
+
+        inserts, updates = [], []
+        for name, row in by_name.items():
+            values = {"name": name, "price": row["price"], "store_id": row["store_id"]}
+            if name in existing:
+                updates.append({"id": existing[name].id, **values})
+            else:
+                inserts.append(values)
+        # stores gaining items and stores items moved away from
+        stores = {row["store_id"] for row in by_name.values()}
+        stores.update(row.store_id for row in existing.values())
+
+        try:
+            db.session.bulk_update_mappings(cls, updates)
+            db.session.bulk_insert_mappings(cls, inserts)
+            # bulk operations skip the flush events that normally bump the version
+            # and log the changes, the inserted ids are only known after a SELECT
+            connection = db.session.connection()
+            TableVersionModel.bump(connection, [cls.__tablename__])
+            written = db.session.query(*cls.__table__.columns).filter(
+                cls.name.in_(list(by_name))
+            )
+            ChangeLogModel.record(
+                connection,
+                (
+                    (
+                        cls.__tablename__,
+                        "update" if row.name in existing else "create",
+                        row._asdict(),
+                    )
+                    for row in written
+                ),
+            )
+            # recounted from the items, one aggregate per store of the import
+            StoreStatsModel.refresh(connection, stores)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for name in by_name:
+            item_cache.delete(name)
+        return len(inserts), len(updates)
 
     # previously insert
-    def save_to_db(self) -> None:
+    def save_to_db(self, commit: bool = True) -> None:
         """
         connection = sqlite3.connect('data.db')
         cursor = connection.cursor()
@@ -47,9 +227,25 @@ class ItemModel(db.Model):
         connection.close()
         """
         # SQLAlchemy handles both updates and inserts
+        # commit=False only stages the change, for callers that commit themselves
+        name = self.name
         db.session.add(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        after_commit(lambda: item_cache.delete(name))
 
-    def delete_from_db(self) -> None:
+    def delete_from_db(self, commit: bool = True) -> None:
+        name = self.name
         db.session.delete(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        after_commit(lambda: item_cache.delete(name))
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    # the first string after every name starting with prefix, None when there is
+    # none: trailing U+10FFFF cannot be incremented, the character before it is
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
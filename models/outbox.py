@@ -0,0 +1,133 @@
+import json
+from time import time
+from typing import Dict, List
+from uuid import uuid4
+
+from db import db, save_changes
+
+# give up on a message after this many failed sends
+MAX_ATTEMPTS = 8
+
+
+class OutboxModel(db.Model):
+    # durable queue of outgoing emails, rows are written in the request
+    # and picked up by the MailDispatcher worker threads
+    __tablename__ = "mail_outbox"
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(80), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    # json encoded Mailgun recipient variables, e.g. {"link": "..."}
+    variables = db.Column(db.Text, nullable=False, default="{}")
+
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.Integer, nullable=False, index=True)
+    # a worker owns the row until claimed_until, after that it can be picked up again
+    claimed_by = db.Column(db.String(32))
+    claimed_until = db.Column(db.Integer, nullable=False, default=0)
+    sent_at = db.Column(db.Integer)
+    last_error = db.Column(db.String(255))
+
+    def __init__(
+        self,
+        recipient: str,
+        subject: str,
+        text: str,
+        html: str,
+        variables: Dict = None,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.recipient = recipient
+        self.subject = subject
+        self.text = text
+        self.html = html
+        self.variables = json.dumps(variables or {})
+        self.attempts = 0
+        self.next_attempt_at = int(time())
+        self.claimed_until = 0
+
+    @property
+    def recipient_variables(self) -> Dict:
+        return json.loads(self.variables)
+
+    @classmethod
+    def claim_batch(cls, limit: int, lease: int) -> List["OutboxModel"]:
+        # a single UPDATE marks the rows as ours so concurrent workers
+        # (threads or uwsgi processes) never send the same message twice
+        now = int(time())
+        token = uuid4().hex
+        pending = (
+            db.session.query(cls.id)
+            .filter(
+                cls.sent_at.is_(None),
+                cls.attempts < MAX_ATTEMPTS,
+                cls.next_attempt_at <= now,
+                cls.claimed_until < now,
+            )
+            .order_by(cls.next_attempt_at)
+            .limit(limit)
+        )
+        ids = [row.id for row in pending]
+        if not ids:
+            return []
+
+        cls.query.filter(cls.id.in_(ids), cls.claimed_until < now).update(
+            {cls.claimed_by: token, cls.claimed_until: now + lease},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return cls.query.filter_by(claimed_by=token).all()
+
+    @classmethod
+    def mark_sent(cls, messages: List["OutboxModel"]) -> None:
+        now = int(time())
+        for message in messages:
+            message.sent_at = now
+            message.claimed_until = 0
+        db.session.commit()
+
+    @classmethod
+    def mark_failed(cls, messages: List["OutboxModel"], error: str, backoff) -> None:
+        # backoff maps the attempt number to a delay in seconds
+        now = int(time())
+        for message in messages:
+            message.attempts += 1
+            message.next_attempt_at = now + int(backoff(message.attempts))
+            message.claimed_until = 0
+            message.last_error = error[:255]
+        db.session.commit()
+
+    @classmethod
+    def delete_finished(cls, seconds: float, batch_size: int) -> int:
+        # sent messages and the ones given up on (MAX_ATTEMPTS failed sends), once
+        # they are older than seconds; in batches with a commit each so locks are
+        # held only briefly
+        cutoff = int(time() - seconds)
+        deleted = 0
+        while True:
+            ids = [
+                row.id
+                for row in db.session.query(cls.id)
+                .filter(
+                    db.or_(
+                        cls.sent_at < cutoff,
+                        db.and_(
+                            cls.attempts >= MAX_ATTEMPTS, cls.next_attempt_at < cutoff
+                        ),
+                    )
+                )
+                .limit(batch_size)
+            ]
+            if not ids:
+                return deleted
+            cls.query.filter(cls.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+
+    def save_to_db(self, commit: bool = True) -> None:
+        db.session.add(self)
+        if commit:
+            save_changes()
@@ -0,0 +1,44 @@
+from time import time
+from db import db, save_changes
+
+
+class RevokedTokenModel(db.Model):
+    __tablename__ = "revoked_tokens"
+
+    # jti is a uuid4 string generated by flask_jwt_extended
+    jti = db.Column(db.String(36), primary_key=True)
+    # unix timestamp of the token's exp claim, rows past it can be purged
+    expires_at = db.Column(db.Integer, nullable=False, index=True)
+
+    def __init__(self, jti: str, expires_at: int, **kwargs):
+        super().__init__(**kwargs)
+        self.jti = jti
+        self.expires_at = expires_at
+
+    @classmethod
+    def is_revoked(cls, jti: str) -> bool:
+        # primary key lookup, the exp check keeps already purged-but-present rows harmless
+        return (
+            db.session.query(cls.jti)
+            .filter(cls.jti == jti, cls.expires_at >= int(time()))
+            .first()
+            is not None
+        )
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        deleted = cls.query.filter(cls.expires_at < int(time())).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return deleted
+
+    @classmethod
+    def count(cls) -> int:
+        return cls.query.count()
+
+    def save_to_db(self, commit: bool = True) -> None:
+        # merge so that logging out twice with the same token does not violate the pk
+        db.session.merge(self)
+        if commit:
+            save_changes()
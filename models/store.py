@@ -1,5 +1,12 @@
-from typing import List
-from db import db
+from collections import defaultdict
+from typing import Iterator, List
+from db import after_commit, db, save_changes
+from libs.cache import cache_row, create_cache, restore_row
+from models.item import ItemModel
+from models.store_stats import StoreStatsModel
+
+# read-through cache of store rows keyed by name, see libs/cache.py for configuration
+store_cache = create_cache("stores")
 
 
 class StoreModel(db.Model):
@@ -16,20 +23,113 @@ class StoreModel(db.Model):
     # trade off between load now once or load later multi times
     items = db.relationship("ItemModel", lazy="dynamic")
 
+    # ids per IN (...) clause when bulk loading items for many stores
+    PREFETCH_CHUNK_SIZE = 500
+
+    @property
+    def loaded_items(self) -> List[ItemModel]:
+        # items filled in by prefetch_items, falls back to querying self.items
+        # so single store code paths keep working without a prefetch
+        prefetched = getattr(self, "_prefetched_items", None)
+        if prefetched is None:
+            return self.items.all()
+        return prefetched
+
+    @classmethod
+    def prefetch_items(cls, stores: List["StoreModel"]) -> List["StoreModel"]:
+        # one query per chunk of stores instead of one per store when serializing lists
+        by_store = defaultdict(list)
+        ids = [store.id for store in stores]
+        for start in range(0, len(ids), cls.PREFETCH_CHUNK_SIZE):
+            chunk = ids[start : start + cls.PREFETCH_CHUNK_SIZE]
+            for item in (
+                ItemModel.query.filter(ItemModel.store_id.in_(chunk))
+                .order_by(ItemModel.id)
+                .all()
+            ):
+                by_store[item.store_id].append(item)
+
+        for store in stores:
+            store._prefetched_items = by_store[store.id]
+        return stores
+
     @classmethod
     def find_by_name(cls, name: str) -> "StoreModel":
-        return cls.query.filter_by(name=name).first()
+        row = store_cache.get(name)
+        if row is not None:
+            return restore_row(cls, row)
+
+        store = cls.query.filter_by(name=name).first()
+        if store:
+            store_cache.set(name, cache_row(store))
+        return store
 
     @classmethod
     def find_all(cls) -> List["StoreModel"]:
         return cls.query.all()
 
+    @classmethod
+    def find_page(cls, limit: int, after: int = 0) -> List["StoreModel"]:
+        # keyset pagination, the primary key index makes every page equally cheap
+        return cls.query.filter(cls.id > after).order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def find_stats(cls, limit: int = None, after: int = 0) -> List:
+        # item count and price range per store from store_stats, one row per store
+        # whatever the number of items; rows with id, name, item_count, min_price,
+        # max_price and avg_price (None without items)
+        stats = StoreStatsModel
+        query = (
+            db.session.query(
+                cls.id,
+                cls.name,
+                db.func.coalesce(stats.item_count, 0).label("item_count"),
+                stats.min_price,
+                stats.max_price,
+                (stats.price_sum / db.func.nullif(stats.item_count, 0)).label(
+                    "avg_price"
+                ),
+            )
+            .outerjoin(stats, stats.store_id == cls.id)
+            .filter(cls.id > after)
+            .order_by(cls.id)
+        )
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    @classmethod
+    def find_all_with_items(cls) -> List["StoreModel"]:
+        return cls.prefetch_items(cls.find_all())
+
+    @classmethod
+    def find_page_with_items(cls, limit: int, after: int = 0) -> List["StoreModel"]:
+        return cls.prefetch_items(cls.find_page(limit, after))
+
+    @classmethod
+    def iter_all(cls, batch_size: int) -> Iterator["StoreModel"]:
+        # walks the table one keyset page at a time, two queries per page
+        # (stores, then their items) regardless of how many stores there are
+        after = 0
+        while True:
+            stores = cls.find_page_with_items(batch_size, after)
+            yield from stores
+            if len(stores) < batch_size:
+                return
+            after = stores[-1].id
+
     # previously insert
-    def save_to_db(self) -> None:
+    def save_to_db(self, commit: bool = True) -> None:
         # SQLAlchemy handles both updates and inserts
+        name = self.name
         db.session.add(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        after_commit(lambda: store_cache.delete(name))
 
-    def delete_from_db(self) -> None:
+    def delete_from_db(self, commit: bool = True) -> None:
+        name = self.name
         db.session.delete(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        after_commit(lambda: store_cache.delete(name))
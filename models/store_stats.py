@@ -0,0 +1,286 @@
+import math
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm.attributes import NO_VALUE
+
+from db import db
+from models.item import ItemModel
+
+
+class StatsChange:
+    # what one flush did to the items of one store
+    def __init__(self):
+        self.count = 0
+        self.price_sum = 0.0
+        self.added: List[float] = []
+        self.removed: List[float] = []
+        # an old price or store was not loaded, the row is recomputed instead
+        self.unknown = False
+
+    def add(self, price: float) -> None:
+        self.count += 1
+        self.price_sum += price
+        self.added.append(price)
+
+    def remove(self, price: float) -> None:
+        self.count -= 1
+        self.price_sum -= price
+        self.removed.append(price)
+
+
+class StoreStatsModel(db.Model):
+    # item count, price sum and price range of every store, kept up to date in the
+    # same transaction as each item write, so reading them costs one row per store
+    # existing databases: `flask rebuild-store-stats` once after `flask init-db`
+    __tablename__ = "store_stats"
+
+    store_id = db.Column(db.Integer, db.ForeignKey("stores.id"), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    price_sum = db.Column(db.Float, nullable=False, default=0.0)
+    min_price = db.Column(db.Float)
+    max_price = db.Column(db.Float)
+
+    @classmethod
+    def computed(cls, store_id: int = None):
+        # the same numbers aggregated from the items table, grouped by store
+        items = ItemModel.__table__
+        query = select(
+            [
+                items.c.store_id,
+                db.func.count().label("item_count"),
+                db.func.coalesce(db.func.sum(items.c.price), 0.0).label("price_sum"),
+                db.func.min(items.c.price).label("min_price"),
+                db.func.max(items.c.price).label("max_price"),
+            ]
+        ).group_by(items.c.store_id)
+        if store_id is not None:
+            query = query.where(items.c.store_id == store_id)
+        return query
+
+    @classmethod
+    def create(cls, connection, store_ids: Iterable[int]) -> None:
+        rows = [
+            {"store_id": store_id, "item_count": 0, "price_sum": 0.0}
+            for store_id in store_ids
+        ]
+        if rows:
+            connection.execute(cls.__table__.insert(), rows)
+
+    @classmethod
+    def remove(cls, connection, store_ids: Iterable[int]) -> None:
+        store_ids = list(store_ids)
+        if store_ids:
+            table = cls.__table__
+            connection.execute(table.delete().where(table.c.store_id.in_(store_ids)))
+
+    @classmethod
+    def refresh(cls, connection, store_ids: Iterable[int]) -> None:
+        # recomputes the rows of some stores from their items, e.g. after a bulk import
+        table = cls.__table__
+        for store_id in sorted(set(store_ids)):
+            row = connection.execute(cls.computed(store_id)).first()
+            values = {
+                "item_count": row.item_count if row else 0,
+                "price_sum": row.price_sum if row else 0.0,
+                "min_price": row.min_price if row else None,
+                "max_price": row.max_price if row else None,
+            }
+            result = connection.execute(
+                table.update().where(table.c.store_id == store_id).values(**values)
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(store_id=store_id, **values))
+
+    @classmethod
+    def rebuild(cls) -> int:
+        # every row recomputed from the items table in one transaction
+        from models.store import StoreModel
+
+        computed = {row.store_id: row for row in db.session.execute(cls.computed())}
+        rows = []
+        for (store_id,) in db.session.query(StoreModel.id):
+            row = computed.get(store_id)
+            rows.append(
+                {
+                    "store_id": store_id,
+                    "item_count": row.item_count if row else 0,
+                    "price_sum": row.price_sum if row else 0.0,
+                    "min_price": row.min_price if row else None,
+                    "max_price": row.max_price if row else None,
+                }
+            )
+        db.session.execute(cls.__table__.delete())
+        if rows:
+            db.session.execute(cls.__table__.insert(), rows)
+        db.session.commit()
+        return len(rows)
+
+    @classmethod
+    def check(cls) -> List[Tuple[int, Dict, Dict]]:
+        # (store_id, stored, computed) for every store whose row is off, the sums
+        # may differ in the last digits after many float additions
+        from models.store import StoreModel
+
+        columns = ("item_count", "price_sum", "min_price", "max_price")
+        empty = {
+            "item_count": 0,
+            "price_sum": 0.0,
+            "min_price": None,
+            "max_price": None,
+        }
+        computed = {
+            row.store_id: {column: row[column] for column in columns}
+            for row in db.session.execute(cls.computed())
+        }
+        stored = {
+            row.store_id: {column: getattr(row, column) for column in columns}
+            for row in cls.query
+        }
+        mismatches = []
+        for (store_id,) in db.session.query(StoreModel.id).order_by(StoreModel.id):
+            expected = computed.get(store_id, empty)
+            actual = stored.get(store_id)
+            if actual is None or not _same(actual, expected):
+                mismatches.append((store_id, actual, expected))
+        return mismatches
+
+    @classmethod
+    def apply(cls, connection, store_id: int, change: StatsChange) -> None:
+        # count and sum move by the difference and the range widens with added prices,
+        # all inside the UPDATE so concurrent writers to a store do not lose changes;
+        # only a removed minimum or maximum is read again, one seek on the
+        # (store_id, price) index
+        table = cls.__table__
+        items = ItemModel.__table__
+        in_store = items.c.store_id == store_id
+        lowest = select([db.func.min(items.c.price)]).where(in_store).as_scalar()
+        highest = select([db.func.max(items.c.price)]).where(in_store).as_scalar()
+        min_price, max_price = table.c.min_price, table.c.max_price
+
+        min_cases, max_cases = [], []
+        if change.removed:
+            min_cases.append(
+                (db.or_(min_price.is_(None), min_price >= min(change.removed)), lowest)
+            )
+            max_cases.append(
+                (db.or_(max_price.is_(None), max_price <= max(change.removed)), highest)
+            )
+        if change.added:
+            low, high = min(change.added), max(change.added)
+            min_cases.append((db.or_(min_price.is_(None), min_price > low), low))
+            max_cases.append((db.or_(max_price.is_(None), max_price < high), high))
+
+        values = {
+            "item_count": table.c.item_count + change.count,
+            "price_sum": table.c.price_sum + change.price_sum,
+        }
+        if min_cases:
+            values["min_price"] = db.case(min_cases, else_=min_price)
+            values["max_price"] = db.case(max_cases, else_=max_price)
+        result = connection.execute(
+            table.update().where(table.c.store_id == store_id).values(**values)
+        )
+        if result.rowcount == 0:
+            # a store from before the table existed
+            cls.refresh(connection, [store_id])
+
+
+def _same(actual: Dict, expected: Dict) -> bool:
+    return (
+        actual["item_count"] == expected["item_count"]
+        and actual["min_price"] == expected["min_price"]
+        and actual["max_price"] == expected["max_price"]
+        and math.isclose(
+            actual["price_sum"], expected["price_sum"], rel_tol=1e-9, abs_tol=1e-6
+        )
+    )
+
+
+def _before(instance, key: str):
+    # the value the row had in the database, NO_VALUE when it was never loaded
+    history = inspect(instance).attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return NO_VALUE
+
+
+def _item_changes(session) -> Dict[int, StatsChange]:
+    changes = defaultdict(StatsChange)
+    for item in session.new:
+        if isinstance(item, ItemModel):
+            changes[item.store_id].add(item.price)
+
+    for item in session.deleted:
+        if isinstance(item, ItemModel):
+            store_id, price = _before(item, "store_id"), _before(item, "price")
+            if store_id is NO_VALUE:
+                continue
+            if price is NO_VALUE:
+                changes[store_id].unknown = True
+            else:
+                changes[store_id].remove(price)
+
+    for item in session.dirty:
+        if not isinstance(item, ItemModel) or not session.is_modified(item):
+            continue
+        old_store_id, old_price = _before(item, "store_id"), _before(item, "price")
+        if old_store_id is NO_VALUE or old_price is NO_VALUE:
+            changes[item.store_id].unknown = True
+            if old_store_id is not NO_VALUE:
+                changes[old_store_id].unknown = True
+        elif (old_store_id, old_price) != (item.store_id, item.price):
+            # repriced, moved to another store or both
+            changes[old_store_id].remove(old_price)
+            changes[item.store_id].add(item.price)
+    return changes
+
+
+def _remove_store_stats(session, flush_context, instances) -> None:
+    # before the flush, the rows reference stores the flush is about to delete
+    deleted = [
+        store.id
+        for store in session.deleted
+        if getattr(store, "__tablename__", None) == "stores"
+    ]
+    if deleted:
+        StoreStatsModel.remove(session.connection(), deleted)
+
+
+def _update_store_stats(session, flush_context) -> None:
+    # after the flush new stores have their ids, the history is not reset yet
+    connection = None
+    created = [
+        store.id
+        for store in session.new
+        if getattr(store, "__tablename__", None) == "stores"
+    ]
+    # their rows went in _remove_store_stats
+    deleted = {
+        store.id
+        for store in session.deleted
+        if getattr(store, "__tablename__", None) == "stores"
+    }
+    changes = _item_changes(session)
+    if created or changes:
+        connection = session.connection()
+    if created:
+        StoreStatsModel.create(connection, created)
+    # sorted so concurrent transactions lock the rows in the same order
+    for store_id in sorted(changes):
+        if store_id in deleted:
+            continue
+        change = changes[store_id]
+        if change.unknown:
+            StoreStatsModel.refresh(connection, [store_id])
+        elif change.added or change.removed:
+            StoreStatsModel.apply(connection, store_id, change)
+
+
+if not event.contains(db.session, "before_flush", _remove_store_stats):
+    event.listen(db.session, "before_flush", _remove_store_stats)
+if not event.contains(db.session, "after_flush", _update_store_stats):
+    event.listen(db.session, "after_flush", _update_store_stats)
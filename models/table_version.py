@@ -0,0 +1,72 @@
+from typing import Dict, Iterable
+
+from sqlalchemy import DDL, event
+
+from db import db
+
+# tables whose writes are counted, see libs/http_cache.py
+VERSIONED_TABLES = ("items", "stores")
+
+
+class TableVersionModel(db.Model):
+    # one counter per table, bumped in the same transaction as every write to it,
+    # so a response can be identified by the versions it was built from
+    __tablename__ = "table_versions"
+
+    name = db.Column(db.String(80), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def versions(cls, names: Iterable[str]) -> Dict[str, int]:
+        # one primary key lookup, tables without a row yet count as version 0
+        names = list(names)
+        found = dict(
+            db.session.query(cls.name, cls.version).filter(cls.name.in_(names))
+        )
+        return {name: found.get(name, 0) for name in names}
+
+    @classmethod
+    def bump(cls, connection, names: Iterable[str]) -> None:
+        # connection is the session's connection, the increment commits or rolls
+        # back together with the write that caused it; callers pass names sorted so
+        # concurrent transactions lock the rows in the same order
+        table = cls.__table__
+        for name in names:
+            result = connection.execute(
+                table.update()
+                .where(table.c.name == name)
+                .values(version=table.c.version + 1)
+            )
+            if result.rowcount == 0:
+                connection.execute(table.insert().values(name=name, version=1))
+
+
+# rows for the versioned tables exist from the start, so concurrent first writes
+# only ever UPDATE
+event.listen(
+    TableVersionModel.__table__,
+    "after_create",
+    DDL(
+        "INSERT INTO table_versions (name, version) VALUES "
+        + ", ".join(f"('{name}', 0)" for name in VERSIONED_TABLES)
+    ),
+)
+
+
+def _bump_written_tables(session, flush_context, instances) -> None:
+    changed = [
+        *session.new,
+        *session.deleted,
+        *(instance for instance in session.dirty if session.is_modified(instance)),
+    ]
+    names = {
+        instance.__tablename__
+        for instance in changed
+        if getattr(instance, "__tablename__", None) in VERSIONED_TABLES
+    }
+    if names:
+        TableVersionModel.bump(session.connection(), sorted(names))
+
+
+if not event.contains(db.session, "before_flush", _bump_written_tables):
+    event.listen(db.session, "before_flush", _bump_written_tables)
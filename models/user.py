@@ -1,8 +1,26 @@
+import os
+from typing import Dict, Optional
+
 from flask import request, url_for
-from requests import Response
-from db import db
-from libs.mailgun import Mailgun
+from db import after_commit, db, save_changes
+from libs.cache import CACHES, LRUCache
+from libs.mail_dispatcher import dispatcher
+from libs.metrics import registry
+from libs.passwords import hash_password, needs_rehash, verify_password
 from models.confirmation import ConfirmationModel
+from models.outbox import OutboxModel
+
+# per process cache of identity_claims() keyed by user id, read by the jwt user loader
+# on every authenticated request; other workers see a change once their entry expires
+identity_cache = LRUCache(
+    max_size=int(os.environ.get("IDENTITY_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("IDENTITY_CACHE_TTL", 60)),
+)
+CACHES["identity"] = identity_cache
+
+IDENTITY_LOOKUPS = registry.counter(
+    "identity_lookups_total", "Current user resolutions by source."
+)
 
 
 class UserModel(db.Model):
@@ -13,8 +31,15 @@ class UserModel(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), nullable=False, unique=True)
-    password = db.Column(db.String(80), nullable=False)
+    # werkzeug "<method>$<salt>$<hash>" string, see libs/passwords.py
+    password = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(80), nullable=False, unique=True)
+    # copy of "the most recent confirmation is confirmed", set by the Confirmation
+    # resource so login and user lookups do not have to query confirmation_model
+    # existing databases: `flask backfill-confirmed`
+    confirmed = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )
 
     # all, delete-orphan deletes the corresponding confirmation record when user record is deleted
     confirmation = db.relationship(
@@ -25,15 +50,43 @@ class UserModel(db.Model):
     def most_recent_confirmation(self) -> "ConfirmationModel":
         return self.confirmation.order_by(db.desc(ConfirmationModel.expire_at)).first()
 
-    def save_to_db(self) -> None:
+    def identity_claims(self) -> Dict:
+        # what authenticated requests may know about their user, safe to put in a token
+        return {
+            "id": self.id,
+            "username": self.username,
+            "email": self.email,
+            "confirmed": self.confirmed,
+        }
+
+    def set_password(self, password: str) -> None:
+        self.password = hash_password(password)
+
+    def check_password(self, password: str) -> bool:
+        if not verify_password(self.password, password):
+            return False
+        # plaintext rows and hashes made with an older cost are upgraded on login
+        if needs_rehash(self.password):
+            self.set_password(password)
+            self.save_to_db()
+        return True
+
+    def save_to_db(self, commit: bool = True) -> None:
         db.session.add(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        user_id = self.id
+        if user_id is not None:
+            after_commit(lambda: identity_cache.delete(user_id))
 
-    def delete_from_db(self) -> None:
+    def delete_from_db(self, commit: bool = True) -> None:
+        user_id = self.id
         db.session.delete(self)
-        db.session.commit()
+        if commit:
+            save_changes()
+        after_commit(lambda: identity_cache.delete(user_id))
 
-    def send_confirmation_email(self) -> Response:
+    def send_confirmation_email(self) -> OutboxModel:
         # url_root = http://localhost:5000/
         # confirmation needs to match Confirmation resource name registerd in app.py
         # user_id is the query param to be embedded in link
@@ -41,11 +94,14 @@ class UserModel(db.Model):
         link = request.url_root[0:-1] + url_for(
             "confirmation", confirmation_id=self.most_recent_confirmation.id
         )
+        # the link is passed as a recipient variable so every confirmation email shares
+        # the same template and the dispatcher can send them in one Mailgun batch
         subject = "Registration Confirmation"
-        text = f"Please click the link to confirm your registration: {link}"
-        html = f'<html>Please click the link to confirm your registration: <a href="{link}">{link}</a></html>'
+        text = "Please click the link to confirm your registration: %recipient.link%"
+        html = '<html>Please click the link to confirm your registration: <a href="%recipient.link%">%recipient.link%</a></html>'
 
-        return Mailgun.send_email([self.email], subject, text, html)
+        # queued, the actual send happens on a dispatcher thread
+        return dispatcher.enqueue(self.email, subject, text, html, {"link": link})
 
     @classmethod
     def find_by_username(cls, username: str) -> "UserModel":
@@ -56,6 +112,27 @@ class UserModel(db.Model):
     def find_by_id(cls, _id: int) -> "UserModel":
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def find_identity(cls, _id: int) -> Optional[Dict]:
+        # identity_claims() of the user, from the cache when possible; None once the
+        # user is deleted
+        claims = identity_cache.get(_id)
+        if claims is not None:
+            IDENTITY_LOOKUPS.inc(source="cache")
+            return claims
+
+        user = cls.find_by_id(_id)
+        if user is None:
+            IDENTITY_LOOKUPS.inc(source="missing")
+            return None
+        IDENTITY_LOOKUPS.inc(source="database")
+        return user.cache_identity()
+
+    def cache_identity(self) -> Dict:
+        claims = self.identity_claims()
+        identity_cache.set(self.id, claims)
+        return claims
+
     @classmethod
     def find_by_email(cls, email: str) -> "UserModel":
         # SQLAlchemy converts results into the model object
@@ -0,0 +1,27 @@
+from flask import request
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required
+from libs.change_feed import change_feed
+from libs.replicas import read_only
+
+INVALID_EVENT_ID = "'Last-Event-ID' and 'after' must be a change sequence number."
+
+
+class ChangeFeed(Resource):
+    # item and store changes as server-sent events, see libs/change_feed.py; clients
+    # resume with the Last-Event-ID header (sent by EventSource when it reconnects)
+    # or ?after=<seq>, without either the stream starts at the next change
+    @classmethod
+    @read_only
+    @jwt_required
+    def get(cls):
+        after = request.headers.get("Last-Event-ID") or request.args.get("after")
+        if after is None:
+            return change_feed.response(None)
+        try:
+            after_id = int(after)
+        except ValueError:
+            return {"message": INVALID_EVENT_ID}, 400
+        if after_id < 0:
+            return {"message": INVALID_EVENT_ID}, 400
+        return change_feed.response(after_id)
@@ -4,7 +4,10 @@ from time import time
 from flask import make_response, render_template
 from flask_restful import Resource
 
+from db import transactional
 from libs.mailgun import MailGunException
+from libs.rate_limit import by_view_arg, rate_limit
+from libs.replicas import read_only
 from models.confirmation import ConfirmationModel
 from models.user import UserModel
 from schemas.confirmation import ConfirmationSchema
@@ -28,6 +31,7 @@ class Confirmation(Resource):
     @classmethod
     def get(cls, confirmation_id: str):
         # Return confirmation HTML page
+        # reads from the primary, the link is often followed seconds after registering
         confirmation = ConfirmationModel.find_by_id(confirmation_id)
 
         if not confirmation:
@@ -39,8 +43,12 @@ class Confirmation(Resource):
         if confirmation.confirmed:
             return {"message": CONFIRMED}, 400
 
+        # the user row carries its own copy of the flag, both change in one commit;
+        # saving through the user drops its cached identity once committed
         confirmation.confirmed = True
-        confirmation.save_to_db()
+        confirmation.user.confirmed = True
+        confirmation.save_to_db(commit=False)
+        confirmation.user.save_to_db()
 
         headers = {"Content-Type": "text/html"}
         return make_response(
@@ -52,6 +60,7 @@ class Confirmation(Resource):
 
 class ConfirmationByUser(Resource):
     @classmethod
+    @read_only
     def get(self, user_id: int):
         # Returns confirmation for a given user. User for testing.
         user = UserModel.find_by_id(user_id)
@@ -69,18 +78,23 @@ class ConfirmationByUser(Resource):
             200,
         )
 
+    # expiring the old confirmation, creating the new one and queueing the email
+    # happen in one transaction
     @classmethod
+    @rate_limit("resend", by_view_arg("user_id"))
+    @transactional
     def post(self, user_id: int):
         # Resend confirmation email
         user = UserModel.find_by_id(user_id)
         if not user:
             return {"message": USER_NOT_FOUND_}, 404
 
+        if user.confirmed:
+            return {"message": ALREADY_CONFIRMED_}, 400
+
         try:
             confirmation = user.most_recent_confirmation
             if confirmation:
-                if confirmation.confirmed:
-                    return {"message": ALREADY_CONFIRMED_}, 400
                 confirmation.force_to_expire()
 
             # create new confirmation object and send email
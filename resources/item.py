@@ -1,7 +1,25 @@
 from flask import request
 from flask_restful import Resource
 from flask_jwt_extended import fresh_jwt_required, jwt_required
-from schemas.item import ItemSchema
+from marshmallow import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from libs.bulk_import import UnsupportedBody, chunked, iter_request_rows
+from libs.http_cache import http_cache
+from libs.pagination import (
+    DEFAULT_PAGE_SIZE,
+    INVALID_PAGE,
+    MAX_PAGE_SIZE,
+    STREAM_BATCH_SIZE,
+    decode_cursor,
+    encode_cursor,
+    next_cursor,
+    page_args,
+    stream_list,
+    wants_stream,
+)
+from libs.replicas import read_only
+from schemas.fast import FAST_SERIALIZERS, fast_dumper
+from schemas.item import ItemSchema, ItemSearchSchema
 from models.item import ItemModel
 
 BLANK_ERROR = "'{}' cannot be left blank!"
@@ -9,19 +27,35 @@ ITEM_NOT_FOUND = "Item not found."
 ITEM_DELETED = "Item deleted."
 ITEM_ALREADY_EXISTS = "An item with the name '{}' already exists."
 ERROR_INSERTING = "Error occurred while trying to insert item."
+INVALID_CURSOR = "Invalid 'after' cursor."
+
+# any of these turns GET /items into a search
+SEARCH_ARGS = ("store_id", "min_price", "max_price", "name", "sort")
+
+# rows validated and written per transaction by the bulk import
+IMPORT_CHUNK_SIZE = 500
+# the import keeps going past this many bad rows but stops listing them
+MAX_REPORTED_ERRORS = 1000
 
 item_schema = ItemSchema()
 item_list_schema = ItemSchema(many=True)
+item_search_schema = ItemSearchSchema()
+# compiled dumps for the read endpoints when FAST_SERIALIZERS is on, otherwise the
+# schemas above
+item_dumper = fast_dumper(item_schema)
+item_list_dumper = fast_dumper(item_list_schema)
 
 
 class Item(Resource):
     # name here is a keyword argument that is tied to the query param
     # described in app.py [ api.add_resource(Item, '/item/<string:name>') ]
     @classmethod
+    @read_only
+    @http_cache.conditional("items")
     def get(cls, name: str):
         item = ItemModel.find_by_name(name)
         if item:
-            return item_schema.dump(item), 200
+            return item_dumper.dump(item), 200
         return {"message": ITEM_NOT_FOUND}, 404
 
     @classmethod
@@ -46,7 +80,7 @@ class Item(Resource):
     @classmethod
     @jwt_required
     def delete(cls, name: str):
-        item = ItemModel.find_by_name(name)
+        item = ItemModel.find_by_name(name, for_update=True)
         if item:
             item.delete_from_db()
             return {"message": ITEM_DELETED}, 200
@@ -56,7 +90,7 @@ class Item(Resource):
     @jwt_required
     def put(cls, name: str):
         item_json = request.get_json()
-        item = ItemModel.find_by_name(name)
+        item = ItemModel.find_by_name(name, for_update=True)
 
         if item:
             item.price = item_json["price"]
@@ -71,5 +105,137 @@ class Item(Resource):
 
 class ItemList(Resource):
     @classmethod
+    @read_only
+    @http_cache.conditional("items")
     def get(cls):
-        return {"items": item_list_schema.dump(ItemModel.find_all())}, 200
+        # ?stream=1 streams every item, ?limit=&after= returns one keyset page
+        # the fast path reads bare columns, nothing here needs model instances
+        if any(arg in request.args for arg in SEARCH_ARGS):
+            return cls.search()
+
+        if wants_stream():
+            return stream_list(
+                "items",
+                ItemModel.iter_all(STREAM_BATCH_SIZE, columns_only=FAST_SERIALIZERS),
+                item_dumper,
+            )
+
+        try:
+            limit, after = page_args()
+        except ValueError:
+            return {"message": INVALID_PAGE}, 400
+        if limit is None:
+            items = ItemModel.find_all(columns_only=FAST_SERIALIZERS)
+            return {"items": item_list_dumper.dump(items)}, 200
+
+        items = ItemModel.find_page(limit, after, columns_only=FAST_SERIALIZERS)
+        return (
+            {"items": item_list_dumper.dump(items), "next": next_cursor(items, limit)},
+            200,
+        )
+
+    @classmethod
+    def search(cls):
+        # ?store_id=&min_price=&max_price=&name=<prefix>&sort=[-]id|price|name
+        # pages take ?limit= and the opaque ?after= cursor returned as "next"
+        args = item_search_schema.load(request.args)
+        sort = args.get("sort", "id")
+
+        after = None
+        if "after" in args:
+            try:
+                after = decode_cursor(args["after"])
+            except ValueError:
+                return {"message": INVALID_CURSOR}, 400
+            if len(after) != 2:
+                return {"message": INVALID_CURSOR}, 400
+
+        limit = args.get("limit")
+        if limit is None and after is not None:
+            limit = DEFAULT_PAGE_SIZE
+        if limit is not None:
+            limit = min(max(limit, 1), MAX_PAGE_SIZE)
+
+        query = ItemModel.search(
+            store_id=args.get("store_id"),
+            min_price=args.get("min_price"),
+            max_price=args.get("max_price"),
+            name_prefix=args.get("name"),
+            sort=sort,
+            limit=limit,
+            after=after,
+            columns_only=FAST_SERIALIZERS,
+        )
+        if wants_stream():
+            return stream_list("items", query.yield_per(STREAM_BATCH_SIZE), item_dumper)
+
+        items = query.all()
+        if limit is None:
+            return {"items": item_list_dumper.dump(items)}, 200
+
+        cursor = None
+        if len(items) == limit:
+            last = items[-1]
+            cursor = encode_cursor([getattr(last, sort.lstrip("-")), last.id])
+        return {"items": item_list_dumper.dump(items), "next": cursor}, 200
+
+
+class ItemImport(Resource):
+    # bulk insert or update items by name from a JSON array, NDJSON or CSV body
+    # bad rows are reported back and skipped, the rest of the import still goes through
+    @classmethod
+    @fresh_jwt_required
+    def post(cls):
+        try:
+            rows = iter_request_rows()
+        except UnsupportedBody as e:
+            return {"message": str(e)}, 400
+
+        result = {"inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+        def fail(number: int, messages) -> None:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                result["errors"].append({"row": number, "errors": messages})
+
+        for chunk in chunked(rows, IMPORT_CHUNK_SIZE):
+            valid = []
+            for number, row, errors in chunk:
+                if errors:
+                    fail(number, errors)
+                    continue
+                try:
+                    item = item_schema.load(row)
+                except ValidationError as err:
+                    fail(number, err.messages)
+                    continue
+                valid.append(
+                    (
+                        number,
+                        {
+                            "name": item.name,
+                            "price": item.price,
+                            "store_id": item.store_id,
+                        },
+                    )
+                )
+
+            try:
+                inserted, updated = ItemModel.bulk_upsert([row for _, row in valid])
+            except SQLAlchemyError:
+                # something in the chunk was rejected by the database (e.g. unknown
+                # store_id), retry row by row to find out which ones
+                inserted = updated = 0
+                for number, row in valid:
+                    try:
+                        row_inserted, row_updated = ItemModel.bulk_upsert([row])
+                    except SQLAlchemyError:
+                        fail(number, {"_schema": [ERROR_INSERTING]})
+                    else:
+                        inserted += row_inserted
+                        updated += row_updated
+
+            result["inserted"] += inserted
+            result["updated"] += updated
+
+        return result, 200
@@ -0,0 +1,95 @@
+from functools import wraps
+from time import time
+
+from flask import Response, current_app, request
+from flask_restful import Resource
+from flask_jwt_extended import fresh_jwt_required, get_jwt_identity
+from libs.profiler import profiler
+from libs.replicas import read_only
+from schemas.profiler import ProfileSessionSchema
+
+ADMIN_REQUIRED = "Admin privileges required."
+PROFILER_DISABLED = "The profiler is disabled (PROFILER_ENABLED)."
+PROFILE_RUNNING = "A profile is running until {}."
+PROFILE_TOO_LONG = "A profile can run for at most {} seconds."
+PROFILE_STOPPED = "Profile stopped, the workers are writing their samples."
+NO_PROFILE_RUNNING = "No profile is running."
+PROFILE_NOT_FOUND = "Profile not found."
+
+profile_session_schema = ProfileSessionSchema()
+
+
+def admin_required(func):
+    # a fresh token of a user listed in ADMIN_USER_IDS
+    @wraps(func)
+    @fresh_jwt_required
+    def wrapper(*args, **kwargs):
+        if get_jwt_identity() not in current_app.config["ADMIN_USER_IDS"]:
+            return {"message": ADMIN_REQUIRED}, 403
+        if not current_app.config["PROFILER_ENABLED"]:
+            return {"message": PROFILER_DISABLED}, 404
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+class Profile(Resource):
+    # starts, shows and stops the sampling profile of the workers of this host
+    @classmethod
+    @read_only
+    @admin_required
+    def get(cls):
+        session = profiler.current()
+        if session is None:
+            return {"message": NO_PROFILE_RUNNING}, 404
+        return session
+
+    @classmethod
+    @admin_required
+    def post(cls):
+        args = profile_session_schema.load(request.get_json() or {})
+        running = profiler.current()
+        if running is not None:
+            return {"message": PROFILE_RUNNING.format(running["until"])}, 409
+        if args["seconds"] > current_app.config["PROFILER_MAX_SECONDS"]:
+            return (
+                {
+                    "message": PROFILE_TOO_LONG.format(
+                        current_app.config["PROFILER_MAX_SECONDS"]
+                    )
+                },
+                400,
+            )
+
+        interval = args.get("interval_ms")
+        session = profiler.start(
+            args["seconds"],
+            args["rate"],
+            args["routes"],
+            interval / 1000 if interval else None,
+        )
+        return session, 201
+
+    @classmethod
+    @admin_required
+    def delete(cls):
+        if profiler.stop() is None:
+            return {"message": NO_PROFILE_RUNNING}, 404
+        return {"message": PROFILE_STOPPED}
+
+
+class ProfileResult(Resource):
+    # the collapsed stacks of a finished profile, ?format=json for the session details
+    @classmethod
+    @read_only
+    @admin_required
+    def get(cls, session_id: str):
+        found = profiler.result(session_id)
+        if found is None:
+            return {"message": PROFILE_NOT_FOUND}, 404
+        session, stacks = found
+        if session.get("until", 0) > time():
+            return {"message": PROFILE_RUNNING.format(session["until"])}, 409
+        if request.args.get("format") == "json":
+            return session
+        return Response(stacks, mimetype="text/plain")
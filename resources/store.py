@@ -1,19 +1,37 @@
 from flask_restful import Resource
 from flask_jwt_extended import jwt_required
-from schemas.store import StoreSchema
+from libs.http_cache import http_cache
+from libs.pagination import (
+    INVALID_PAGE,
+    STREAM_BATCH_SIZE,
+    next_cursor,
+    page_args,
+    stream_list,
+    wants_stream,
+)
+from libs.replicas import read_only
+from schemas.fast import fast_dumper
+from schemas.store import StoreSchema, StoreStatsSchema
 from models.store import StoreModel
 
 store_schema = StoreSchema()
 store_list_schema = StoreSchema(many=True)
+store_stats_schema = StoreStatsSchema(many=True)
+# compiled dumps for the read endpoints when FAST_SERIALIZERS is on
+store_dumper = fast_dumper(store_schema)
+store_list_dumper = fast_dumper(store_list_schema)
 
 
 class Store(Resource):
+    # store bodies embed their items, so writes to either table change the ETag
     @classmethod
+    @read_only
     @jwt_required
+    @http_cache.conditional("items", "stores")
     def get(cls, name: str):
         store = StoreModel.find_by_name(name)
         if store:
-            return store_schema.dump(store)
+            return store_dumper.dump(store)
         return {"message": "Store not found."}, 404
 
     @classmethod
@@ -45,6 +63,46 @@ class Store(Resource):
 
 class StoreList(Resource):
     @classmethod
+    @read_only
     @jwt_required
+    @http_cache.conditional("items", "stores")
     def get(cls):
-        return {"stores": store_list_schema.dump(StoreModel.find_all())}
+        # ?stream=1 streams every store, ?limit=&after= returns one keyset page
+        if wants_stream():
+            return stream_list(
+                "stores", StoreModel.iter_all(STREAM_BATCH_SIZE), store_dumper
+            )
+
+        try:
+            limit, after = page_args()
+        except ValueError:
+            return {"message": INVALID_PAGE}, 400
+        if limit is None:
+            return {"stores": store_list_dumper.dump(StoreModel.find_all_with_items())}
+
+        stores = StoreModel.find_page_with_items(limit, after)
+        return {
+            "stores": store_list_dumper.dump(stores),
+            "next": next_cursor(stores, limit),
+        }
+
+
+class StoreStats(Resource):
+    # item count and min/max/average price per store from the aggregates kept in
+    # store_stats, instead of aggregating the nested items of GET /stores
+    @classmethod
+    @read_only
+    @jwt_required
+    @http_cache.conditional("items", "stores")
+    def get(cls):
+        try:
+            limit, after = page_args()
+        except ValueError:
+            return {"message": INVALID_PAGE}, 400
+        stats = StoreModel.find_stats(limit, after)
+        if limit is None:
+            return {"stores": store_stats_schema.dump(stats)}
+        return {
+            "stores": store_stats_schema.dump(stats),
+            "next": next_cursor(stats, limit),
+        }
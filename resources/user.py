@@ -1,22 +1,25 @@
 import traceback
 
-from flask import request
+from flask import current_app, request
 from flask_restful import Resource
-from werkzeug.security import safe_str_cmp
 from flask_jwt_extended import (
     create_access_token,
     create_refresh_token,
-    get_jwt_identity,
+    get_current_user,
     jwt_required,
     jwt_refresh_token_required,
     get_raw_jwt,
 )
 
+from db import transactional
 from libs.mailgun import MailGunException
+from libs.passwords import PasswordHasherBusy, reject_password
+from libs.rate_limit import by_json_field, rate_limit
+from libs.replicas import read_only
 from schemas.user import UserSchema
 from models.user import UserModel
 from models.confirmation import ConfirmationModel
-from blacklist import BLACKLIST
+from blacklist import BLACKLIST, BlacklistFull
 
 ACTIVATION_SUCCESSFUL = "User successfully activated!"
 ERROR_UPDATING_USER = "Error updating user."
@@ -28,6 +31,7 @@ USER_NOT_FOUND = "User not found."
 USERNAME_EXISTS = "A user with that username already exists."
 EMAIL_EXISTS = "A user with that email already exists."
 FAILED_TO_CREATE = "Internal server error. Failed to create user."
+TRY_AGAIN_LATER = "Server busy, please try again shortly."
 SUCCESS_REGISTER_MESSAGE = (
     "Account created successfully, an email with an activation link has been sent to your "
     "email address, please check. "
@@ -37,7 +41,10 @@ user_schema = UserSchema()
 
 
 class UserRegister(Resource):
+    # user, confirmation and queued email are committed together or not at all
     @classmethod
+    @rate_limit("register")
+    @transactional
     def post(cls):
         json = request.get_json()
         # user_schema creates a UserModel object with attribute values being request variables
@@ -50,6 +57,7 @@ class UserRegister(Resource):
             return {"message": EMAIL_EXISTS}, 400
 
         try:
+            user.set_password(user.password)
             user.save_to_db()
 
             confirmation = ConfirmationModel(user.id)
@@ -58,16 +66,17 @@ class UserRegister(Resource):
             user.send_confirmation_email()
             return {"message": SUCCESS_REGISTER_MESSAGE}, 201
         except MailGunException as e:
-            user.delete_from_db()
             return {"message": str(e)}, 500
+        except PasswordHasherBusy:
+            return {"message": TRY_AGAIN_LATER}, 503
         except:
             traceback.print_exc()
-            user.delete_from_db()
-            return {"message": FAILED_TO_CREATE}
+            return {"message": FAILED_TO_CREATE}, 500
 
 
 class User(Resource):
     @classmethod
+    @read_only
     def get(cls, user_id: int):
         user = UserModel.find_by_id(user_id)
         if not user:
@@ -84,7 +93,10 @@ class User(Resource):
 
 
 class UserLogin(Resource):
+    # throttled per client address and per username before any password check
     @classmethod
+    @rate_limit("login")
+    @rate_limit("login_user", by_json_field("username"))
     def post(cls):
         json = request.get_json()
         # partial lets marshmallow ignore email field for logging in
@@ -93,10 +105,21 @@ class UserLogin(Resource):
         # find user in db
         user = UserModel.find_by_username(user_data.username)
 
-        # check password
-        if user and safe_str_cmp(user.password, user_data.password):
-            confirmation = user.most_recent_confirmation
-            if confirmation and confirmation.confirmed:
+        # check password, hashing runs on a bounded worker pool (libs/passwords.py);
+        # an unknown username costs as much as a wrong password
+        try:
+            if user is None:
+                valid = reject_password(user_data.password)
+            else:
+                valid = user.check_password(user_data.password)
+        except PasswordHasherBusy:
+            return {"message": TRY_AGAIN_LATER}, 503
+
+        if valid:
+            if user.confirmed:
+                # the user's next requests (and the token's claims) come from the cache
+                user.cache_identity()
+
                 # create access token
                 access_token = create_access_token(identity=user.id, fresh=True)
 
@@ -120,8 +143,15 @@ class UserLogout(Resource):
     @classmethod
     @jwt_required
     def post(cls):
-        jti = get_raw_jwt()["jti"]  # jti is a JWT ID, a unique identifier for a JWT
-        BLACKLIST.add(jti)
+        raw_jwt = get_raw_jwt()
+        jti = raw_jwt["jti"]  # jti is a JWT ID, a unique identifier for a JWT
+        # exp lets the blacklist forget the jti once the token could not be used anyway
+        try:
+            BLACKLIST.add(jti, raw_jwt.get("exp"))
+        except BlacklistFull as e:
+            # the token stays valid, the client has to be told the logout failed
+            current_app.logger.error(str(e))
+            return {"message": TRY_AGAIN_LATER}, 503
         return {"message": LOGGED_OUT}, 200
 
 
@@ -129,8 +159,8 @@ class TokenRefresh(Resource):
     @classmethod
     @jwt_refresh_token_required
     def post(cls):
-        # accepts refresh token, gets user id based on that token, then generates new
-        # access token but one that is not fresh
-        current_user = get_jwt_identity()
-        new_token = create_access_token(identity=current_user, fresh=False)
+        # accepts refresh token, loads its user (a deleted user gets a 401 from the
+        # user loader in app.py), then generates new access token but one that is not fresh
+        current_user = get_current_user()
+        new_token = create_access_token(identity=current_user["id"], fresh=False)
         return {"access_token": new_token}, 200
@@ -1,10 +1,5 @@
-from app import app
-from db import db
+from app import create_app
 
-db.init_app(app)
-
-
-# creates database tables presumably based on model info
-@app.before_first_request
-def create_tables():
-    db.create_all()
+# uwsgi entry point (uwsgi.ini: module = run, callable = app), configured by APP_CONFIG
+# the schema is created by `FLASK_APP=run flask init-db`, not on the first request
+app = create_app()
@@ -1,8 +1,9 @@
+from libs.metrics import TimedSchemaMixin
 from ma import ma
 from models.confirmation import ConfirmationModel
 
 
-class ConfirmationSchema(ma.ModelSchema):
+class ConfirmationSchema(TimedSchemaMixin, ma.ModelSchema):
     class Meta:
         model = ConfirmationModel
         load_only = ("user",)
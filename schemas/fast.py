@@ -0,0 +1,90 @@
+import os
+from typing import Callable
+
+from marshmallow import Schema, fields, missing
+from marshmallow.decorators import POST_DUMP, PRE_DUMP
+
+from libs.metrics import TimedSchemaMixin
+
+# opt-in: hot read endpoints dump through functions compiled from their schemas
+FAST_SERIALIZERS = os.environ.get("FAST_SERIALIZERS", "").lower() in (
+    "1",
+    "true",
+    "yes",
+    "on",
+)
+
+# exact field classes whose serialization is inlined, mirroring their _serialize:
+# None stays None, anything else goes through the conversion
+_CONVERSIONS = {fields.Integer: "int", fields.Float: "float", fields.String: "str"}
+
+
+def _has_hooks(schema: Schema) -> bool:
+    return schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP)
+
+
+def compile_dump(schema: Schema) -> Callable:
+    # builds the source of a function that does what schema.dump does for one object,
+    # field by field in dump_fields order so the JSON comes out byte for byte the same
+    # fields it does not know are serialized by the field object itself
+    namespace = {"missing": missing, "dict_class": schema.dict_class}
+    lines = ["def dump(obj):", "    ret = dict_class()"]
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        attribute = field.attribute or name
+        key = field.data_key if field.data_key is not None else name
+        conversion = _CONVERSIONS.get(type(field))
+        if conversion and not getattr(field, "as_string", False):
+            lines.append(f"    value = getattr(obj, {attribute!r}, missing)")
+            lines.append("    if value is not missing:")
+            lines.append(
+                f"        ret[{key!r}] = None if value is None else {conversion}(value)"
+            )
+        elif isinstance(field, fields.Nested) and not _has_hooks(field.schema):
+            namespace[f"nested_{index}"] = compile_dump(field.schema)
+            loop = f"[nested_{index}(each) for each in value]"
+            call = loop if field.many or field.schema.many else f"nested_{index}(value)"
+            lines.append(f"    value = getattr(obj, {attribute!r}, missing)")
+            lines.append("    if value is not missing:")
+            lines.append(f"        ret[{key!r}] = None if value is None else {call}")
+        else:
+            namespace[f"field_{index}"] = field
+            lines.append(
+                f"    value = field_{index}.serialize({name!r}, obj, "
+                "accessor=get_attribute)"
+            )
+            lines.append("    if value is not missing:")
+            lines.append(f"        ret[{key!r}] = value")
+    lines.append("    return ret")
+    namespace["get_attribute"] = schema.get_attribute
+
+    exec("\n".join(lines), namespace)
+    return namespace["dump"]
+
+
+class CompiledDump:
+    # dump() with the compiled function in place of marshmallow's per field loop,
+    # many follows the schema it was built from unless passed explicitly
+    def __init__(self, schema: Schema):
+        self.schema = schema
+        self.many = schema.many
+        self._dump_one = compile_dump(schema)
+
+    def dump(self, obj, *, many: bool = None):
+        dump_one = self._dump_one
+        if self.many if many is None else many:
+            return [dump_one(each) for each in obj]
+        return dump_one(obj)
+
+
+class FastDumper(TimedSchemaMixin, CompiledDump):
+    @property
+    def timer_label(self) -> str:
+        return f"{type(self.schema).__name__}:fast"
+
+
+def fast_dumper(schema: Schema):
+    # the schema itself unless FAST_SERIALIZERS is on, schemas with dump hooks are
+    # always left to marshmallow
+    if not FAST_SERIALIZERS or _has_hooks(schema):
+        return schema
+    return FastDumper(schema)
@@ -1,11 +1,34 @@
+from marshmallow import EXCLUDE, fields, validate
+
+from libs.metrics import TimedSchemaMixin
 from ma import ma
 from models.item import ItemModel
 from models.store import StoreModel
 
 
-class ItemSchema(ma.ModelSchema):
+class ItemSchema(TimedSchemaMixin, ma.ModelSchema):
     class Meta:
         model = ItemModel
         load_only = ("store",)
         dump_only = ("id",)
         include_fk = True
+
+
+class ItemSearchSchema(ma.Schema):
+    # query string of GET /items, see ItemModel.search
+    class Meta:
+        # stream and anything else unrelated to searching
+        unknown = EXCLUDE
+
+    store_id = fields.Integer()
+    min_price = fields.Float()
+    max_price = fields.Float()
+    # name prefix
+    name = fields.String(validate=validate.Length(min=1, max=80))
+    sort = fields.String(
+        validate=validate.OneOf(
+            [key for column in ItemModel.SORT_COLUMNS for key in (column, f"-{column}")]
+        )
+    )
+    limit = fields.Integer()
+    after = fields.String()
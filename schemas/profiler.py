@@ -0,0 +1,16 @@
+from marshmallow import EXCLUDE, fields, validate
+
+from ma import ma
+
+
+class ProfileSessionSchema(ma.Schema):
+    # body of POST /admin/profile, see libs/profiler.py
+    class Meta:
+        unknown = EXCLUDE
+
+    seconds = fields.Float(missing=30, validate=validate.Range(min=0.1))
+    # share of the matching requests that are sampled
+    rate = fields.Float(missing=1.0, validate=validate.Range(min=0.001, max=1))
+    # url rules or endpoint names, empty for every route
+    routes = fields.List(fields.String(), missing=list)
+    interval_ms = fields.Float(validate=validate.Range(min=1, max=1000))
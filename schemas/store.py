@@ -1,13 +1,22 @@
+from libs.metrics import TimedSchemaMixin
 from ma import ma
 from models.store import StoreModel
 from models.item import ItemModel
 from schemas.item import ItemSchema
 
 
-class StoreSchema(ma.ModelSchema):
-    items = ma.Nested(ItemSchema, many=True)
+class StoreSchema(TimedSchemaMixin, ma.ModelSchema):
+    # loaded_items uses items bulk loaded by StoreModel.prefetch_items when available
+    items = ma.Nested(ItemSchema, many=True, attribute="loaded_items")
 
     class Meta:
         model = StoreModel
         dump_only = ("id",)
         include_fk = True
+
+
+class StoreStatsSchema(TimedSchemaMixin, ma.Schema):
+    # rows of StoreModel.find_stats
+    class Meta:
+        fields = ("id", "name", "item_count", "min_price", "max_price", "avg_price")
+        ordered = True
@@ -1,11 +1,9 @@
-from werkzeug.security import safe_str_cmp
-
 from models.user import UserModel
 
 
 def authenticate(username, password):
     user = UserModel.find_by_username(username)
-    if user and safe_str_cmp(user.password, password):
+    if user and user.check_password(password):
         return user
 
 
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# must be set before the app is imported, several modules read the environment at import
+os.environ.setdefault("APP_SECRET_KEY", "testing")
+os.environ.setdefault("MAILGUN_DOMAIN", "testing.example.com")
+os.environ.setdefault("MAILGUN_API_KEY", "testing-key")
+# every test request comes from one address, which the limits would throttle
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+# no background senders polling the test databases, queued mail stays in the outbox
+os.environ.setdefault("MAIL_DISPATCHER_WORKERS", "0")
+# the production cost makes every login take a few hundred milliseconds
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+TEST_PASSWORD = "test-password"
+
+
+@pytest.fixture
+def config():
+    # what create_app is given, tests needing another database override this fixture
+    return "testing"
+
+
+@pytest.fixture
+def app(config):
+    from app import create_app
+    from db import db
+    from libs.cache import CACHES
+
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+    # the row and identity caches are per process, ids repeat in the next database
+    for cache in CACHES.values():
+        cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user(app):
+    # a confirmed user that can log in with TEST_PASSWORD
+    from db import db
+    from libs.passwords import hash_password
+    from models.confirmation import ConfirmationModel
+    from models.user import UserModel
+
+    user = UserModel(
+        username="test", password=hash_password(TEST_PASSWORD), email="test@example.com"
+    )
+    user.confirmed = True
+    db.session.add(user)
+    db.session.flush()
+    confirmation = ConfirmationModel(user.id)
+    confirmation.confirmed = True
+    db.session.add(confirmation)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def tokens(client, user):
+    response = client.post(
+        "/login", json={"username": "test", "password": TEST_PASSWORD}
+    )
+    assert response.status_code == 200
+    return response.get_json()
+
+
+@pytest.fixture
+def auth(tokens):
+    return {"Authorization": f"Bearer {tokens['access_token']}"}
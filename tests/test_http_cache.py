@@ -0,0 +1,33 @@
+from models.item import ItemModel
+from models.store import StoreModel
+
+
+def create_item(name: str) -> None:
+    store = StoreModel(name="store")
+    store.save_to_db()
+    ItemModel(name=name, price=1.0, store_id=store.id).save_to_db()
+
+
+def test_matching_etag_is_not_modified(client):
+    create_item("item")
+    etag = client.get("/item/item").headers["ETag"]
+
+    response = client.get("/item/item", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_star_matches_an_existing_item(client):
+    create_item("item")
+
+    response = client.get("/item/item", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == client.get("/item/item").headers["ETag"]
+
+
+def test_star_does_not_hide_a_missing_item(client):
+    response = client.get("/item/missing", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 404
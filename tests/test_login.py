@@ -0,0 +1,43 @@
+import pytest
+
+from conftest import TEST_PASSWORD
+from libs import passwords
+from resources.user import INVALID_CREDENTIALS
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    # the hashes passed to the KDF, whatever the login was
+    hashes = []
+
+    def check_password_hash(stored, password):
+        hashes.append(stored)
+        return original(stored, password)
+
+    original = passwords.check_password_hash
+    monkeypatch.setattr(passwords, "check_password_hash", check_password_hash)
+    return hashes
+
+
+def login(client, username: str, password: str):
+    return client.post("/login", json={"username": username, "password": password})
+
+
+def test_wrong_password_is_hashed(client, user, verified):
+    response = login(client, "test", "wrong")
+
+    assert response.status_code == 401
+    assert verified == [user.password]
+
+
+def test_unknown_username_costs_a_hash(client, user, verified):
+    response = login(client, "nobody", TEST_PASSWORD)
+
+    assert response.status_code == 401
+    assert response.get_json() == {"message": INVALID_CREDENTIALS}
+    assert verified == [passwords._dummy_hash()]
+
+
+def test_dummy_hash_never_matches(app):
+    assert not passwords.reject_password("")
+    assert not passwords.reject_password(TEST_PASSWORD)
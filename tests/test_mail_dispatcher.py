@@ -0,0 +1,38 @@
+from time import time
+
+from db import db
+from libs.mail_dispatcher import MailDispatcher
+from models.outbox import MAX_ATTEMPTS, OutboxModel
+
+
+def queue(*recipients: str):
+    messages = [
+        OutboxModel(recipient, "subject", "text", "html", {"link": i})
+        for i, recipient in enumerate(recipients)
+    ]
+    db.session.add_all(messages)
+    db.session.commit()
+    return messages
+
+
+def test_batches_send_every_message_of_a_recipient(app):
+    messages = queue("a@example.com", "b@example.com", "a@example.com")
+
+    batches = list(MailDispatcher._batches(messages))
+
+    assert sorted(m.id for batch in batches for m in batch) == [m.id for m in messages]
+    for batch in batches:
+        assert len(MailDispatcher._recipients(batch)) == len(batch)
+
+
+def test_delete_finished_keeps_pending_messages(app):
+    sent, dead, retrying, pending = queue(*(f"{i}@example.com" for i in range(4)))
+    old = int(time()) - 100
+    sent.sent_at = old
+    dead.attempts, dead.next_attempt_at = MAX_ATTEMPTS, old
+    retrying.attempts, retrying.next_attempt_at = 1, old
+    db.session.commit()
+    remaining = {retrying.id, pending.id}
+
+    assert OutboxModel.delete_finished(50, batch_size=1) == 2
+    assert {m.id for m in OutboxModel.query} == remaining
@@ -0,0 +1,28 @@
+import pytest
+
+from config import TestingConfig
+
+
+class DeployedConfig(TestingConfig):
+    # the testing database without testing mode, as production runs
+    TESTING = False
+
+
+class TokenConfig(DeployedConfig):
+    METRICS_TOKEN = "secret"
+
+
+def test_served_in_testing(client):
+    assert client.get("/metrics").status_code == 200
+
+
+@pytest.mark.parametrize("config", [DeployedConfig])
+def test_not_served_without_a_token(client):
+    assert client.get("/metrics").status_code == 404
+
+
+@pytest.mark.parametrize("config", [TokenConfig])
+def test_token_required(client):
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
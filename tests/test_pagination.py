@@ -0,0 +1,34 @@
+import pytest
+
+from libs.pagination import INVALID_PAGE
+from models.item import ItemModel
+from models.store import StoreModel
+
+
+@pytest.fixture
+def items(app):
+    store = StoreModel(name="store")
+    store.save_to_db()
+    for i in range(3):
+        ItemModel(name=f"item-{i}", price=1.0, store_id=store.id).save_to_db()
+
+
+def test_pages_follow_the_cursor(client, items):
+    first = client.get("/items?limit=2").get_json()
+    second = client.get(f"/items?limit=2&after={first['next']}").get_json()
+
+    assert [item["name"] for item in first["items"] + second["items"]] == [
+        "item-0",
+        "item-1",
+        "item-2",
+    ]
+    assert second["next"] is None
+
+
+@pytest.mark.parametrize("query", ["after=abc", "limit=ten", "limit=2&after=1.5"])
+def test_malformed_page_arguments_are_rejected(client, auth, items, query):
+    for url in ("/items", "/stores", "/stores/stats"):
+        response = client.get(f"{url}?{query}", headers=auth)
+
+        assert response.status_code == 400
+        assert response.get_json() == {"message": INVALID_PAGE}
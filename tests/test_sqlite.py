@@ -0,0 +1,45 @@
+import pytest
+
+from config import TestingConfig
+from db import db
+from libs import sqlite
+
+
+@pytest.fixture
+def config(tmp_path):
+    # the tuning and the write lock are only used for SQLite files
+    class FileConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+    return FileConfig
+
+
+@pytest.fixture(autouse=True)
+def short_wait(monkeypatch):
+    # a lock that was never released fails the next writer after this long
+    monkeypatch.setenv("SQLITE_BUSY_TIMEOUT", "1")
+
+
+def write(connection) -> None:
+    with connection.begin():
+        connection.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+
+
+def test_checkin_releases_the_write_lock(app):
+    for _ in range(3):
+        with db.engine.connect() as connection:
+            write(connection)
+
+
+@pytest.mark.parametrize("drop", ["invalidate", "detach"])
+def test_dropped_connection_releases_the_write_lock(app, drop):
+    connection = db.engine.connect()
+    connection.begin()
+    assert sqlite._write_lock.locked()
+
+    getattr(connection, drop)()
+    connection.close()
+
+    assert not sqlite._write_lock.locked()
+    with db.engine.connect() as other:
+        write(other)
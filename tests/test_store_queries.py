@@ -0,0 +1,60 @@
+import pytest
+
+from db import db
+from libs.metrics import request_stats
+from models.item import ItemModel
+from models.store import StoreModel
+
+# more stores than the budget, so a query per store would show
+STORES = 5
+ITEMS_PER_STORE = 3
+
+
+@pytest.fixture(autouse=True)
+def no_http_cache(app):
+    # every GET builds its body, the warm up request would otherwise cache it
+    app.config["HTTP_CACHE_ENABLED"] = False
+
+
+def seed_stores():
+    for i in range(STORES):
+        store = StoreModel(name=f"store-{i}")
+        db.session.add(store)
+        db.session.flush()
+        for j in range(ITEMS_PER_STORE):
+            db.session.add(
+                ItemModel(name=f"item-{i}-{j}", price=1.0 + j, store_id=store.id)
+            )
+    db.session.commit()
+
+
+def queries(client, url: str, **kwargs) -> int:
+    # statements of the request as counted by libs/metrics.py, the test client runs
+    # the request on this thread
+    response = client.get(url, **kwargs)
+    assert response.status_code == 200
+    return request_stats.sql_queries
+
+
+def test_store_list_loads_items_in_one_query(app, client, auth):
+    # the stores, then the items of every store in one query
+    # (StoreModel.prefetch_items), the user comes from the identity cache
+    seed_stores()
+    client.get("/stores", headers=auth)  # first request runs the startup hooks
+
+    assert queries(client, "/stores", headers=auth) <= 2
+
+
+def test_store_list_queries_do_not_grow_with_stores(app, client, auth):
+    seed_stores()
+    client.get("/stores", headers=auth)
+    before = queries(client, "/stores", headers=auth)
+
+    store = StoreModel(name="one-more")
+    db.session.add(store)
+    db.session.flush()
+    db.session.add(ItemModel(name="one-more", price=1.0, store_id=store.id))
+    db.session.commit()
+
+    assert queries(client, "/stores", headers=auth) == before
+    assert len(client.get("/stores", headers=auth).get_json()["stores"]) == STORES + 1
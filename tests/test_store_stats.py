@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+import models.item
+from config import TestingConfig
+from db import db
+from libs.cache import LRUCache, cache_row
+from models.item import ItemModel
+from models.store import StoreModel
+from models.store_stats import StoreStatsModel
+
+
+def create_store(client, auth, name: str) -> int:
+    response = client.post(f"/store/{name}", headers=auth)
+    assert response.status_code == 201
+    return response.get_json()["id"]
+
+
+def create_item(client, auth, name: str, price: float, store_id: int) -> None:
+    response = client.post(
+        f"/item/{name}", json={"price": price, "store_id": store_id}, headers=auth
+    )
+    assert response.status_code == 201
+
+
+def reprice(client, auth, name: str, price: float, store_id: int) -> None:
+    response = client.put(
+        f"/item/{name}", json={"price": price, "store_id": store_id}, headers=auth
+    )
+    assert response.status_code == 200
+
+
+def test_stats_follow_item_writes(client, auth):
+    first = create_store(client, auth, "first")
+    second = create_store(client, auth, "second")
+    empty = create_store(client, auth, "empty")
+    for i in range(6):
+        create_item(client, auth, f"item-{i}", 10.0 + i, first)
+    create_item(client, auth, "cheap", 1.0, second)
+
+    # new minimum, new maximum and the old maximum repriced down
+    reprice(client, auth, "item-0", 0.5, first)
+    reprice(client, auth, "item-1", 99.0, first)
+    reprice(client, auth, "item-1", 12.5, first)
+    # moved with a new price and moved on its own
+    item = ItemModel.find_by_name("item-2")
+    item.store_id, item.price = second, 30.0
+    item.save_to_db()
+    response = client.post(
+        "/items/import",
+        json=[{"name": "item-3", "price": 13.0, "store_id": second}],
+        headers=auth,
+    )
+    assert response.get_json()["updated"] == 1
+    # the minimum and maximum deleted
+    assert client.delete("/item/item-0", headers=auth).status_code == 200
+    assert client.delete("/item/cheap", headers=auth).status_code == 200
+    client.delete("/store/empty", headers=auth)
+
+    assert StoreStatsModel.check() == []
+    assert StoreStatsModel.query.get(empty) is None
+    stats = StoreStatsModel.query.get(first)
+    assert (stats.item_count, stats.min_price, stats.max_price) == (3, 12.5, 15.0)
+
+
+def test_reprice_from_a_stale_cached_row(client, auth, monkeypatch):
+    # another worker repriced the item, this process still has the old row cached
+    monkeypatch.setattr(models.item, "item_cache", LRUCache())
+    store_id = create_store(client, auth, "store")
+    create_item(client, auth, "item", 10.0, store_id)
+    models.item.item_cache.set("item", cache_row(ItemModel.find_by_name("item")))
+    items = ItemModel.__table__
+    db.session.execute(items.update().where(items.c.name == "item").values(price=20.0))
+    StoreStatsModel.refresh(db.session.connection(), [store_id])
+    db.session.commit()
+
+    reprice(client, auth, "item", 30.0, store_id)
+
+    assert StoreStatsModel.check() == []
+    assert StoreStatsModel.query.get(store_id).price_sum == 30.0
+
+
+class TestConcurrentReprices:
+    @pytest.fixture
+    def config(self, tmp_path):
+        # the threads have to share the database, each would get its own in memory
+        class FileConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+
+        return FileConfig
+
+    def test_concurrent_reprices(self, app, client, auth):
+        store_id = create_store(client, auth, "store")
+        for name in ("item", "other"):
+            create_item(client, auth, name, 10.0, store_id)
+
+        # requests on this thread share the test's session, which holds the SQLite
+        # write lock until it lets go of its connection
+        db.session.remove()
+        errors = []
+
+        def writer(thread: int) -> None:
+            # the same item and another one of its store from every thread
+            try:
+                for i in range(10):
+                    reprice(client, auth, "item", 20.0 + thread * 10 + i, store_id)
+                    reprice(client, auth, "other", 1.0 + thread + i, store_id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert StoreStatsModel.check() == []
+        assert StoreStatsModel.query.get(store_id).item_count == 2
@@ -0,0 +1,27 @@
+from conftest import TEST_PASSWORD
+from libs.metrics import request_stats
+
+
+def test_user_get_query_budget(client, user):
+    # the user, then its confirmations for the "confirmation" field existing
+    # clients still read
+    client.get(f"/user/{user.id}")  # first request runs the startup hooks
+
+    response = client.get(f"/user/{user.id}")
+
+    assert response.status_code == 200
+    assert request_stats.sql_queries <= 2
+    body = response.get_json()
+    assert body["confirmed"] is True
+    assert len(body["confirmation"]) == 1
+
+
+def test_login_reads_only_the_user(client, user):
+    # users.confirmed instead of the most recent confirmation
+    login = {"username": "test", "password": TEST_PASSWORD}
+    client.post("/login", json=login)
+
+    response = client.post("/login", json=login)
+
+    assert response.status_code == 200
+    assert request_stats.sql_queries <= 1